@@ -252,9 +252,9 @@ app.post('/api/detect-ulcers', upload.single('file'), async (req, res) => {
 
 app.post('/api/classify-regions', express.json(), async (req, res) => {
     try {
-        const { imagem_redimensionada, boxes_finais } = req.body;
+        const { imagem_redimensionada, imagem_id, boxes_finais } = req.body;
 
-        if (!imagem_redimensionada || !boxes_finais) {
+        if ((!imagem_redimensionada && !imagem_id) || !boxes_finais) {
             return res.status(400).json({
                 success: false,
                 message: 'Dados insuficientes para classificação'
@@ -264,12 +264,18 @@ app.post('/api/classify-regions', express.json(), async (req, res) => {
         console.log(`--- Etapa 2: Classificando ${boxes_finais.length} regiões... ---`);
 
         // 1. Preparar dados para o servidor Python
-        const imageBuffer = Buffer.from(imagem_redimensionada, 'base64');
+        // Com imagem_id o Python reaproveita a imagem da detecção (sem novo upload)
         const formClassification = new FormData();
-        formClassification.append('file', stream.Readable.from(imageBuffer), {
-            filename: 'ulcera_analise.jpg',
-            contentType: 'image/jpeg'
-        });
+        if (imagem_redimensionada) {
+            const imageBuffer = Buffer.from(imagem_redimensionada, 'base64');
+            formClassification.append('file', stream.Readable.from(imageBuffer), {
+                filename: 'ulcera_analise.jpg',
+                contentType: 'image/jpeg'
+            });
+        }
+        if (imagem_id) {
+            formClassification.append('imagem_id', imagem_id);
+        }
         formClassification.append('deteccoes_json', JSON.stringify(boxes_finais));
 
         // 2. Chamar o servidor Python
@@ -322,6 +328,64 @@ app.post('/api/classify-regions', express.json(), async (req, res) => {
     }
 });
 
+/**
+ * Endpoint da edição de regiões: recorte e classificação só das caixas alteradas.
+ * Recebe o imagem_id da detecção (ou o imagem_blob), as regiões atuais e o delta
+ * da edição ({ adicionadas, movidas, removidas }); a imagem não é reenviada.
+ */
+
+app.post('/api/edit-regions', express.json(), async (req, res) => {
+    try {
+        const { imagem_id, imagem_blob, regioes = [], delta, crops = 'thumb' } = req.body;
+
+        if ((!imagem_id && !imagem_blob) || !delta) {
+            return res.status(400).json({
+                success: false,
+                message: 'Dados insuficientes para a edição de regiões'
+            });
+        }
+
+        const formRegions = new FormData();
+        if (imagem_id) {
+            formRegions.append('imagem_id', imagem_id);
+        }
+        if (imagem_blob) {
+            formRegions.append('imagem_blob', imagem_blob);
+        }
+        formRegions.append('regioes_json', JSON.stringify(regioes));
+        formRegions.append('delta_json', JSON.stringify(delta));
+
+        const responseRegions = await axios.post(`${PYTHON_API_BASE_URL}/predict/regions`, formRegions, {
+            headers: { ...formRegions.getHeaders() },
+            params: { crops },
+            timeout: 30000
+        });
+
+        res.json({
+            success: true,
+            ...responseRegions.data
+        });
+
+    } catch (error) {
+        console.error('❌ Erro na edição de regiões:', {
+            message: error.message,
+            status: error.response?.status,
+            data: error.response?.data
+        });
+
+        let errorMessage = error.message;
+        let statusCode = 500;
+        if (error.response) {
+            statusCode = error.response.status;
+            errorMessage = error.response.data?.detail || error.response.statusText || error.message;
+        } else if (error.request) {
+            errorMessage = 'Servidor de IA não está respondendo para a edição de regiões';
+            statusCode = 503;
+        }
+        res.status(statusCode).json({ success: false, message: errorMessage });
+    }
+});
+
 
 
 app.post('/api/save-analysis', express.json(), async (req, res) => {
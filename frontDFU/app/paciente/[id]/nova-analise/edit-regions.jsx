@@ -4,6 +4,7 @@ import {
 } from 'react-native';
 import { useLocalSearchParams, router } from 'expo-router';
 import { Ionicons } from '@expo/vector-icons';
+import API_CONFIG, { buildURL } from '../../../../config/api';
 
 // ... (constantes e a maior parte do código permanecem os mesmos)
 
@@ -16,6 +17,7 @@ export default function EditRegionsScreen() {
   const params = useLocalSearchParams();
   const pacienteId = params.id;
   const detectedImageBase64 = params.imageBase64;
+  const imagemId = params.imagemId;
   const initialBoxes = useMemo(() => (params.boxes ? JSON.parse(params.boxes) : []), [params.boxes]);
   const imageInfo = params.imageInfo ? JSON.parse(params.imageInfo) : {};
   // Tamanho da imagem exibida (a redimensionada+padding vinda da API)
@@ -81,6 +83,51 @@ export default function EditRegionsScreen() {
     setActualImageLayout({ width: actualWidth, height: actualHeight, offsetX, offsetY });
   };
 
+  // Coordenadas da tela -> coordenadas da imagem redimensionada (final_size) da API
+  const paraCoordenadasImagem = (box) => {
+    const scaleX = actualImageLayout.width / (finalSize.width || 416);
+    const scaleY = actualImageLayout.height / (finalSize.height || 416);
+    return {
+      xmin: Math.round(box.xmin / scaleX),
+      ymin: Math.round(box.ymin / scaleY),
+      xmax: Math.round(box.xmax / scaleX),
+      ymax: Math.round(box.ymax / scaleY),
+    };
+  };
+
+  // Recorte da caixa nova/ajustada gerado no servidor a partir do imagem_id (sem reenviar a imagem)
+  const gerarRecorte = async (box) => {
+    if (!imagemId || !actualImageLayout) return;
+    try {
+      const response = await fetch(buildURL(API_CONFIG.ENDPOINTS.EDIT_REGIONS), {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ imagem_id: imagemId, delta: { adicionadas: [paraCoordenadasImagem(box)] } }),
+      });
+      if (!response.ok) return;
+      const data = await response.json();
+      const [regiao] = data.resultados || [];
+      if (!regiao) return;
+      // Ignora a resposta se a caixa mudou de novo enquanto isso
+      setBoxes(prev => prev.map(b => (
+        b.id === box.id && b.xmin === box.xmin && b.ymin === box.ymin && b.xmax === box.xmax && b.ymax === box.ymax
+          ? { ...b, subimagem: regiao.subimagem }
+          : b
+      )));
+    } catch (error) {
+      console.warn('Não foi possível gerar o recorte da região:', error);
+    }
+  };
+
+  const finalizarAjuste = (boxId) => {
+    const inicial = gestureStartState.box;
+    gestureStartState.box = null;
+    const atual = boxesRef.current.find(b => b.id === boxId);
+    if (inicial && atual && ['xmin', 'ymin', 'xmax', 'ymax'].some(campo => atual[campo] !== inicial[campo])) {
+      gerarRecorte(atual);
+    }
+  };
+
   const handleAddBox = () => {
     if (!actualImageLayout) return;
     const { width, height } = actualImageLayout;
@@ -93,6 +140,7 @@ export default function EditRegionsScreen() {
     };
     setBoxes(prev => [...prev, newBox]);
     setSelectedBoxId(newBox.id);
+    gerarRecorte(newBox);
   };
 
   const handleRemoveBox = (boxId) => {
@@ -133,7 +181,7 @@ export default function EditRegionsScreen() {
       },
       onPanResponderRelease: () => {
         setIsInteractingWithBox(false);
-        gestureStartState.box = null;
+        finalizarAjuste(boxId);
       },
     });
 
@@ -171,7 +219,7 @@ export default function EditRegionsScreen() {
       },
       onPanResponderRelease: () => {
         setIsInteractingWithBox(false);
-        gestureStartState.box = null;
+        finalizarAjuste(boxId);
       },
     });
 
@@ -179,20 +227,10 @@ export default function EditRegionsScreen() {
     if (boxes.length === 0) { Alert.alert('Atenção', 'Adicione pelo menos uma região.'); return; }
     if (!actualImageLayout) { Alert.alert('Erro', 'Aguarde a imagem carregar.'); return; }
     
-  const sourceW = finalSize.width || 416;
-  const sourceH = finalSize.height || 416;
-  const scaleX = actualImageLayout.width / sourceW;
-  const scaleY = actualImageLayout.height / sourceH;
-    const unscaledBoxes = boxes.map(box => ({
-      ...box,
-      xmin: Math.round(box.xmin / scaleX),
-      ymin: Math.round(box.ymin / scaleY),
-      xmax: Math.round(box.xmax / scaleX),
-      ymax: Math.round(box.ymax / scaleY),
-    }));
+    const unscaledBoxes = boxes.map(box => ({ ...box, ...paraCoordenadasImagem(box) }));
     router.push({
       pathname: `/paciente/${pacienteId}/nova-analise/results`,
-      params: { id: pacienteId, imageBase64: detectedImageBase64, boxes: JSON.stringify(unscaledBoxes), imageInfo: JSON.stringify(imageInfo), originalUri },
+      params: { id: pacienteId, imageBase64: detectedImageBase64, imagemId, boxes: JSON.stringify(unscaledBoxes), imageInfo: JSON.stringify(imageInfo), originalUri },
     });
   };
 
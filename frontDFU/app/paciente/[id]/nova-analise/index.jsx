@@ -169,6 +169,7 @@ export default function NovaAnaliseIndex() {
             params: {
               id: pacienteId,
               imageBase64: data.imagem_redimensionada,
+              imagemId: data.imagem_id || '',
               boxes: JSON.stringify(data.boxes),
               imageInfo: JSON.stringify(data.dimensoes || {}),
               originalUri: originalImageUri,
@@ -17,6 +17,7 @@ export default function ResultsScreen() {
   const params = useLocalSearchParams();
   const pacienteId = params.id;
   const detectedImageBase64 = params.imageBase64;
+  const imagemId = params.imagemId;
   const boxes = params.boxes ? JSON.parse(params.boxes) : [];
   const imageInfo = params.imageInfo ? JSON.parse(params.imageInfo) : {};
   const originalUri = params.originalUri;
@@ -36,21 +37,31 @@ export default function ResultsScreen() {
     handleProceedToClassification();
   }, []);
 
+  const enviarClassificacao = (classificacaoData) =>
+    fetch(buildURL(API_CONFIG.ENDPOINTS.CLASSIFY_REGIONS), {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(classificacaoData),
+    });
+
   const handleProceedToClassification = async () => {
     setIsProcessing(true);
     try {
       const classificacaoData = {
-        imagem_redimensionada: detectedImageBase64,
         boxes_finais: boxes,
         medico_id: auth.currentUser?.uid,
         paciente_id: pacienteId,
       };
 
-      const response = await fetch(buildURL(API_CONFIG.ENDPOINTS.CLASSIFY_REGIONS), {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(classificacaoData),
-      });
+      // Com imagem_id o servidor reaproveita a imagem da detecção (sem reenviar o base64)
+      let response = imagemId
+        ? await enviarClassificacao({ ...classificacaoData, imagem_id: imagemId })
+        : await enviarClassificacao({ ...classificacaoData, imagem_redimensionada: detectedImageBase64 });
+
+      if (response.status === 410) {
+        // Sessão da imagem expirou no servidor: reenviar a imagem
+        response = await enviarClassificacao({ ...classificacaoData, imagem_redimensionada: detectedImageBase64 });
+      }
 
       if (!response.ok) {
         const errorText = await response.text();
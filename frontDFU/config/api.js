@@ -16,6 +16,7 @@ const API_CONFIG = {
   // alias para compatibilidade
   DETECT_ULCERS: '/api/detect-ulcers',
     CLASSIFY_REGIONS: '/api/classify-regions',
+    EDIT_REGIONS: '/api/edit-regions',
     SAVE_ANALYSIS: '/api/save-analysis',
   },
   
@@ -0,0 +1,334 @@
+"""
+Análise em lote (offline) de um acervo de fotos, sem passar pela API HTTP.
+
+    python analise_lote.py fotos/ -o resultados.jsonl
+    python analise_lote.py --manifesto lista.txt -o resultados.jsonl --lote 64
+    python analise_lote.py fotos/ -o resultados.jsonl --parquet resultados.parquet
+
+Usa o mesmo carregamento (`carregar_modelo_yolo`, `carregar_modelo_classificacao`)
+e o mesmo pré-processamento da API, então o resultado de cada imagem é o de
+/predict/full (detecções no espaço da imagem redimensionada, com `resize_info`).
+
+As fotos são lidas, identificadas (SHA-256) e decodificadas por um pool de
+processos (--decodificadores, padrão: todos os núcleos) que trabalha
+--prefetch lotes à frente da inferência; o processo principal roda o YOLO
+em lotes de --lote imagens (um forward pass por lote) e o classificador com
+os recortes de todas as imagens do lote juntos.
+
+Entrada: uma pasta (busca recursiva por .jpg/.jpeg/.png/.bmp/.webp) ou um
+manifesto (--manifesto) com um caminho por linha ou linhas JSON com
+`caminho` (os demais campos são copiados em `manifesto`); caminhos
+relativos são relativos ao manifesto.
+
+Saída JSONL: uma linha por imagem (caminho, sha256, resize_info,
+resultados, versões dos modelos, ou `erro`), gravada ao fim de cada lote.
+O próprio arquivo é o checkpoint: rodar de novo com a mesma saída pula as
+imagens já presentes (a última linha, se cortada por uma interrupção, é
+descartada). --parquet converte o JSONL ao final em uma tabela colunar com
+uma linha por detecção (requer pyarrow).
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from cache_resultados import digest_conteudo
+from processamento_imagem import preparar_imagem_cronometrada
+
+logger = logging.getLogger("analise_lote")
+
+EXTENSOES = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+# ========================================
+# ENTRADA E CHECKPOINT
+# ========================================
+def listar_pasta(pasta):
+    """Imagens da pasta (recursivo), em ordem estável"""
+    for caminho in sorted(Path(pasta).rglob("*")):
+        if caminho.suffix.lower() in EXTENSOES and caminho.is_file():
+            yield str(caminho), None
+
+
+def ler_manifesto(manifesto):
+    """(caminho, campos extras) de cada linha: um caminho ou um objeto JSON com `caminho`"""
+    base = Path(manifesto).resolve().parent
+    with open(manifesto, encoding="utf-8") as arquivo:
+        for numero, linha in enumerate(arquivo, 1):
+            linha = linha.strip()
+            if not linha or linha.startswith("#"):
+                continue
+            extras = None
+            if linha.startswith("{"):
+                extras = json.loads(linha)
+                if "caminho" not in extras:
+                    raise ValueError(f"{manifesto}:{numero}: linha JSON sem `caminho`")
+                linha = extras.pop("caminho")
+            caminho = Path(linha)
+            yield str(caminho if caminho.is_absolute() else base / caminho), extras or None
+
+
+def carregar_checkpoint(saida):
+    """Caminhos já presentes na saída e as versões de modelo usadas neles
+
+    Uma última linha sem `\\n` (escrita interrompida) é removida do arquivo.
+    """
+    concluidos, versoes = set(), set()
+    if not saida.exists():
+        return concluidos, versoes
+
+    with open(saida, "rb") as arquivo:
+        dados = arquivo.read()
+    completo = dados.rfind(b"\n") + 1
+    if completo != len(dados):
+        logger.warning(f"✂️ Descartando linha incompleta no fim de {saida}")
+        os.truncate(saida, completo)
+
+    for linha in dados[:completo].splitlines():
+        registro = json.loads(linha)
+        concluidos.add(registro["caminho"])
+        if registro.get("modelos"):
+            versoes.add(json.dumps(registro["modelos"], sort_keys=True))
+    return concluidos, versoes
+
+
+# ========================================
+# DECODIFICAÇÃO (pool de processos)
+# ========================================
+def decodificar(caminho, tamanho, reduzir):
+    """Lê, identifica e prepara uma imagem para o YOLO (roda no pool; só PIL/NumPy/OpenCV)"""
+    try:
+        with open(caminho, "rb") as arquivo:
+            contents = arquivo.read()
+        img, info, _ = preparar_imagem_cronometrada(contents, tamanho, reduzir)
+        return {"sha256": digest_conteudo(contents), "bytes": len(contents), "imagem": img, "resize_info": info}
+    except Exception as e:
+        return {"erro": f"{type(e).__name__}: {e}"}
+
+
+def decodificar_em_lotes(entradas, pool, tamanho, reduzir, lote, prefetch):
+    """Lotes de (caminho, extras, imagem decodificada), mantendo `prefetch` lotes em decodificação à frente"""
+    pendentes = deque()
+    entradas = iter(entradas)
+    esgotado = False
+    while True:
+        while not esgotado and len(pendentes) < lote * (prefetch + 1):
+            try:
+                caminho, extras = next(entradas)
+            except StopIteration:
+                esgotado = True
+                break
+            pendentes.append((caminho, extras, pool.submit(decodificar, caminho, tamanho, reduzir)))
+        if not pendentes:
+            return
+        atual = [pendentes.popleft() for _ in range(min(lote, len(pendentes)))]
+        yield [(caminho, extras, futuro.result()) for caminho, extras, futuro in atual]
+
+
+# ========================================
+# INFERÊNCIA
+# ========================================
+def analisar_lote(api_ia, decodificadas, tamanho, lote_classificacao, tempos):
+    """Detecção de todas as imagens em um forward pass e classificação de todos os recortes juntos
+
+    Retorna, para cada imagem decodificada, a lista de resultados no formato de /predict/full.
+    """
+    import numpy as np
+
+    inicio = time.perf_counter()
+    results = api_ia.detectar_lote([(d["imagem"], tamanho) for d in decodificadas])
+    deteccoes = [api_ia.processar_deteccoes_yolo(r, api_ia.YOLO_CONFIG["conf"]) for r in results]
+    tempos["yolo"] += time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    caixas = [list(dict.fromkeys(api_ia.chave_caixa(det) for det in dets)) for dets in deteccoes]
+    recortes = [
+        api_ia.recortar_e_preprocessar(d["imagem"], unicas)
+        for d, unicas in zip(decodificadas, caixas) if unicas
+    ]
+    tempos["preprocessamento"] += time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    preds = np.zeros((0, len(api_ia.LABEL_COLS)), dtype=np.float32)
+    if recortes:
+        recortes = np.concatenate(recortes)
+        preds = np.concatenate([
+            np.asarray(api_ia.classificar_lote(recortes[i:i + lote_classificacao]))
+            for i in range(0, len(recortes), lote_classificacao)
+        ])
+    tempos["classificacao"] += time.perf_counter() - inicio
+
+    saida, posicao = [], 0
+    for dets, unicas in zip(deteccoes, caixas):
+        classificadas = {}
+        for caixa, pred in zip(unicas, preds[posicao:posicao + len(unicas)]):
+            classificadas[caixa] = {
+                "classe_classificacao": api_ia.LABEL_COLS[int(np.argmax(pred))],
+                "confianca_classificacao": float(np.max(pred)),
+            }
+        posicao += len(unicas)
+        resultados = []
+        for det in dets:
+            caixa = api_ia.chave_caixa(det)
+            xmin, ymin, xmax, ymax = caixa
+            resultados.append({
+                "xmin": xmin,
+                "ymin": ymin,
+                "xmax": xmax,
+                "ymax": ymax,
+                "classe_deteccao": det.get("classe"),
+                "confianca_deteccao": det.get("confianca"),
+                **classificadas[caixa],
+            })
+        saida.append(resultados)
+    return saida
+
+
+# ========================================
+# SAÍDA COLUNAR
+# ========================================
+def converter_parquet(saida, destino):
+    """JSONL -> Parquet com uma linha por detecção (imagens sem detecção ou com erro: uma linha com nulos)"""
+    import pandas as pd
+
+    linhas = []
+    with open(saida, encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            registro = json.loads(linha)
+            base = {
+                "caminho": registro["caminho"],
+                "sha256": registro.get("sha256"),
+                "erro": registro.get("erro"),
+                "versao_deteccao": (registro.get("modelos") or {}).get("deteccao"),
+                "versao_classificacao": (registro.get("modelos") or {}).get("classificacao"),
+            }
+            resultados = registro.get("resultados") or [{}]
+            for indice, resultado in enumerate(resultados):
+                linhas.append({**base, "deteccao": indice if resultado else None, **resultado})
+
+    pd.DataFrame(linhas).to_parquet(destino, index=False)
+    logger.info(f"🧱 {len(linhas)} linhas em {destino}")
+
+
+# ========================================
+# MAIN
+# ========================================
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pasta", nargs="?", help="Pasta com as imagens (recursivo)")
+    parser.add_argument("--manifesto", help="Arquivo com um caminho (ou objeto JSON com `caminho`) por linha")
+    parser.add_argument("-o", "--saida", required=True, help="Arquivo JSONL de saída (e checkpoint)")
+    parser.add_argument("--lote", type=int, default=32, help="Imagens por forward pass do YOLO")
+    parser.add_argument("--lote-classificacao", type=int, default=128, help="Recortes por forward pass do classificador")
+    parser.add_argument("--decodificadores", type=int, default=os.cpu_count(), help="Processos de decodificação")
+    parser.add_argument("--prefetch", type=int, default=2, help="Lotes decodificados à frente da inferência")
+    parser.add_argument("--tamanho", type=int, help="Tamanho de entrada do YOLO (padrão: o da API)")
+    parser.add_argument("--limite", type=int, help="Processa no máximo N imagens novas")
+    parser.add_argument("--parquet", help="Converte a saída em Parquet ao final")
+    args = parser.parse_args()
+
+    if bool(args.pasta) == bool(args.manifesto):
+        parser.error("informe uma pasta ou --manifesto")
+    if args.parquet:
+        # Antes de processar o acervo, não só na conversão final
+        try:
+            import pandas  # noqa: F401
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            parser.error(f"--parquet requer pandas e pyarrow: {e}")
+
+    # Importado só aqui: os processos de decodificação (spawn) importam este módulo sem os frameworks
+    import asyncio
+    import api_ia
+
+    asyncio.run(api_ia.carregar_modelo_yolo())
+    asyncio.run(api_ia.carregar_modelo_classificacao())
+    api_ia.atualizar_versao_modelos()
+    modelos = {
+        **api_ia.VERSAO_MODELOS,
+        "detector": api_ia.DETECTOR_INFO["name"],
+        "classificador": api_ia.CLASSIFIER_INFO["name"],
+    }
+    tamanho = args.tamanho or getattr(api_ia.modelo_yolo, "tamanho", api_ia.controle_qualidade.degrau("high")[0])
+    reduzir = api_ia.UPLOAD_CONFIG["jpeg_draft"]
+
+    saida = Path(args.saida)
+    saida.parent.mkdir(parents=True, exist_ok=True)
+    concluidos, versoes = carregar_checkpoint(saida)
+    if concluidos:
+        logger.info(f"⏩ Retomando: {len(concluidos)} imagens já em {saida}")
+    if versoes - {json.dumps(modelos, sort_keys=True)}:
+        logger.warning("⚠️ A saída tem resultados de outra versão dos modelos; use outro arquivo para reprocessar o acervo")
+
+    entradas = listar_pasta(args.pasta) if args.pasta else ler_manifesto(args.manifesto)
+    entradas = (e for e in entradas if e[0] not in concluidos)
+    if args.limite:
+        entradas = (e for _, e in zip(range(args.limite), entradas))
+
+    tempos = {"espera_decodificacao": 0.0, "yolo": 0.0, "preprocessamento": 0.0, "classificacao": 0.0, "escrita": 0.0}
+    total = erros = deteccoes = 0
+    inicio = ultimo_relatorio = time.perf_counter()
+    logger.info(f"🚚 Analisando em lotes de {args.lote} ({tamanho} px, {args.decodificadores} decodificadores)")
+
+    # spawn: os processos não herdam as threads do TensorFlow/PyTorch já carregados
+    with ProcessPoolExecutor(max_workers=max(1, args.decodificadores),
+                             mp_context=multiprocessing.get_context("spawn")) as pool, \
+            open(saida, "a", encoding="utf-8") as arquivo:
+        lotes = decodificar_em_lotes(entradas, pool, tamanho, reduzir, max(1, args.lote), max(0, args.prefetch))
+        while True:
+            espera = time.perf_counter()
+            lote = next(lotes, None)
+            tempos["espera_decodificacao"] += time.perf_counter() - espera
+            if lote is None:
+                break
+
+            validas = [d for _, _, d in lote if "erro" not in d]
+            resultados = iter(analisar_lote(api_ia, validas, tamanho, args.lote_classificacao, tempos) if validas else [])
+
+            escrita = time.perf_counter()
+            for caminho, extras, decodificada in lote:
+                registro = {"caminho": caminho}
+                if extras:
+                    registro["manifesto"] = extras
+                if "erro" in decodificada:
+                    registro["erro"] = decodificada["erro"]
+                    erros += 1
+                else:
+                    registro.update(
+                        sha256=decodificada["sha256"],
+                        bytes=decodificada["bytes"],
+                        resize_info=decodificada["resize_info"],
+                        resultados=next(resultados),
+                        modelos=modelos,
+                    )
+                    deteccoes += len(registro["resultados"])
+                arquivo.write(json.dumps(registro, ensure_ascii=False, separators=(",", ":")) + "\n")
+            # Checkpoint: o lote inteiro no disco antes do próximo
+            arquivo.flush()
+            tempos["escrita"] += time.perf_counter() - escrita
+
+            total += len(lote)
+            agora = time.perf_counter()
+            if agora - ultimo_relatorio >= 10:
+                ultimo_relatorio = agora
+                logger.info(f"📦 {total} imagens ({total / (agora - inicio):.1f} img/s), {erros} erros")
+
+    duracao = time.perf_counter() - inicio
+    print("\n" + "="*60)
+    print(f"✅ {total} imagens em {duracao:.1f}s: {total / duracao if duracao else 0:.1f} img/s")
+    print(f"   {deteccoes} detecções, {erros} erros, {len(concluidos)} já processadas antes")
+    for etapa, segundos in tempos.items():
+        print(f"   {etapa:<22} {segundos:>8.2f}s")
+    print("="*60 + "\n")
+
+    if args.parquet:
+        converter_parquet(saida, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,97 @@
+import time
+import gc
+import hmac
+_INICIO_IMPORT = time.perf_counter()
+
 import os
-import torch
+import shutil
+import threading
 import pathlib
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Response
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Response, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.resnet50 import preprocess_input as resnet_preprocess
-import io
-from PIL import Image
-import base64
 import json
 import logging
 import asyncio
 from pathlib import Path
-import requests
 import re
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
 import psutil
-import time
+from micro_batching import MicroBatcher, concatenar_e_dividir
+from executor_inferencia import ExecutorInferencia, FilaCheia, cronometrar, server_timing
+from processamento_imagem import preparar_imagem_cronometrada, codificar_jpeg, codificar_recortes, MODOS_RECORTE
+from preprocessamento import decodificar_rgb, montar_lote, montar_lote_recortes
+from mosaico import METODOS_FUSAO, preparar_mosaico, unir_mosaico
+from qualidade import QUALIDADES, ControladorQualidade, ler_escada
+from fila_trabalhos import FINAIS, FilaTrabalhos
+from armazenamento_blobs import ArmazenamentoBlobs, intervalo_bytes
+from tta import agregar, expandir_lote, ler_vistas
+from indice_embeddings import IndiceEmbeddings, id_paciente_valido
+from registro_modelos import (
+    RegistroModelos, RoteamentoModelos, gravar_estado, ler_estado, nome_versao_valido, rotear,
+    versoes_requisicao
+)
+from uploads import LimiteUpload, ler_upload
+from metricas import (
+    MetricasHTTP, exportar, medidores_processo, observar_etapas, observar_memoria, observar_modelo, registrar_estado
+)
+from memoria import MB, GovernadorMemoria, dimensoes_imagem, estimar_bytes, ram_disponivel
+from sessoes_imagem import ArmazemSessoes, chave_caixa
+from cache_resultados import CacheResultados, chave_cache, digest_conteudo
+from respostas import escolher_formato, renderizar
+from backends_inferencia import (
+    BACKENDS, RELATORIO_QUANTIZACAO, ClassificadorONNX, DetectorONNX, DetectorTorchScript,
+    caminho_compartilhado, caminho_variante, hash_arquivo, selecionar_variante
+)
 
 # ============================================
 # 🚀 AUTO-DETECÇÃO E CONFIGURAÇÃO DE HARDWARE
 # ============================================
+def gpu_nvidia_presente():
+    """Verificação leve do driver NVIDIA (sem importar PyTorch/TensorFlow)"""
+    if os.getenv("CUDA_VISIBLE_DEVICES") in ("", "-1"):
+        return False
+    return Path("/proc/driver/nvidia/version").exists() or shutil.which("nvidia-smi") is not None
+
 def configurar_hardware():
-    """Detecta automaticamente GPU/CPU e otimiza"""
-    cpu_threads = os.cpu_count()
+    """Detecta automaticamente GPU/CPU e otimiza
+    
+    Não importa os frameworks: a GPU é confirmada e TensorFlow/PyTorch são
+    configurados em `importar_torch` / `importar_tensorflow`, no primeiro uso.
+    """
+    cpu_threads_total = os.cpu_count()
     ram_gb = psutil.virtual_memory().total / (1024**3)
-    gpu_disponivel = torch.cuda.is_available()
+    gpu_disponivel = gpu_nvidia_presente()
+    
+    # Com vários workers (servidor_prefork.py), cada um usa sua fatia dos núcleos
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    cpu_threads = max(1, cpu_threads_total // workers)
     
     print("\n" + "="*60)
     print("🔍 DETECTANDO HARDWARE")
     print("="*60)
-    print(f"💻 CPU: {psutil.cpu_count(logical=False)} cores / {cpu_threads} threads")
+    print(f"💻 CPU: {psutil.cpu_count(logical=False)} cores / {cpu_threads_total} threads")
     print(f"💾 RAM: {ram_gb:.1f}GB")
+    if workers > 1:
+        print(f"👥 Workers: {workers} ({cpu_threads} threads cada)")
     
     if gpu_disponivel:
-        gpu_name = torch.cuda.get_device_name(0)
-        gpu_memory = torch.cuda.get_device_properties(0).total_memory / (1024**3)
-        print(f"🎮 GPU: {gpu_name}")
-        print(f"💾 VRAM: {gpu_memory:.1f}GB")
-        print(f"✅ Modo: GPU ACELERADA")
-        
-        # Configurar TensorFlow GPU
-        gpus = tf.config.list_physical_devices('GPU')
-        if gpus:
-            for gpu in gpus:
-                tf.config.experimental.set_memory_growth(gpu, True)
+        print("🎮 GPU: driver NVIDIA detectado")
+        print("✅ Modo: GPU ACELERADA")
         
         target_size = 640
         device = 'cuda'
     else:
-        print(f"⚠️  GPU NVIDIA: Não detectada")
-        print(f"✅ Modo: CPU OTIMIZADA (Multi-thread)")
+        print("⚠️  GPU NVIDIA: Não detectada")
+        print("✅ Modo: CPU OTIMIZADA (Multi-thread)")
         
-        # Otimizar TensorFlow para CPU
+        # Otimizar TensorFlow para CPU (lido quando o TensorFlow for importado)
         os.environ['OMP_NUM_THREADS'] = str(cpu_threads)
         os.environ['TF_NUM_INTRAOP_THREADS'] = str(cpu_threads)
         os.environ['TF_NUM_INTEROP_THREADS'] = '2'
         
-        tf.config.threading.set_inter_op_parallelism_threads(2)
-        tf.config.threading.set_intra_op_parallelism_threads(cpu_threads)
-        
         target_size = 416  # Menor = mais rápido em CPU
         device = 'cpu'
     
@@ -72,9 +102,15 @@ def configurar_hardware():
         'gpu_disponivel': gpu_disponivel,
         'target_size': target_size,
         'cpu_threads': cpu_threads,
+        'cpu_threads_total': cpu_threads_total,
+        'workers': workers,
         'ram_gb': ram_gb
     }
 
+# Tempos de import/carregamento por fase (ms), impressos com --startup-profile
+PERFIL_INICIALIZACAO = {}
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") != "0"
+
 # Executar configuração
 HARDWARE_CONFIG = configurar_hardware()
 
@@ -102,11 +138,65 @@ def fix_yolo_deployment():
 
 fix_yolo_deployment()
 
+# ========================================
+# IMPORTS SOB DEMANDA (TensorFlow / PyTorch)
+# ========================================
+# Importados só quando um modelo nativo é carregado: com INFERENCE_BACKEND=onnx
+# nenhum dos dois é importado.
+tf = None
+torch = None
+_lock_tf = threading.Lock()
+_lock_torch = threading.Lock()
+
+def importar_tensorflow():
+    """Importa e configura o TensorFlow no primeiro uso"""
+    global tf
+    with _lock_tf:
+        if tf is None:
+            with cronometrar(PERFIL_INICIALIZACAO, "import_tensorflow"):
+                import tensorflow as modulo
+            
+            if HARDWARE_CONFIG['device'] == 'cuda':
+                for gpu in modulo.config.list_physical_devices('GPU'):
+                    modulo.config.experimental.set_memory_growth(gpu, True)
+            else:
+                modulo.config.threading.set_inter_op_parallelism_threads(2)
+                modulo.config.threading.set_intra_op_parallelism_threads(HARDWARE_CONFIG['cpu_threads'])
+            tf = modulo
+    return tf
+
+def importar_torch():
+    """Importa o PyTorch no primeiro uso e confirma a GPU"""
+    global torch
+    with _lock_torch:
+        if torch is None:
+            with cronometrar(PERFIL_INICIALIZACAO, "import_torch"):
+                import torch as modulo
+            
+            if HARDWARE_CONFIG['device'] == 'cuda':
+                if modulo.cuda.is_available():
+                    gpu_memory = modulo.cuda.get_device_properties(0).total_memory / (1024**3)
+                    logger.info(f"🎮 GPU: {modulo.cuda.get_device_name(0)} ({gpu_memory:.1f}GB VRAM)")
+                else:
+                    logger.warning("⚠️ Driver NVIDIA presente, mas PyTorch sem CUDA: usando CPU")
+                    HARDWARE_CONFIG.update(device='cpu', gpu_disponivel=False, target_size=416)
+            torch = modulo
+    return torch
+
 # ========================================
 # FASTAPI
 # ========================================
 app = FastAPI(title="Medical AI API", version="2.0.0")
 
+# Uploads: limite em bytes (413 acima dele) e decode reduzido de JPEGs grandes
+UPLOAD_CONFIG = {
+    "max_bytes": int(float(os.getenv("UPLOAD_MAX_MB", "20")) * 1024 * 1024),
+    "jpeg_draft": os.getenv("JPEG_DRAFT", "1") != "0",
+}
+app.add_middleware(LimiteUpload, max_bytes=UPLOAD_CONFIG["max_bytes"])
+# Último adicionado = mais externo: conta também os 413 do limite de upload
+app.add_middleware(MetricasHTTP)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -119,21 +209,282 @@ app.add_middleware(
 # VARIÁVEIS GLOBAIS
 # ========================================
 modelo_classificacao = None
+classificador_compilado = None
+extrator_embeddings = None  # (probabilidades, embeddings da penúltima camada) no mesmo forward pass
 modelo_yolo = None
 LABEL_COLS = ['none', 'infection', 'ischaemia', 'both']
-CLASSIFIER_INFO = {"name": None, "is_mock": False}
+CLASSIFIER_INFO = {"name": None, "is_mock": False, "backend": None, "variant": None, "quantization": None}
+DETECTOR_INFO = {"name": None, "backend": None, "variant": None, "quantization": None, "artifact": None}
 
 MODELO_CLASSIFICACAO_URL = os.getenv("MODELO_CLASSIFICACAO_URL", "")
 MODELO_YOLO_URL = os.getenv("MODELO_YOLO_URL", "https://drive.google.com/uc?export=download&id=1oTSfjG_z63eLwSaCuj8gfHuSTk6-w1Tr")
+# SHA-256 esperado dos pesos (vazio = sem verificação)
+MODELO_YOLO_SHA256 = os.getenv("MODELO_YOLO_SHA256", "")
+YOLO_CONFIG = {
+    "conf": float(os.getenv("YOLO_CONF", "0.25")),
+    "iou": float(os.getenv("YOLO_IOU", "0.45")),
+}
+
+# Modelos mock (benchmarks/testes de carga, sem rede): o YOLO mock devolve MOCK_YOLO_BOXES caixas
+MOCK_MODELS = os.getenv("MOCK_MODELS", "0") != "0"
+MOCK_YOLO_BOXES = int(os.getenv("MOCK_YOLO_BOXES", "0"))
 
 MODELS_DIR = Path("models-ia")
 MODELS_DIR.mkdir(exist_ok=True)
 
+# Versões dos modelos com troca a quente: models-ia/versoes/<classificacao|yolo>/<nome>/ (a
+# versão "padrao" são os arquivos de models-ia carregados no startup). O roteamento desejado
+# (ativa, canário, sombra) fica em MODELS_STATE e é aplicado por todos os workers
+VERSOES_CONFIG = {
+    "diretorio": MODELS_DIR / "versoes",
+    "estado": os.getenv("MODELS_STATE", "dados/modelos.json"),
+    "intervalo_s": float(os.getenv("MODELS_SYNC_S", "2")),
+    "token": os.getenv("MODELS_ADMIN_TOKEN", ""),  # vazio = endpoints de administração sem autenticação
+}
+VERSAO_INICIAL = "padrao"
+
+# Backend de inferência: "native" (TensorFlow/PyTorch) ou "onnx" (ONNX Runtime, CPU)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "native").lower()
+if INFERENCE_BACKEND not in BACKENDS:
+    raise ValueError(f"INFERENCE_BACKEND inválido: {INFERENCE_BACKEND} (use {', '.join(BACKENDS)})")
+ONNX_CONFIG = {
+    "intra_threads": int(os.getenv("ORT_INTRA_OP_THREADS", str(HARDWARE_CONFIG['cpu_threads']))),
+    "inter_threads": int(os.getenv("ORT_INTER_OP_THREADS", "1")),
+    "variante": os.getenv("ONNX_MODEL_VARIANT", "fp32"),
+    "yolo_size": int(os.getenv("ONNX_YOLO_SIZE", "640")),
+    # Pesos mapeados em memória e compartilhados entre workers (padrão: ligado com WEB_CONCURRENCY > 1)
+    "pesos_compartilhados": os.getenv("ONNX_SHARED_WEIGHTS", "1" if HARDWARE_CONFIG['workers'] > 1 else "0") != "0",
+    # Gate de acurácia das variantes quantizadas (relatório de quantizar_modelos.py)
+    "gate_top1": float(os.getenv("QUANT_GATE_MIN_TOP1", "0.98")),
+    "gate_map50": float(os.getenv("QUANT_GATE_MIN_MAP50", "0.95")),
+}
+
+# Micro-batching entre requisições (ex.: 8 itens ou 10 ms)
+BATCH_CONFIG = {
+    "habilitado": os.getenv("BATCH_ENABLED", "1") != "0",
+    "max_lote": int(os.getenv("BATCH_MAX_SIZE", "8")),
+    "max_espera_ms": float(os.getenv("BATCH_MAX_WAIT_MS", "10")),
+}
+# Batchers da versão ativa de cada modelo (cada versão carregada tem os seus)
+batcher_classificacao = None
+batcher_yolo = None
+
+# Versões carregadas de cada modelo: as rotas /predict escolhem a versão (ativa ou canário) por requisição
+registros_modelos = {
+    tipo: RegistroModelos(tipo, lambda versao: descarregar_versao(versao)) for tipo in ("classificacao", "yolo")
+}
+app.add_middleware(RoteamentoModelos, registros=registros_modelos)
+tarefa_versoes = None
+sinal_versoes = None
+tarefas_modelos = set()  # carregamentos de versões e execuções na sombra em andamento
+alvos_sincronizados = {}  # último estado desejado aplicado, por tipo
+
+# Detecção em mosaico (?tiles=true): janelas sobrepostas da foto em resolução maior,
+# para lesões pequenas que somem no letterbox; ajustável por requisição
+MOSAICO_CONFIG = {
+    "padrao": os.getenv("TILES_DEFAULT", "0") != "0",
+    "tamanho": int(os.getenv("TILE_SIZE", "0")),  # 0 = tamanho de entrada do YOLO
+    "sobreposicao": float(os.getenv("TILE_OVERLAP", "0.2")),
+    "max_tiles": int(os.getenv("TILE_MAX", "4")),
+    "limite_tiles": int(os.getenv("TILE_MAX_LIMIT", "16")),  # teto para ?max_tiles=
+    "fusao": os.getenv("TILE_MERGE", "wbf").lower(),
+    "iou_fusao": float(os.getenv("TILE_MERGE_IOU", "0.5")),
+}
+if MOSAICO_CONFIG["fusao"] not in METODOS_FUSAO:
+    raise ValueError(f"TILE_MERGE inválido: {MOSAICO_CONFIG['fusao']} (use {', '.join(METODOS_FUSAO)})")
+
+# Qualidade adaptativa (?quality=): resolução de entrada do YOLO por requisição,
+# reduzida sob carga (fila ou latência acima do SLO) e restaurada quando ocioso
+QOS_CONFIG = {
+    "habilitado": os.getenv("QOS_ENABLED", "1") != "0",
+    "escada": ler_escada(os.getenv("QOS_LADDER", "320,416,512,640"), YOLO_CONFIG["conf"]),
+    # Qualidade máxima do modo auto (a de ocioso). 640 é o size que o YOLO sempre recebeu (padrão
+    # do AutoShape, mesmo com o letterbox de 416 em CPU); QOS_MAX_SIZE=416 troca qualidade por CPU
+    "topo": int(os.getenv("QOS_MAX_SIZE", "640")),
+    "slo_ms": float(os.getenv("QOS_SLO_MS", "2000")),
+    "fila_alta": int(os.getenv("QOS_QUEUE_HIGH", "4")),
+    "intervalo_s": float(os.getenv("QOS_STEP_INTERVAL_S", "2")),
+    "ocioso_s": float(os.getenv("QOS_IDLE_RESET_S", "10")),
+}
+controle_qualidade = ControladorQualidade(
+    QOS_CONFIG["escada"], QOS_CONFIG["topo"], QOS_CONFIG["slo_ms"], QOS_CONFIG["fila_alta"],
+    QOS_CONFIG["intervalo_s"], QOS_CONFIG["ocioso_s"]
+)
+
+# Test-time augmentation do classificador (?tta=true): K vistas por recorte no mesmo lote
+TTA_CONFIG = {
+    "padrao": os.getenv("TTA_DEFAULT", "0") != "0",
+    "vistas": ler_vistas(os.getenv("TTA_VIEWS", "original,flip_h,flip_v,rot10,rot-10")),
+}
+
+# Acompanhamento longitudinal: embeddings dos recortes em um índice por paciente (k-NN)
+# (use um volume persistente para EMBEDDINGS_DIR)
+EMBEDDINGS_CONFIG = {
+    "habilitado": os.getenv("EMBEDDINGS_ENABLED", "1") != "0",
+    "diretorio": os.getenv("EMBEDDINGS_DIR", "dados/embeddings"),
+    "dimensao": int(os.getenv("EMBEDDINGS_DIM", "256")),  # projeção no índice (0 = dimensão do modelo)
+    "k": int(os.getenv("EMBEDDINGS_K", "3")),
+    "mesma_lesao": float(os.getenv("EMBEDDINGS_MATCH", "0.85")),  # similaridade (cosseno) mínima
+    "max_pacientes": int(os.getenv("EMBEDDINGS_CACHE_PATIENTS", "256")),  # índices mantidos em memória
+}
+indice_embeddings = IndiceEmbeddings(
+    EMBEDDINGS_CONFIG["diretorio"],
+    dimensao=EMBEDDINGS_CONFIG["dimensao"],
+    max_pacientes=EMBEDDINGS_CONFIG["max_pacientes"]
+) if EMBEDDINGS_CONFIG["habilitado"] else None
+
+# Trabalhos assíncronos (POST /jobs): fila em SQLite, processada por JOBS_WORKERS tarefas;
+# trabalhos em andamento sobrevivem a restarts (use um volume persistente para JOBS_DB)
+JOBS_CONFIG = {
+    "habilitado": os.getenv("JOBS_ENABLED", "1") != "0",
+    "banco": os.getenv("JOBS_DB", "dados/trabalhos.sqlite3"),
+    "workers": int(os.getenv("JOBS_WORKERS", "2")),
+    "max_pendentes": int(os.getenv("JOBS_MAX_PENDING", "200")),
+    "arrendamento_s": float(os.getenv("JOBS_LEASE_S", "120")),
+    "max_tentativas": int(os.getenv("JOBS_MAX_ATTEMPTS", "3")),
+    "ttl_s": float(os.getenv("JOBS_TTL_S", "86400")),
+}
+fila_trabalhos = None
+tarefas_trabalhos = []
+sinal_trabalhos = None
+
+# Executor dedicado: tira inferência e codecs PIL do event loop
+EXECUTOR_CONFIG = {
+    "threads": int(os.getenv("INFER_THREADS", str(max(2, min(8, HARDWARE_CONFIG['cpu_threads']))))),
+    "processos": int(os.getenv("INFER_PROCESSES", "0")),
+    "max_fila": int(os.getenv("INFER_MAX_QUEUE", "32")),
+}
+executor_inferencia = None
+
+# Governador de memória: cada requisição reserva o pico estimado (foto, caixas, vistas)
+# em um orçamento de RAM e espera na fila se não couber; um vigia de RSS apara os
+# alocadores acima do limite. Evita OOM com uploads simultâneos em instâncias pequenas
+MEMORIA_CONFIG = {
+    "habilitado": os.getenv("MEMORY_GOVERNOR", "1") != "0",
+    "fracao": float(os.getenv("MEMORY_FRACTION", "0.85")),  # da RAM de cada worker
+    "orcamento_mb": float(os.getenv("MEMORY_BUDGET_MB", "0")),  # 0 = limite menos o RSS com os modelos
+    "espera_max_s": float(os.getenv("MEMORY_QUEUE_TIMEOUT_S", "30")),
+    "intervalo_s": float(os.getenv("MEMORY_WATCHDOG_S", "0.2")),
+    "mb_deteccao": float(os.getenv("MEMORY_MB_DETECTION", "150")),  # ativações do YOLO por imagem
+    "mb_caixa": float(os.getenv("MEMORY_MB_PER_BOX", "12")),  # ativações do classificador por recorte
+    "caixas_previstas": int(os.getenv("MEMORY_EXPECTED_BOXES", "4")),  # antes da detecção (/predict/full)
+}
+MEMORIA_CONFIG["limite_mb"] = round(
+    ram_disponivel(HARDWARE_CONFIG['ram_gb'] * 1024**3) / HARDWARE_CONFIG['workers'] * MEMORIA_CONFIG["fracao"] / MB
+)
+governador_memoria = None
+
+# Carregamento dos modelos: "background" abre a porta imediatamente e carrega em
+# segundo plano (/health/ready responde 200 quando terminar); "blocking" só
+# termina o startup após carregar tudo
+MODEL_LOADING = os.getenv("MODEL_LOADING", "background").lower()
+if MODEL_LOADING not in ("background", "blocking"):
+    raise ValueError(f"MODEL_LOADING inválido: {MODEL_LOADING} (use background, blocking)")
+CARREGAMENTO = {
+    "modo": MODEL_LOADING,
+    "fase": "aguardando",  # aguardando -> carregando -> pronto
+    "modelos": {"classificacao": "pendente", "yolo": "pendente"},
+    "perfil_ms": PERFIL_INICIALIZACAO,
+}
+tarefa_carregamento = None
+
+# Imagens da detecção reaproveitadas pela classificação (via imagem_id)
+sessoes_imagem = ArmazemSessoes(
+    ttl_s=float(os.getenv("IMAGE_SESSION_TTL", "600")),
+    max_itens=int(os.getenv("IMAGE_SESSION_MAX", "64"))
+)
+
+# Cache de resultados por conteúdo (a mesma foto/caixa não reexecuta os modelos)
+CACHE_CONFIG = {
+    "habilitado": os.getenv("RESULT_CACHE_ENABLED", "1") != "0",
+    "max_mb": float(os.getenv("RESULT_CACHE_MAX_MB", "32")),
+    "ttl_s": float(os.getenv("RESULT_CACHE_TTL", "3600")),
+    "pasta": os.getenv("RESULT_CACHE_DIR", ""),  # vazio = apenas memória
+    "max_mb_disco": float(os.getenv("RESULT_CACHE_DISK_MAX_MB", "256")),
+}
+cache_resultados = CacheResultados(
+    max_bytes=CACHE_CONFIG["max_mb"] * 1024 * 1024,
+    ttl_s=CACHE_CONFIG["ttl_s"],
+    pasta=CACHE_CONFIG["pasta"] or None,
+    max_bytes_disco=CACHE_CONFIG["max_mb_disco"] * 1024 * 1024
+) if CACHE_CONFIG["habilitado"] else None
+VERSAO_MODELOS = {"deteccao": None, "classificacao": None}
+
+# Imagens e recortes gravados por conteúdo (?crops=blob): a resposta leva ids/URLs em vez de base64
+# (use um volume persistente para BLOBS_DIR)
+BLOBS_CONFIG = {
+    "diretorio": os.getenv("BLOBS_DIR", "dados/blobs"),
+    "max_age_s": int(os.getenv("BLOBS_MAX_AGE", "31536000")),
+}
+armazenamento_blobs = ArmazenamentoBlobs(BLOBS_CONFIG["diretorio"])
+
+# Estado exportado em /metrics (lido só no scrape)
+registrar_estado([
+    ("api_executor_em_andamento", "Requisições admitidas no executor de inferência", None,
+     lambda: executor_inferencia.estatisticas()["em_andamento"] if executor_inferencia else 0),
+    ("api_fila_lote", "Itens aguardando na fila de micro-batching", "batcher",
+     lambda: {b.nome: b.profundidade_fila() for b in (batcher_classificacao, batcher_yolo) if b}),
+    ("api_qualidade_resolucao", "Resolução de entrada escolhida pelo controle de qualidade (modo auto)", None,
+     controle_qualidade.tamanho_atual),
+    ("api_trabalhos", "Trabalhos assíncronos por estado", "estado",
+     lambda: fila_trabalhos.contagem() if fila_trabalhos else {}),
+    ("api_memoria_orcamento_bytes", "Orçamento de memória para as requisições em andamento", None,
+     lambda: governador_memoria.orcamento if governador_memoria else 0),
+    ("api_memoria_ocupada_bytes", "Memória ocupada pelas requisições (reservas ou RSS acima da base)", None,
+     lambda: governador_memoria.ocupado() if governador_memoria else 0),
+    ("api_memoria_aguardando", "Requisições esperando memória", None,
+     lambda: governador_memoria.estatisticas()["aguardando"] if governador_memoria else 0),
+    ("api_sessoes_imagem", "Imagens guardadas para reuso via imagem_id", None,
+     lambda: sessoes_imagem.estatisticas()["sessoes"]),
+    ("api_modelos_prontos", "1 quando todos os modelos estão carregados", None,
+     lambda: CARREGAMENTO["fase"] == "pronto"),
+    ("api_inicializacao_segundos", "Duração de cada fase da inicialização (imports e carregamento dos modelos)", "fase",
+     lambda: {fase: ms / 1000 for fase, ms in PERFIL_INICIALIZACAO.items()}),
+    *medidores_processo(),
+])
+
 # ========================================
 # DOWNLOAD DE MODELOS
 # ========================================
-async def baixar_google_drive_direto(file_id: str, destino: Path, descricao: str):
-    """Download do Google Drive"""
+def baixar_com_retomada(session, url, parcial, timeout=300):
+    """GET em streaming para `parcial`, continuando um download interrompido (Range) se o servidor aceitar"""
+    inicio = parcial.stat().st_size if parcial.exists() else 0
+    headers = {"Range": f"bytes={inicio}-"} if inicio else {}
+    
+    with session.get(url, stream=True, allow_redirects=True, timeout=timeout, headers=headers) as response:
+        if response.status_code == 416:  # parcial já está completo
+            return
+        response.raise_for_status()
+        if "text/html" in response.headers.get("Content-Type", ""):
+            raise ValueError("servidor retornou HTML em vez do arquivo")
+        
+        retomando = inicio and response.status_code == 206
+        if inicio:
+            logger.info(f"↪️ Retomando a partir de {inicio / (1024*1024):.1f}MB" if retomando
+                        else "↪️ Servidor não aceita retomada, baixando do início")
+        with open(parcial, 'ab' if retomando else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                if chunk:
+                    f.write(chunk)
+
+def finalizar_download(parcial, destino, sha256, descricao):
+    """Valida tamanho/checksum do parcial e o move para o destino; False se inválido"""
+    if not parcial.exists() or parcial.stat().st_size <= 10000:
+        return False
+    if sha256 and hash_arquivo(parcial) != sha256:
+        logger.warning(f"⚠️ Checksum de {descricao} não confere, descartando download")
+        parcial.unlink()
+        return False
+    
+    os.replace(parcial, destino)
+    size_mb = destino.stat().st_size / (1024*1024)
+    logger.info(f"✅ {descricao} baixado: {size_mb:.1f}MB")
+    return True
+
+async def baixar_google_drive_direto(file_id: str, parcial: Path, descricao: str):
+    """Download do Google Drive (para o arquivo parcial)"""
+    import requests
+    
     urls = [
         f"https://drive.google.com/uc?export=download&id={file_id}",
         f"https://drive.usercontent.google.com/download?id={file_id}&export=download"
@@ -144,52 +495,45 @@ async def baixar_google_drive_direto(file_id: str, destino: Path, descricao: str
             logger.info(f"🔄 Tentativa {i}/2: Baixando {descricao}...")
             
             session = requests.Session()
-            response = session.get(url, stream=True, allow_redirects=True, timeout=300)
-            
-            # Handle virus scan warning
-            if "confirm=" in response.url:
-                for line in response.text.split('\n'):
-                    if 'confirm=' in line:
-                        token = re.search(r'confirm=([a-zA-Z0-9_-]+)', line)
-                        if token:
-                            url = f"{url}&confirm={token.group(1)}"
-                            response = session.get(url, stream=True, timeout=300)
-                            break
-            
-            response.raise_for_status()
             
-            # Salvar arquivo
-            with open(destino, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            # Handle virus scan warning (só lê o HTML; o arquivo vem na requisição seguinte)
+            with session.get(url, stream=True, allow_redirects=True, timeout=300) as response:
+                if "confirm=" in response.url or "text/html" in response.headers.get("Content-Type", ""):
+                    for line in response.text.split('\n'):
+                        if 'confirm=' in line:
+                            token = re.search(r'confirm=([a-zA-Z0-9_-]+)', line)
+                            if token:
+                                url = f"{url}&confirm={token.group(1)}"
+                                break
             
-            # Validar
-            if destino.exists() and destino.stat().st_size > 10000:
-                size_mb = destino.stat().st_size / (1024*1024)
-                logger.info(f"✅ {descricao} baixado: {size_mb:.1f}MB")
-                return True
-            else:
-                if destino.exists():
-                    destino.unlink()
+            baixar_com_retomada(session, url, parcial)
+            return True
                     
         except Exception as e:
             logger.warning(f"⚠️ Tentativa {i} falhou: {e}")
-            if destino.exists():
-                destino.unlink()
     
     return False
 
-async def baixar_arquivo(url: str, destino: Path, descricao: str = "arquivo"):
-    """Baixa arquivo com fallback"""
-    if not url:
-        raise ValueError(f"URL não configurada para {descricao}")
+async def baixar_arquivo(url: str, destino: Path, descricao: str = "arquivo", sha256: str = ""):
+    """Baixa arquivo com fallback, checksum (SHA-256) e retomada de downloads parciais
+    
+    O download vai para `<destino>.part` e só é movido para o destino após
+    validado; um reinício continua o parcial em vez de começar do zero.
+    """
+    sha256 = (sha256 or "").lower()
     
     if destino.exists():
-        logger.info(f"✅ {descricao} já existe")
-        return
+        if not sha256 or hash_arquivo(destino) == sha256:
+            logger.info(f"✅ {descricao} já existe")
+            return
+        logger.warning(f"⚠️ Checksum de {destino.name} não confere, baixando novamente")
+        destino.unlink()
+    
+    if not url:
+        raise ValueError(f"URL não configurada para {descricao}")
     
     logger.info(f"📥 Baixando {descricao}...")
+    parcial = destino.with_name(destino.name + ".part")
     
     # Extrair ID do Google Drive
     file_id = None
@@ -203,31 +547,33 @@ async def baixar_arquivo(url: str, destino: Path, descricao: str = "arquivo"):
     
     # Tentar Google Drive
     if file_id:
-        success = await baixar_google_drive_direto(file_id, destino, descricao)
-        if success:
+        if await baixar_google_drive_direto(file_id, parcial, descricao) and \
+                finalizar_download(parcial, destino, sha256, descricao):
             return
     
     # Fallback: download direto
-    response = requests.get(url, stream=True, timeout=300)
-    response.raise_for_status()
-    
-    with open(destino, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-    
-    logger.info(f"✅ {descricao} baixado!")
+    import requests
+    baixar_com_retomada(requests.Session(), url, parcial)
+    if not finalizar_download(parcial, destino, sha256, descricao):
+        raise ValueError(f"Download de {descricao} inválido")
 
 # ========================================
 # CARREGAMENTO DE MODELOS
 # ========================================
 async def carregar_modelo_classificacao():
     """Carrega modelo de classificação"""
-    global modelo_classificacao
+    global modelo_classificacao, classificador_compilado
     
     if modelo_classificacao is not None:
         return
     
+    if MOCK_MODELS:
+        criar_classificador_mock()
+        return
+    
+    if INFERENCE_BACKEND == "onnx" and carregar_classificador_onnx():
+        return
+    
     modelo_path = MODELS_DIR / "resnet50_consolidado.keras"
     
     try:
@@ -261,9 +607,13 @@ async def carregar_modelo_classificacao():
         logger.info(f"📚 Carregando modelo: {modelo_path.name}")
         
         # ✅ CARREGAR MODELO
+        tf = importar_tensorflow()
         modelo_classificacao = tf.keras.models.load_model(str(modelo_path), compile=False)
+        classificador_compilado = compilar_classificador(modelo_classificacao)
         CLASSIFIER_INFO["name"] = modelo_path.name
         CLASSIFIER_INFO["is_mock"] = False
+        CLASSIFIER_INFO["backend"] = "native"
+        CLASSIFIER_INFO["variant"] = "fp32"
         
         # ✅ INFO DO MODELO
         logger.info(f"✅ Modelo {modelo_path.name} carregado!")
@@ -274,25 +624,133 @@ async def carregar_modelo_classificacao():
         # ✅ WARM-UP
         logger.info("🔥 Aquecendo modelo...")
         dummy_input = np.random.rand(1, 224, 224, 3).astype(np.float32)
-        _ = modelo_classificacao.predict(dummy_input, verbose=0)
+        _ = classificador_compilado(dummy_input)
         logger.info("🔥 Warm-up concluído!")
         
         logger.info("✅ Modelo de classificação pronto!")
         
     except Exception as e:
         logger.error(f"❌ Erro ao carregar modelo: {e}")
-        logger.warning("🔧 Criando modelo mock para testes...")
-        
         # ✅ MODELO MOCK EM CASO DE ERRO
-        modelo_classificacao = tf.keras.Sequential([
-            tf.keras.layers.Input(shape=(224, 224, 3)),
-            tf.keras.layers.GlobalAveragePooling2D(),
-            tf.keras.layers.Dense(len(LABEL_COLS), activation='softmax')
-        ], name="MockClassifier")
-        CLASSIFIER_INFO["name"] = "MockClassifier"
-        CLASSIFIER_INFO["is_mock"] = True
+        criar_classificador_mock()
+
+def criar_classificador_mock():
+    """Classificador mock (GlobalAveragePooling + Dense), sem arquivo de modelo"""
+    global modelo_classificacao, classificador_compilado
+    
+    logger.warning("🔧 Criando modelo mock para testes...")
+    modelo_classificacao = construir_classificador_mock()
+    classificador_compilado = compilar_classificador(modelo_classificacao)
+    CLASSIFIER_INFO["name"] = "MockClassifier"
+    CLASSIFIER_INFO["is_mock"] = True
+    CLASSIFIER_INFO["backend"] = "native"
+    CLASSIFIER_INFO["variant"] = "fp32"
+    
+    logger.warning("⚠️ Usando modelo mock - resultados não serão precisos!")
+
+def construir_classificador_mock():
+    tf = importar_tensorflow()
+    return tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(224, 224, 3)),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(len(LABEL_COLS), activation='softmax')
+    ], name="MockClassifier")
+
+def variante_classificador_onnx():
+    """(arquivo, info) do classificador ONNX após o gate da variante configurada"""
+    return selecionar_variante(
+        MODELS_DIR / "resnet50_consolidado.onnx", ONNX_CONFIG["variante"],
+        MODELS_DIR / RELATORIO_QUANTIZACAO, "classificador", "top1_concordancia", ONNX_CONFIG["gate_top1"]
+    )
+
+def variante_yolo_onnx():
+    """(arquivo, info) do YOLO ONNX após o gate da variante configurada"""
+    return selecionar_variante(
+        MODELS_DIR / "bestYolov5_test.onnx", ONNX_CONFIG["variante"],
+        MODELS_DIR / RELATORIO_QUANTIZACAO, "yolo", "map50", ONNX_CONFIG["gate_map50"]
+    )
+
+def carregar_classificador_onnx():
+    """Carrega o classificador exportado para ONNX; False se não existir"""
+    global modelo_classificacao, classificador_compilado
+    
+    onnx_path, variante_info = variante_classificador_onnx()
+    if not onnx_path.exists():
+        logger.warning(f"⚠️ {onnx_path.name} não encontrado, usando backend nativo")
+        return False
+    
+    try:
+        logger.info(f"📚 Carregando modelo ONNX: {onnx_path.name}")
+        modelo = ClassificadorONNX(
+            onnx_path, ONNX_CONFIG["intra_threads"], ONNX_CONFIG["inter_threads"], ONNX_CONFIG["pesos_compartilhados"]
+        )
         
-        logger.warning("⚠️ Usando modelo mock - resultados não serão precisos!")
+        logger.info("🔥 Aquecendo modelo...")
+        modelo(np.random.rand(1, 224, 224, 3).astype(np.float32))
+    except Exception as e:
+        logger.error(f"❌ Erro ao carregar {onnx_path.name}: {e}, usando backend nativo")
+        return False
+    
+    modelo_classificacao = classificador_compilado = modelo
+    CLASSIFIER_INFO["name"] = onnx_path.name
+    CLASSIFIER_INFO["is_mock"] = False
+    CLASSIFIER_INFO["backend"] = "onnx"
+    CLASSIFIER_INFO["variant"] = variante_info["variant"]
+    CLASSIFIER_INFO["quantization"] = variante_info.get("gate")
+    logger.info("✅ Modelo de classificação (ONNX Runtime) pronto!")
+    return True
+
+def preparar_extrator_embeddings():
+    """Forward pass que também devolve a entrada da última camada (embedding), se o modelo permitir"""
+    global extrator_embeddings
+    
+    if not EMBEDDINGS_CONFIG["habilitado"] or modelo_classificacao is None or extrator_embeddings is not None:
+        return
+    extrator_embeddings = criar_extrator(modelo_classificacao, CLASSIFIER_INFO)
+
+def criar_extrator(modelo, info):
+    """Extrator de embeddings aquecido para um classificador (None se o modelo não permite)"""
+    extrator = None
+    try:
+        if info["backend"] == "onnx":
+            # Exportações antigas só têm a saída das probabilidades
+            if modelo.com_embeddings:
+                extrator = modelo.inferir_com_embeddings
+        else:
+            extrator = compilar_extrator(modelo)
+        if extrator is not None:
+            # Warm-up (traçado do tf.function) e projeção do índice prontos antes da primeira requisição
+            _, embeddings = extrator(np.zeros((1, 224, 224, 3), dtype=np.float32))
+            if indice_embeddings is not None:
+                indice_embeddings.reduzir(np.asarray(embeddings))
+    except Exception as e:
+        extrator = None
+        logger.warning(f"⚠️ Embeddings indisponíveis para {info['name']}: {e}")
+    
+    if extrator is None:
+        logger.warning(f"⚠️ {info['name']} sem saída de embeddings (reexporte com exportar_onnx.py)")
+    else:
+        logger.info("🧬 Embeddings da penúltima camada habilitados")
+    return extrator
+
+def compilar_extrator(modelo):
+    """Como `compilar_classificador`, devolvendo (probabilidades, embeddings)"""
+    tf = importar_tensorflow()
+    extrator = tf.keras.Model(modelo.inputs, [modelo.outputs[0], modelo.layers[-1].input])
+    
+    @tf.function(input_signature=[tf.TensorSpec([None, 224, 224, 3], tf.float32)])
+    def inferir(x):
+        return extrator(x, training=False)
+    return inferir
+
+def compilar_classificador(modelo):
+    """Forward pass compilado (tf.function) com batch dinâmico, sem retracing por N"""
+    tf = importar_tensorflow()
+    
+    @tf.function(input_signature=[tf.TensorSpec([None, 224, 224, 3], tf.float32)])
+    def inferir(x):
+        return modelo(x, training=False)
+    return inferir
 
 async def carregar_modelo_yolo():
     """Carrega YOLO (auto-detecta GPU/CPU)"""
@@ -303,13 +761,19 @@ async def carregar_modelo_yolo():
     
     logger.info("🎯 Carregando YOLO...")
     
-    # Lista de estratégias
-    estrategias = [
-        lambda: carregar_yolo_customizado(),
-        lambda: carregar_yolo_pretrained('yolov5s'),
-        lambda: carregar_yolo_pretrained('yolov5n'),
-        lambda: carregar_yolo_mock()
-    ]
+    # Lista de estratégias (artefato local primeiro: sem torch.hub nem rede)
+    if MOCK_MODELS:
+        estrategias = [lambda: carregar_yolo_mock(MOCK_YOLO_BOXES)]
+    else:
+        estrategias = [
+            carregar_yolo_torchscript,
+            lambda: carregar_yolo_customizado(),
+            lambda: carregar_yolo_pretrained('yolov5s'),
+            lambda: carregar_yolo_pretrained('yolov5n'),
+            lambda: carregar_yolo_mock()
+        ]
+    if INFERENCE_BACKEND == "onnx" and not MOCK_MODELS:
+        estrategias.insert(0, carregar_yolo_onnx)
     
     for i, estrategia in enumerate(estrategias, 1):
         try:
@@ -322,24 +786,9 @@ async def carregar_modelo_yolo():
                 modelo_yolo = resultado
             
             if modelo_yolo is not None:
-                # Configurar device
-                device = HARDWARE_CONFIG['device']
-                if hasattr(modelo_yolo, 'to'):
-                    modelo_yolo.to(device)
-                
-                if hasattr(modelo_yolo, 'conf'):
-                    modelo_yolo.conf = 0.25
-                if hasattr(modelo_yolo, 'iou'):
-                    modelo_yolo.iou = 0.45
-                
-                # Warm-up
-                logger.info("🔥 Aquecendo YOLO...")
-                dummy = torch.randn(1, 3, HARDWARE_CONFIG['target_size'], HARDWARE_CONFIG['target_size'])
-                if device == 'cuda':
-                    dummy = dummy.cuda()
-                _ = modelo_yolo(dummy)
-                
-                logger.info(f"✅ YOLO pronto! (device: {device})")
+                preparar_yolo(modelo_yolo)
+                registrar_detector_info()
+                logger.info(f"✅ YOLO pronto! (device: {HARDWARE_CONFIG['device']})")
                 return
                 
         except Exception as e:
@@ -348,6 +797,45 @@ async def carregar_modelo_yolo():
     
     logger.error("❌ Todas estratégias falharam, usando mock")
     modelo_yolo = carregar_yolo_mock()
+    registrar_detector_info()
+
+def preparar_yolo(modelo):
+    """Device, limiares e warm-up de um YOLO recém-carregado"""
+    device = HARDWARE_CONFIG['device']
+    if hasattr(modelo, 'to'):
+        modelo.to(device)
+    
+    if hasattr(modelo, 'conf'):
+        modelo.conf = YOLO_CONFIG["conf"]
+    if hasattr(modelo, 'iou'):
+        modelo.iou = YOLO_CONFIG["iou"]
+    
+    # Warm-up (o backend ONNX aceita NumPy e dispensa o PyTorch)
+    logger.info("🔥 Aquecendo YOLO...")
+    tamanho = getattr(modelo, 'tamanho', HARDWARE_CONFIG['target_size'])  # TorchScript tem tamanho fixo
+    forma = (1, 3, tamanho, tamanho)
+    if getattr(modelo, 'backend', 'native') == 'onnx':
+        dummy = np.random.randn(*forma).astype(np.float32)
+    else:
+        dummy = importar_torch().randn(*forma)
+        if device == 'cuda':
+            dummy = dummy.cuda()
+    _ = modelo(dummy)
+
+def info_detector(modelo):
+    variante_info = getattr(modelo, 'variante_info', {"variant": "fp32"})
+    caminho = getattr(modelo, 'caminho', None)
+    return {
+        "name": caminho.name if caminho else getattr(modelo, 'nome', type(modelo).__name__),
+        "backend": getattr(modelo, 'backend', 'native'),
+        "variant": variante_info["variant"],
+        "quantization": variante_info.get("gate"),
+        "artifact": getattr(modelo, 'artefato', None),
+    }
+
+def registrar_detector_info():
+    """Atualiza DETECTOR_INFO a partir do modelo YOLO carregado"""
+    DETECTOR_INFO.update(info_detector(modelo_yolo))
 
 async def carregar_yolo_customizado():
     """Carrega modelo customizado"""
@@ -355,42 +843,101 @@ async def carregar_yolo_customizado():
         raise ValueError("URL não configurada")
     
     modelo_path = MODELS_DIR / "bestYolov5_test.pt"
-    await baixar_arquivo(MODELO_YOLO_URL, modelo_path, "YOLO customizado")
-    
+    await baixar_arquivo(MODELO_YOLO_URL, modelo_path, "YOLO customizado", MODELO_YOLO_SHA256)
+    return carregar_yolo_pt(modelo_path)
+
+def carregar_yolo_pt(modelo_path):
+    """Pesos .pt do YOLOv5 via torch.hub (clone local em cache, se houver)"""
+    torch = importar_torch()
     tentativas = [
         lambda: torch.hub.load('ultralytics/yolov5', 'custom', path=str(modelo_path), trust_repo=True),
-        lambda: torch.hub.load('ultralytics/yolov5', 'custom', path=str(modelo_path.resolve()), force_reload=True),
     ]
+    repo_local = repositorio_yolov5_local()
+    if repo_local:
+        # Clone já em cache: evita a consulta ao GitHub do torch.hub
+        tentativas.insert(0, lambda: torch.hub.load(str(repo_local), 'custom', path=str(modelo_path), source='local'))
     
     for i, tentativa in enumerate(tentativas, 1):
         try:
-            return tentativa()
+            modelo = tentativa()
+            modelo.nome = Path(modelo_path).name
+            return modelo
         except Exception as e:
             logger.warning(f"Tentativa {i} falhou: {e}")
     
     raise Exception("Falha em todas as tentativas")
 
+def repositorio_yolov5_local():
+    """Clone do YOLOv5 no cache do torch.hub, se existir"""
+    repo = Path(importar_torch().hub.get_dir()) / "ultralytics_yolov5_master"
+    return repo if (repo / "hubconf.py").exists() else None
+
+def carregar_yolo_torchscript():
+    """Carrega o artefato TorchScript versionado de models-ia (gerado por exportar_onnx.py --torchscript)"""
+    modelo_path = MODELS_DIR / "bestYolov5_test.torchscript"
+    if not modelo_path.exists():
+        raise FileNotFoundError(f"{modelo_path.name} não encontrado")
+    
+    logger.info(f"📦 Carregando {modelo_path.name} (TorchScript, offline)...")
+    importar_torch()
+    modelo = DetectorTorchScript(modelo_path, device=HARDWARE_CONFIG['device'])
+    
+    origem = modelo.artefato.get("sha256_origem")
+    if MODELO_YOLO_SHA256 and origem and origem != MODELO_YOLO_SHA256.lower():
+        raise ValueError(f"{modelo_path.name} foi gerado de outros pesos (sha256 {origem[:12]}...)")
+    logger.info(f"✅ Artefato {modelo.artefato.get('versao', '?')} (tamanho {modelo.tamanho})")
+    return modelo
+
+def carregar_yolo_onnx():
+    """Carrega YOLO exportado para ONNX (ONNX Runtime)"""
+    modelo_path, variante_info = variante_yolo_onnx()
+    if not modelo_path.exists():
+        raise FileNotFoundError(f"{modelo_path.name} não encontrado")
+    
+    logger.info(f"📦 Carregando {modelo_path.name} (ONNX Runtime)...")
+    modelo = DetectorONNX(
+        modelo_path, ONNX_CONFIG["yolo_size"],
+        ONNX_CONFIG["intra_threads"], ONNX_CONFIG["inter_threads"], ONNX_CONFIG["pesos_compartilhados"]
+    )
+    modelo.variante_info = variante_info
+    return modelo
+
 def carregar_yolo_pretrained(model_name):
     """Carrega YOLO pré-treinado"""
     logger.info(f"📦 Carregando {model_name}...")
-    modelo = torch.hub.load('ultralytics/yolov5', model_name, pretrained=True, trust_repo=True)
+    repo_local = repositorio_yolov5_local()
+    if repo_local:
+        modelo = importar_torch().hub.load(str(repo_local), model_name, pretrained=True, source='local')
+    else:
+        modelo = importar_torch().hub.load('ultralytics/yolov5', model_name, pretrained=True, trust_repo=True)
     logger.info(f"✅ {model_name} carregado")
+    modelo.nome = model_name
     return modelo
 
-def carregar_yolo_mock():
-    """Modelo mock"""
+def carregar_yolo_mock(caixas=0):
+    """Modelo mock (`caixas` detecções fixas por imagem, em grade)"""
     logger.warning("🔧 Criando YOLO mock...")
+    torch = importar_torch()
+    
+    lado = max(1, int(np.ceil(np.sqrt(caixas))))
+    passo = HARDWARE_CONFIG['target_size'] // lado
+    deteccoes = [
+        [(i % lado) * passo + 4, (i // lado) * passo + 4, (i % lado + 1) * passo - 4, (i // lado + 1) * passo - 4,
+         0.9 - 0.01 * i, 0.0]
+        for i in range(caixas)
+    ]
     
     class YOLOMock:
         def __init__(self):
             self.names = {0: 'object'}
-            self.conf = 0.25
-            self.iou = 0.45
+            self.conf = YOLO_CONFIG["conf"]
+            self.iou = YOLO_CONFIG["iou"]
         
-        def __call__(self, img):
+        def __call__(self, img, size=None):
+            n = len(img) if isinstance(img, (list, tuple)) else 1
             class Result:
                 def __init__(self):
-                    self.xyxy = [torch.tensor([])]
+                    self.xyxy = [torch.tensor(deteccoes) for _ in range(n)]
             return Result()
         
         def to(self, device):
@@ -398,76 +945,662 @@ def carregar_yolo_mock():
     
     return YOLOMock()
 
+# ========================================
+# VERSÕES DOS MODELOS (troca a quente)
+# ========================================
+def pasta_versao(tipo, nome):
+    return MODELS_DIR if nome == VERSAO_INICIAL else VERSOES_CONFIG["diretorio"] / tipo / nome
+
+GATES_VARIANTE = {
+    "classificacao": ("classificador", "top1_concordancia", "gate_top1"),
+    "yolo": ("yolo", "map50", "gate_map50"),
+}
+
+def variante_onnx_versao(tipo, pasta):
+    """(arquivo, info) do modelo ONNX base da pasta após o gate da variante, com o relatório da própria versão"""
+    arquivos = sorted(pasta.glob("*.onnx"))
+    derivados = {
+        derivado.name for arquivo in arquivos
+        for derivado in (
+            caminho_variante(arquivo, "int8"), caminho_variante(arquivo, ONNX_CONFIG["variante"]),
+            caminho_compartilhado(arquivo)
+        )
+        if derivado != arquivo
+    }
+    bases = [arquivo for arquivo in arquivos if arquivo.name not in derivados]
+    if not bases:
+        return None, None
+    chave, metrica, gate = GATES_VARIANTE[tipo]
+    return selecionar_variante(
+        bases[0], ONNX_CONFIG["variante"], pasta / RELATORIO_QUANTIZACAO, chave, metrica, ONNX_CONFIG[gate]
+    )
+
+def arquivo_versao(tipo, nome):
+    """(arquivo, info da variante) do modelo de uma versão; para a inicial, o mesmo que o carregamento do startup escolhe"""
+    candidatos = []
+    if INFERENCE_BACKEND == "onnx":
+        if nome == VERSAO_INICIAL:
+            candidatos.append(variante_classificador_onnx() if tipo == "classificacao" else variante_yolo_onnx())
+        else:
+            candidatos.append(variante_onnx_versao(tipo, pasta_versao(tipo, nome)))
+    
+    if nome == VERSAO_INICIAL:
+        if tipo == "classificacao":
+            nativos = [MODELS_DIR / n for n in ("resnet50_consolidado.keras", "modeloClassificacao.h5", "modeloClassificacao1.h5")]
+        else:
+            nativos = [MODELS_DIR / "bestYolov5_test.torchscript", MODELS_DIR / "bestYolov5_test.pt"]
+    else:
+        extensoes = (".keras", ".h5") if tipo == "classificacao" else (".torchscript", ".pt")
+        pasta = pasta_versao(tipo, nome)
+        nativos = [arquivo for extensao in extensoes for arquivo in sorted(pasta.glob(f"*{extensao}"))]
+    candidatos += [(arquivo, {"variant": "fp32"}) for arquivo in nativos]
+    
+    for candidato, variante_info in candidatos:
+        if candidato is not None and candidato.exists():
+            return candidato, variante_info
+    raise FileNotFoundError(f"Nenhum modelo para {tipo}/{nome} em {pasta_versao(tipo, nome)}")
+
+def carregar_versao_classificacao(nome):
+    """(recursos, info) de uma versão do classificador, carregada e aquecida sem tocar na ativa"""
+    if MOCK_MODELS:
+        modelo = construir_classificador_mock()
+        compilado = compilar_classificador(modelo)
+        info = {"name": "MockClassifier", "is_mock": True, "backend": "native", "variant": "fp32", "quantization": None}
+    else:
+        arquivo, variante_info = arquivo_versao("classificacao", nome)
+        logger.info(f"📚 Carregando classificador {nome}: {arquivo.name}")
+        if arquivo.suffix == ".onnx":
+            modelo = compilado = ClassificadorONNX(
+                arquivo, ONNX_CONFIG["intra_threads"], ONNX_CONFIG["inter_threads"], ONNX_CONFIG["pesos_compartilhados"]
+            )
+            backend = "onnx"
+        else:
+            modelo = importar_tensorflow().keras.models.load_model(str(arquivo), compile=False)
+            compilado = compilar_classificador(modelo)
+            backend = "native"
+        info = {
+            "name": arquivo.name, "is_mock": False, "backend": backend,
+            "variant": variante_info["variant"], "quantization": variante_info.get("gate"),
+        }
+    
+    logger.info(f"🔥 Aquecendo classificador {nome}...")
+    compilado(np.zeros((1, 224, 224, 3), dtype=np.float32))
+    extrator = criar_extrator(modelo, info) if EMBEDDINGS_CONFIG["habilitado"] else None
+    return {"modelo": modelo, "compilado": compilado, "extrator": extrator}, info
+
+def carregar_versao_yolo(nome):
+    """(recursos, info) de uma versão do YOLO, carregada e aquecida sem tocar na ativa"""
+    if MOCK_MODELS:
+        modelo = carregar_yolo_mock(MOCK_YOLO_BOXES)
+    else:
+        arquivo, variante_info = arquivo_versao("yolo", nome)
+        logger.info(f"📦 Carregando YOLO {nome}: {arquivo.name}")
+        if arquivo.suffix == ".onnx":
+            modelo = DetectorONNX(
+                arquivo, ONNX_CONFIG["yolo_size"],
+                ONNX_CONFIG["intra_threads"], ONNX_CONFIG["inter_threads"], ONNX_CONFIG["pesos_compartilhados"]
+            )
+            modelo.variante_info = variante_info
+        elif arquivo.suffix == ".torchscript":
+            importar_torch()
+            modelo = DetectorTorchScript(arquivo, device=HARDWARE_CONFIG['device'])
+        else:
+            modelo = carregar_yolo_pt(arquivo)
+    preparar_yolo(modelo)
+    return {"modelo": modelo}, info_detector(modelo)
+
+def chave_versao(tipo, nome, info):
+    """Versão de um modelo nas chaves do cache (arquivos da versão + info)"""
+    pasta = pasta_versao(tipo, nome)
+    arquivos = sorted(
+        (p.name, p.stat().st_size, int(p.stat().st_mtime))
+        for p in (pasta.iterdir() if pasta.is_dir() else ())
+        if p.is_file() and p.suffix in (".keras", ".h5", ".pt", ".torchscript", ".onnx")
+    )
+    base = [os.getenv("MODEL_VERSION", ""), arquivos] if nome == VERSAO_INICIAL else [tipo, nome, arquivos]
+    return chave_cache(base, info)[:16]
+
+def registrar_versoes_iniciais():
+    """Registra os modelos carregados no startup como a versão ativa "padrao" de cada tipo"""
+    iniciais = {
+        "classificacao": (modelo_classificacao, {
+            "modelo": modelo_classificacao, "compilado": classificador_compilado, "extrator": extrator_embeddings
+        }, CLASSIFIER_INFO, VERSAO_MODELOS["classificacao"]),
+        "yolo": (modelo_yolo, {"modelo": modelo_yolo}, DETECTOR_INFO, VERSAO_MODELOS["deteccao"]),
+    }
+    for tipo, (modelo, recursos, info, chave) in iniciais.items():
+        if modelo is None:
+            continue
+        registro = registros_modelos[tipo]
+        versao = registro.adicionar(VERSAO_INICIAL)
+        versao.pronta(recursos, info, chave)
+        versao.batcher = criar_batcher(versao)
+        registro.rotear(versao)
+        aplicar_versao_ativa(tipo)
+
+def aplicar_versao_ativa(tipo):
+    """Aponta os globais do modelo (usados fora das requisições: /models/info, benchmarks) para a versão ativa"""
+    global modelo_classificacao, classificador_compilado, extrator_embeddings, batcher_classificacao
+    global modelo_yolo, batcher_yolo
+    
+    versao = registros_modelos[tipo].ativa
+    if tipo == "classificacao":
+        modelo_classificacao = versao.recursos["modelo"]
+        classificador_compilado = versao.recursos["compilado"]
+        extrator_embeddings = versao.recursos["extrator"]
+        batcher_classificacao = versao.batcher
+        CLASSIFIER_INFO.update(versao.info)
+        VERSAO_MODELOS["classificacao"] = versao.chave
+    else:
+        modelo_yolo = versao.recursos["modelo"]
+        batcher_yolo = versao.batcher
+        DETECTOR_INFO.update(versao.info)
+        VERSAO_MODELOS["deteccao"] = versao.chave
+    CARREGAMENTO["modelos"][tipo] = "pronto"
+
+def iniciar_carregamento_versao(tipo, nome):
+    """Carrega e aquece uma versão em segundo plano (thread própria); a troca é feita por `sincronizar_versoes`"""
+    versao = registros_modelos[tipo].adicionar(nome)
+    carregar = carregar_versao_classificacao if tipo == "classificacao" else carregar_versao_yolo
+    
+    async def carregar_em_segundo_plano():
+        inicio = time.perf_counter()
+        try:
+            recursos, info = await asyncio.to_thread(carregar, nome)
+            versao.pronta(recursos, info, chave_versao(tipo, nome, info))
+            versao.batcher = criar_batcher(versao)
+            if governador_memoria is not None:
+                governador_memoria.calibrar(aparar=False)
+            logger.info(f"✅ Versão {tipo}/{nome} pronta em {time.perf_counter() - inicio:.1f}s")
+        except Exception as e:
+            versao.falhou(e)
+            logger.error(f"❌ Erro ao carregar a versão {tipo}/{nome}: {e}")
+        sinal_versoes.set()
+    
+    tarefa = asyncio.create_task(carregar_em_segundo_plano())
+    tarefas_modelos.add(tarefa)
+    tarefa.add_done_callback(tarefas_modelos.discard)
+
+def estado_desejado(estado, tipo):
+    """Roteamento desejado de um tipo de modelo (de MODELS_STATE), com os padrões"""
+    return {
+        "ativa": VERSAO_INICIAL, "canario": None, "fracao_canario": 0.0, "sombra": None, "fracao_sombra": 0.0,
+        **estado.get(tipo, {}),
+    }
+
+def sincronizar_versoes():
+    """Reconcilia as versões carregadas com o estado desejado
+    
+    Versões pedidas e ainda não carregadas começam a carregar; o roteamento
+    muda só com as versões prontas (até lá a ativa anterior continua
+    atendendo); versões prontas que saíram do estado desejado são retiradas.
+    """
+    estado = ler_estado(VERSOES_CONFIG["estado"])
+    for tipo, registro in registros_modelos.items():
+        alvo = estado_desejado(estado, tipo)
+        if alvo != alvos_sincronizados.get(tipo):
+            # Estado novo: versões que falharam podem ser tentadas de novo
+            for nome in [n for n, v in registro.versoes.items() if v.estado == "erro"]:
+                del registro.versoes[nome]
+            alvos_sincronizados[tipo] = alvo
+        # Canário/sombra com fração 0 não precisam ficar carregados
+        nomes = {
+            alvo["ativa"],
+            alvo["canario"] if alvo["fracao_canario"] > 0 else None,
+            alvo["sombra"] if alvo["fracao_sombra"] > 0 else None,
+        } - {None}
+        for nome in nomes:
+            if nome not in registro.versoes:
+                iniciar_carregamento_versao(tipo, nome)
+        
+        def pronta(nome):
+            versao = registro.versoes.get(nome)
+            return versao if versao is not None and versao.recursos is not None else None
+        
+        ativa = pronta(alvo["ativa"]) or registro.ativa
+        if ativa is None:
+            continue
+        anterior = registro.ativa
+        if registro.rotear(ativa, pronta(alvo["canario"]), float(alvo["fracao_canario"]),
+                           pronta(alvo["sombra"]), float(alvo["fracao_sombra"])):
+            aplicar_versao_ativa(tipo)
+            if anterior is not registro.ativa:
+                logger.info(f"🔀 {tipo}: versão ativa {anterior.nome if anterior else None} -> {registro.ativa.nome}")
+        
+        for versao in list(registro.versoes.values()):
+            if versao.estado == "pronta" and versao.nome not in nomes:
+                registro.retirar(versao)
+
+def iniciar_sincronizacao_versoes():
+    global tarefa_versoes, sinal_versoes
+    sinal_versoes = asyncio.Event()
+    tarefa_versoes = asyncio.create_task(laco_versoes())
+
+async def laco_versoes():
+    """Aplica o estado desejado a cada MODELS_SYNC_S (ou logo após um carregamento/alteração)"""
+    while True:
+        try:
+            sincronizar_versoes()
+        except Exception as e:
+            logger.error(f"❌ Erro ao sincronizar versões dos modelos: {e}")
+        try:
+            await asyncio.wait_for(sinal_versoes.wait(), VERSOES_CONFIG["intervalo_s"])
+        except asyncio.TimeoutError:
+            pass
+        sinal_versoes.clear()
+
+def descarregar_versao(versao):
+    """Libera uma versão drenada: para o batcher e solta os objetos do modelo"""
+    logger.info(f"♻️ Descarregando {versao.tipo}/{versao.nome}")
+    if versao.batcher is not None:
+        tarefa = asyncio.get_running_loop().create_task(versao.batcher.parar())
+        tarefas_modelos.add(tarefa)
+        tarefa.add_done_callback(tarefas_modelos.discard)
+    versao.recursos = None
+    versao.batcher = None
+    gc.collect()
+    if governador_memoria is not None:
+        governador_memoria.calibrar(aparar=False)
+
+def versao_em_uso(tipo):
+    """Versão que atende a requisição atual (escolhida em `rotear`); fora de uma requisição, a ativa"""
+    escolhas = versoes_requisicao()
+    if escolhas and tipo in escolhas:
+        return escolhas[tipo][0]
+    return registros_modelos[tipo].ativa
+
+def sombrear(tipo, executar, *args, comparar=None):
+    """Repete a chamada na versão sombra da requisição em segundo plano (a resposta não espera)
+    
+    `comparar(resultado_sombra)` diz se a sombra concordou com a versão servida.
+    """
+    escolhas = versoes_requisicao()
+    sombra = escolhas[tipo][1] if escolhas and tipo in escolhas else None
+    if sombra is None:
+        return
+    registro = registros_modelos[tipo]
+    registro.reservar(sombra)
+    
+    async def executar_na_sombra():
+        try:
+            resultado = await executar(*args, versao=sombra)
+            if comparar is not None:
+                sombra.comparar(comparar(resultado))
+        except Exception as e:
+            logger.warning(f"⚠️ Sombra {tipo}/{sombra.nome} falhou: {e}")
+        finally:
+            registro.liberar(sombra)
+    
+    tarefa = asyncio.create_task(executar_na_sombra())
+    tarefas_modelos.add(tarefa)
+    tarefa.add_done_callback(tarefas_modelos.discard)
+
+@contextmanager
+def medir_versao(versao):
+    """Latência de uma chamada ao modelo (com a espera no lote) nas estatísticas da versão e no /metrics"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        versao.observar(0, erro=True)
+        raise
+    ms = (time.perf_counter() - inicio) * 1000
+    versao.observar(ms)
+    observar_modelo(versao.tipo, versao.nome, ms)
+
+# ========================================
+# PRÉ-FORK (servidor_prefork.py)
+# ========================================
+def modelos_onnx_compartilhaveis():
+    """Arquivos ONNX que os workers vão carregar (para gerar as versões com pesos em mmap)"""
+    if INFERENCE_BACKEND != "onnx" or MOCK_MODELS:
+        return []
+    return [caminho for caminho, _ in (variante_classificador_onnx(), variante_yolo_onnx()) if caminho.exists()]
+
+def preparar_prefork():
+    """Roda no processo pai antes do fork: o que fica carregado aqui é herdado copy-on-write
+    
+    Só entra o que não cria threads nem contexto de GPU: os imports dos
+    frameworks e o YOLO TorchScript (tensores no heap do pai). Sessões do
+    ONNX Runtime e o modelo Keras são criados em cada worker no startup.
+    """
+    global modelo_yolo
+    
+    if HARDWARE_CONFIG['device'] == 'cuda':
+        logger.info("👥 GPU: frameworks e modelos carregados em cada worker")
+        return
+    if INFERENCE_BACKEND == "onnx" and not MOCK_MODELS:
+        import onnxruntime  # noqa: F401
+        return
+    
+    importar_tensorflow()
+    importar_torch()
+    if MOCK_MODELS:
+        return
+    try:
+        modelo = carregar_yolo_torchscript()
+    except Exception as e:
+        logger.info(f"👥 YOLO será carregado em cada worker ({e})")
+        return
+    modelo.conf = YOLO_CONFIG["conf"]
+    modelo.iou = YOLO_CONFIG["iou"]
+    modelo_yolo = modelo
+    registrar_detector_info()
+    logger.info("👥 YOLO TorchScript carregado no processo pai (compartilhado pelos workers)")
+
 @app.on_event("startup")
 async def startup_event():
     """Inicialização"""
+    global executor_inferencia
     logger.info("🚀 Iniciando API...")
     
-    results = await asyncio.gather(
-        carregar_modelo_classificacao(),
-        carregar_modelo_yolo(),
-        return_exceptions=True
+    global tarefa_carregamento, governador_memoria
+    
+    with cronometrar(PERFIL_INICIALIZACAO, "executor"):
+        executor_inferencia = ExecutorInferencia(**EXECUTOR_CONFIG)
+        await executor_inferencia.aquecer()
+    
+    if MEMORIA_CONFIG["habilitado"]:
+        governador_memoria = GovernadorMemoria(
+            MEMORIA_CONFIG["limite_mb"] * MB,
+            orcamento=MEMORIA_CONFIG["orcamento_mb"] * MB,
+            espera_max_s=MEMORIA_CONFIG["espera_max_s"],
+            intervalo_s=MEMORIA_CONFIG["intervalo_s"],
+            observar=observar_memoria
+        )
+        governador_memoria.iniciar()
+    
+    # Aceita trabalhos já durante o carregamento; os workers começam quando os modelos estiverem prontos
+    abrir_fila_trabalhos()
+    
+    if MODEL_LOADING == "blocking":
+        await carregar_modelos()
+        logger.info("✅ API pronta!")
+    else:
+        tarefa_carregamento = asyncio.create_task(carregar_modelos())
+        logger.info("✅ API no ar, modelos carregando em segundo plano (/health/ready)")
+
+async def carregar_em_thread(nome, carregar):
+    """Roda um carregador (async, mas bloqueante) em uma thread própria"""
+    CARREGAMENTO["modelos"][nome] = "carregando"
+    try:
+        with cronometrar(PERFIL_INICIALIZACAO, f"carregar_{nome}"):
+            await asyncio.to_thread(asyncio.run, carregar())
+        CARREGAMENTO["modelos"][nome] = "pronto"
+    except Exception as e:
+        CARREGAMENTO["modelos"][nome] = "erro"
+        logger.error(f"❌ Erro ao carregar modelo {nome}: {e}")
+
+async def carregar_modelos():
+    """Carrega classificador e YOLO em paralelo, sem bloquear o event loop"""
+    CARREGAMENTO["fase"] = "carregando"
+    await asyncio.gather(
+        carregar_em_thread("classificacao", carregar_modelo_classificacao),
+        carregar_em_thread("yolo", carregar_modelo_yolo)
     )
     
-    for i, result in enumerate(results):
-        if isinstance(result, Exception):
-            logger.error(f"❌ Erro ao carregar modelo {i}: {result}")
+    with cronometrar(PERFIL_INICIALIZACAO, "extrator_embeddings"):
+        await asyncio.to_thread(preparar_extrator_embeddings)
+    atualizar_versao_modelos()
+    registrar_versoes_iniciais()
+    iniciar_sincronizacao_versoes()
+    if governador_memoria is not None:
+        # RSS com os modelos carregados: o orçamento das requisições é o que sobra do limite
+        governador_memoria.calibrar()
+    
+    CARREGAMENTO["fase"] = "pronto"
+    iniciar_trabalhadores()
+    PERFIL_INICIALIZACAO["total_ate_pronto"] = round((time.perf_counter() - _INICIO_IMPORT) * 1000, 3)
+    logger.info("✅ Modelos prontos!")
+    if STARTUP_PROFILE:
+        imprimir_perfil_inicializacao()
+
+def imprimir_perfil_inicializacao():
+    """Tabela com o tempo de cada fase do startup (--startup-profile)"""
+    print("\n" + "="*60)
+    print("⏱️  PERFIL DE INICIALIZAÇÃO")
+    print("="*60)
+    for fase, ms in PERFIL_INICIALIZACAO.items():
+        print(f"   {fase:<28}{ms:>12.1f} ms")
+    print("="*60 + "\n")
+
+def exigir_modelos(*nomes):
+    """Gate de prontidão: 503 enquanto os modelos não estiverem prontos"""
+    faltando = [nome for nome in nomes if CARREGAMENTO["modelos"][nome] != "pronto"]
+    if CARREGAMENTO["fase"] == "pronto" and not faltando:
+        return
+    if CARREGAMENTO["fase"] != "pronto":
+        raise HTTPException(
+            status_code=503,
+            detail="Modelos carregando, tente novamente em instantes",
+            headers={"Retry-After": "5"}
+        )
+    raise HTTPException(status_code=503, detail=f"Modelo não carregado: {', '.join(faltando)}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Encerramento"""
+    await parar_trabalhadores()
+    if tarefa_versoes is not None:
+        tarefa_versoes.cancel()
+    for registro in registros_modelos.values():
+        for versao in registro.versoes.values():
+            if versao.batcher is not None:
+                await versao.batcher.parar()
+    if governador_memoria is not None:
+        await governador_memoria.parar()
+    if executor_inferencia is not None:
+        executor_inferencia.encerrar()
+
+# ========================================
+# MICRO-BATCHING
+# ========================================
+class ResultadoYOLO:
+    """Resultado de uma única imagem extraído de um lote YOLO"""
+    def __init__(self, xyxy):
+        self.xyxy = [xyxy]
+
+def classificar_lote(img_arrays, versao=None):
+    """Forward pass único do classificador para um array (N, 224, 224, 3)
+    
+    Sem `versao`, usa o modelo ativo (globais).
+    """
+    recursos = versao.recursos if versao else {"modelo": modelo_classificacao, "compilado": classificador_compilado}
+    if recursos["compilado"] is not None:
+        return np.asarray(recursos["compilado"](img_arrays))
+    return recursos["modelo"].predict(img_arrays, verbose=0)
+
+def classificar_lote_embeddings(img_arrays, versao=None):
+    """Como `classificar_lote`, com os embeddings no mesmo forward pass: (N, classes + D)"""
+    extrator = versao.recursos["extrator"] if versao else extrator_embeddings
+    probabilidades, embeddings = extrator(img_arrays)
+    return np.concatenate([np.asarray(probabilidades), np.asarray(embeddings)], axis=1)
+
+def funcao_classificacao(versao=None):
+    extrator = versao.recursos["extrator"] if versao else extrator_embeddings
+    funcao = classificar_lote_embeddings if extrator is not None else classificar_lote
+    return partial(funcao, versao=versao) if versao else funcao
+
+def detectar_lote(itens, versao=None):
+    """Forward pass do YOLO para uma lista de (imagem, tamanho de entrada): um por tamanho"""
+    modelo = versao.recursos["modelo"] if versao else modelo_yolo
+    grupos = {}
+    for i, (_, tamanho) in enumerate(itens):
+        grupos.setdefault(tamanho, []).append(i)
+    
+    resultados = [None] * len(itens)
+    for tamanho, indices in grupos.items():
+        results = modelo([itens[i][0] for i in indices], size=tamanho)
+        for i, xyxy in zip(indices, results.xyxy):
+            resultados[i] = ResultadoYOLO(xyxy)
+    return resultados
+
+def criar_batcher(versao):
+    """Batcher de uma versão de modelo (None com micro-batching desabilitado)"""
+    if not BATCH_CONFIG["habilitado"]:
+        return None
+    if versao.tipo == "classificacao":
+        processar, tamanho_item = concatenar_e_dividir(funcao_classificacao(versao)), len
+    else:
+        processar, tamanho_item = partial(detectar_lote, versao=versao), None
+    batcher = MicroBatcher(
+        versao.tipo,
+        processar,
+        max_lote=BATCH_CONFIG["max_lote"],
+        max_espera_ms=BATCH_CONFIG["max_espera_ms"],
+        executor=executor_inferencia.pool_threads,
+        tamanho_item=tamanho_item
+    )
+    batcher.iniciar()
+    return batcher
+
+async def executar_classificacao(img_arrays, tempos=None, versao=None):
+    """Classifica um array (n, 224, 224, 3), agrupando com outras requisições
     
-    logger.info("✅ API pronta!")
+    Usa a versão da requisição (ou `versao`). Retorna (probabilidades (n,
+    classes), embeddings (n, D) ou None sem extrator).
+    """
+    versao = versao or versao_em_uso("classificacao")
+    with medir_versao(versao):
+        if versao.batcher is not None:
+            with cronometrar(tempos, "classificacao"):
+                saida = np.asarray(await versao.batcher.submeter(img_arrays))
+        else:
+            saida = np.asarray(await executor_inferencia.executar(
+                funcao_classificacao(versao), img_arrays, etapa="classificacao", tempos=tempos
+            ))
+    n = len(LABEL_COLS)
+    return saida[:, :n], (saida[:, n:] if saida.shape[1] > n else None)
+
+async def executar_deteccao(img, tamanho, tempos=None, versao=None):
+    """Detecta em uma imagem com entrada `tamanho`, agrupando com outras requisições"""
+    versao = versao or versao_em_uso("yolo")
+    with medir_versao(versao):
+        if versao.batcher is not None:
+            with cronometrar(tempos, "yolo"):
+                return await versao.batcher.submeter((img, tamanho))
+        resultados = await executor_inferencia.executar(
+            partial(detectar_lote, versao=versao), [(img, tamanho)], etapa="yolo", tempos=tempos
+        )
+    return resultados[0]
+
+def resposta_fila_cheia(e):
+    """503 com Retry-After quando o executor não admite mais requisições"""
+    logger.warning(f"⏳ Requisição rejeitada: {e}")
+    return HTTPException(
+        status_code=503,
+        detail="Servidor ocupado, tente novamente em instantes",
+        headers={"Retry-After": "1"}
+    )
+
+@asynccontextmanager
+async def reservar_memoria(rota, tempos, contents=None, caixas=0, vistas=None, tamanho=None,
+                           mosaico=None, deteccao=True, reduzir=None, esperar_sempre=False):
+    """Reserva no governador o pico de memória estimado da requisição (None com o governador desligado)
+
+    `contents` é a foto a decodificar (dimensões lidas só do cabeçalho);
+    sem ela a imagem já está decodificada (sessão do `imagem_id`).
+    """
+    if governador_memoria is None:
+        yield None
+        return
+    custo = estimar_bytes(
+        dimensoes_imagem(contents) if contents else None,
+        len(contents) if contents else 0,
+        tamanho or HARDWARE_CONFIG['target_size'],
+        caixas, len(vistas) if vistas else 1,
+        mosaico["max_tiles"] if mosaico else 0, mosaico["tamanho"] if mosaico else 0,
+        UPLOAD_CONFIG["jpeg_draft"] if reduzir is None else reduzir, deteccao,
+        MEMORIA_CONFIG["mb_deteccao"], MEMORIA_CONFIG["mb_caixa"]
+    )
+    async with governador_memoria.reservar(custo, rota, tempos, esperar_sempre) as reserva:
+        yield reserva
+
+def anexar_memoria(conteudo, reserva):
+    """Memória estimada e pico de RSS da requisição em `memoria` (para dimensionar a instância)"""
+    if reserva is not None:
+        conteudo["memoria"] = reserva.resumo()
+
+# ========================================
+# CACHE DE RESULTADOS
+# ========================================
+def atualizar_versao_modelos():
+    """Versão dos modelos carregados no startup (info + arquivos de models-ia) usada nas chaves do cache"""
+    VERSAO_MODELOS["classificacao"] = chave_versao("classificacao", VERSAO_INICIAL, CLASSIFIER_INFO)
+    VERSAO_MODELOS["deteccao"] = chave_versao("yolo", VERSAO_INICIAL, DETECTOR_INFO)
+
+async def identificar_conteudo(contents, tempos=None):
+    """SHA-256 do upload (None com o cache desabilitado)"""
+    if cache_resultados is None:
+        return None
+    return await executor_inferencia.executar(digest_conteudo, contents, etapa="hash", tempos=tempos)
+
+def chave_deteccao(origem, degrau, mosaico=None, versao=None):
+    versao = versao or versao_em_uso("yolo")
+    modelo = versao.recursos["modelo"]
+    return chave_cache(
+        "deteccao", origem, versao.chave,
+        getattr(modelo, 'conf', YOLO_CONFIG["conf"]), getattr(modelo, 'iou', YOLO_CONFIG["iou"]),
+        degrau, UPLOAD_CONFIG["jpeg_draft"],
+        mosaico and (mosaico, MOSAICO_CONFIG["iou_fusao"])
+    )
+
+def chave_classificacao(origem, caixa, vistas=None, versao=None):
+    versao = versao or versao_em_uso("classificacao")
+    return chave_cache("classificacao", origem, versao.chave, caixa, vistas)
+
+def origem_redimensionada(origem, tamanho):
+    """Identifica a imagem redimensionada derivada de um upload (depende do tamanho do letterbox)"""
+    return f"{origem}@{tamanho}" if origem else None
 
 # ========================================
 # FUNÇÕES AUXILIARES
 # ========================================
-def redimensionar_imagem(img, target_size=None):
-    """Redimensiona mantendo proporção"""
-    if target_size is None:
-        target_size = HARDWARE_CONFIG['target_size']
-    
-    w, h = img.size
-    scale = min(target_size / w, target_size / h)
-    
-    new_w, new_h = int(w * scale), int(h * scale)
-    img_resized = img.resize((new_w, new_h), Image.Resampling.BILINEAR)
-    
-    img_padded = Image.new('RGB', (target_size, target_size), (0, 0, 0))
-    paste_x = (target_size - new_w) // 2
-    paste_y = (target_size - new_h) // 2
-    img_padded.paste(img_resized, (paste_x, paste_y))
-    
-    return img_padded, {
-        "original_size": {"width": w, "height": h},
-        "resized_size": {"width": new_w, "height": new_h},
-        "final_size": {"width": target_size, "height": target_size},
-        "padding": {"x": paste_x, "y": paste_y},
-        "scale_factor": scale
-    }
+def modo_preprocessamento(info=None):
+    """ResNet (modelo padrão) usa o preprocess_input da ResNet (modo 'caffe'); os demais, /255"""
+    info = info or CLASSIFIER_INFO
+    if info.get("name") and "resnet" in info["name"].lower():
+        return "resnet"
+    return "escala"
 
-def image_to_base64(img):
-    """Converte PIL Image para base64"""
-    buffered = io.BytesIO()
-    img.save(buffered, format="JPEG", quality=90)
-    return base64.b64encode(buffered.getvalue()).decode()
+def preprocessar_recortes(recortes):
+    """Monta um único array contíguo (N, 224, 224, 3) float32 para o classificador"""
+    return montar_lote_recortes(recortes, modo_preprocessamento())
 
-def processar_deteccoes_yolo(results, img_original):
-    """Processa resultados YOLO"""
+def recortar_e_preprocessar(img, coords, vistas=None, versao=None):
+    """Recorta as caixas (xmin, ymin, xmax, ymax) da imagem (array RGB) direto no lote do classificador
+    
+    Com `vistas` (TTA), o lote traz as vistas de cada recorte em sequência.
+    O pré-processamento é o do classificador da `versao` (padrão: o ativo).
+    """
+    lote = montar_lote(img, coords, modo_preprocessamento(versao.info if versao else None))
+    return expandir_lote(lote, vistas) if vistas else lote
+
+def processar_deteccoes_yolo(results, conf=None, versao=None):
+    """Processa resultados YOLO (com `conf`, descarta as detecções abaixo dele)
+    
+    Os nomes das classes são os da `versao` (padrão: o modelo ativo).
+    """
+    modelo = versao.recursos["modelo"] if versao else modelo_yolo
     deteccoes = []
     
     try:
         if not hasattr(results, 'xyxy') or len(results.xyxy[0]) == 0:
             return deteccoes
         
-        deteccoes_tensor = results.xyxy[0].cpu().numpy()
+        deteccoes_tensor = results.xyxy[0]
+        if hasattr(deteccoes_tensor, 'cpu'):
+            deteccoes_tensor = deteccoes_tensor.cpu().numpy()
         
-        for i, (*box, conf, cls) in enumerate(deteccoes_tensor):
+        for i, (*box, confianca, cls) in enumerate(deteccoes_tensor):
             x1, y1, x2, y2 = map(int, box)
-            confidence = float(conf)
+            confidence = float(confianca)
             class_id = int(cls)
+            if conf is not None and confidence < conf:
+                continue
 
-            cropped_img = img_original.crop((x1, y1, x2, y2))
-            subimagem_base64 = image_to_base64(cropped_img)
-            
-            if hasattr(modelo_yolo, 'names') and class_id in modelo_yolo.names:
-                class_name = modelo_yolo.names[class_id]
+            if hasattr(modelo, 'names') and class_id in modelo.names:
+                class_name = modelo.names[class_id]
             else:
                 class_name = f"class_{class_id}"
             
@@ -477,8 +1610,7 @@ def processar_deteccoes_yolo(results, img_original):
                 "xmax": x2,
                 "ymax": y2,
                 "classe": class_name,
-                "confianca": confidence,
-                "subimagem": subimagem_base64
+                "confianca": confidence
             })
             
     except Exception as e:
@@ -486,6 +1618,563 @@ def processar_deteccoes_yolo(results, img_original):
         
     return deteccoes
 
+def processar_deteccoes_mosaico(results, plano, resize_info, fusao, conf=None, versao=None):
+    """Une a visão global (primeiro resultado) e as janelas do mosaico e processa como um resultado só"""
+    unidas = unir_mosaico(
+        results[0].xyxy[0], [r.xyxy[0] for r in results[1:]], plano, resize_info,
+        fusao, MOSAICO_CONFIG["iou_fusao"]
+    )
+    return processar_deteccoes_yolo(ResultadoYOLO(unidas), conf, versao)
+
+def finalizar_tempos(resposta, tempos):
+    """Server-Timing na resposta e tempos por etapa no histograma do /metrics"""
+    resposta.headers["Server-Timing"] = server_timing(tempos)
+    observar_etapas(tempos)
+
+def validar_modo_recorte(crops):
+    """Valida o parâmetro ?crops="""
+    if crops not in MODOS_RECORTE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"crops inválido: {crops} (use {', '.join(MODOS_RECORTE)})"
+        )
+
+def opcoes_mosaico(tiles, tile_size, tile_overlap, max_tiles):
+    """Valida ?tiles= e ajustes; retorna as opções do mosaico (None = modo normal)"""
+    if not (MOSAICO_CONFIG["padrao"] if tiles is None else tiles):
+        return None
+    
+    versao = versao_em_uso("yolo")  # None enquanto os modelos carregam em segundo plano
+    modelo = versao.recursos["modelo"] if versao else None
+    tamanho = tile_size or MOSAICO_CONFIG["tamanho"] or getattr(modelo, 'tamanho', HARDWARE_CONFIG['target_size'])
+    sobreposicao = MOSAICO_CONFIG["sobreposicao"] if tile_overlap is None else tile_overlap
+    limite = max_tiles or MOSAICO_CONFIG["max_tiles"]
+    if not 128 <= tamanho <= 2048:
+        raise HTTPException(status_code=400, detail="tile_size deve estar entre 128 e 2048")
+    if not 0 <= sobreposicao <= 0.5:
+        raise HTTPException(status_code=400, detail="tile_overlap deve estar entre 0 e 0.5")
+    if not 1 <= limite <= MOSAICO_CONFIG["limite_tiles"]:
+        raise HTTPException(status_code=400, detail=f"max_tiles deve estar entre 1 e {MOSAICO_CONFIG['limite_tiles']}")
+    return {"tamanho": tamanho, "sobreposicao": sobreposicao, "max_tiles": limite, "fusao": MOSAICO_CONFIG["fusao"]}
+
+def requisicoes_em_andamento():
+    return executor_inferencia.estatisticas()["em_andamento"] if executor_inferencia else 0
+
+def validar_qualidade(quality):
+    """Valida o parâmetro ?quality="""
+    if quality != "auto" and controle_qualidade.degrau(quality) is None:
+        tamanhos = ", ".join(str(t) for t, _ in QOS_CONFIG["escada"])
+        raise HTTPException(
+            status_code=400,
+            detail=f"quality inválido: {quality} (use {', '.join(QUALIDADES)} ou um tamanho: {tamanhos})"
+        )
+
+def escolher_qualidade(quality):
+    """Degrau (tamanho, conf) da requisição: ?quality= explícito ou escolhido pela carga (auto)"""
+    if quality == "auto":
+        if not QOS_CONFIG["habilitado"]:
+            return controle_qualidade.degrau("high")
+        return controle_qualidade.escolher(requisicoes_em_andamento())
+    validar_qualidade(quality)
+    return controle_qualidade.degrau(quality)
+
+def vistas_tta(tta):
+    """Vistas de TTA da requisição (?tta=, padrão TTA_DEFAULT) ou None"""
+    return TTA_CONFIG["vistas"] if (TTA_CONFIG["padrao"] if tta is None else tta) else None
+
+def tamanho_inferencia(tamanho, versao=None):
+    """Tamanho de entrada efetivo do YOLO (exportações com entrada fixa ignoram o pedido)"""
+    modelo = (versao or versao_em_uso("yolo")).recursos["modelo"]
+    if getattr(modelo, 'dinamico', True):
+        return tamanho
+    return getattr(modelo, 'tamanho', tamanho)
+
+# ========================================
+# PIPELINES
+# ========================================
+async def pipeline_deteccao(contents, tempos, origem=None, mosaico=None, degrau=None, quality="auto"):
+    """Decodifica, redimensiona e detecta; retorna (imagem, resize_info, deteccoes)
+    
+    Com `origem` (hash do upload), as detecções vêm do cache quando possível;
+    a imagem é sempre decodificada, pois alimenta a sessão e os recortes.
+    Com `mosaico` (opções de `opcoes_mosaico`), detecta também em janelas
+    da foto em resolução maior; o plano usado é anotado em `mosaico`.
+    `degrau` (tamanho, conf) é o de `escolher_qualidade`; o usado fica em
+    `resize_info["qualidade"]`. Usa a versão do YOLO da requisição e repete
+    a detecção na versão sombra, se houver.
+    """
+    versao = versao_em_uso("yolo")
+    tamanho, conf = degrau or controle_qualidade.degrau("high")
+    if mosaico:
+        img_resized, resize_info, janelas, plano, ms_redimensionamento = await executor_inferencia.executar_imagem(
+            preparar_mosaico, contents, tamanho, mosaico["tamanho"],
+            mosaico["sobreposicao"], mosaico["max_tiles"], UPLOAD_CONFIG["jpeg_draft"],
+            etapa="decodificacao", tempos=tempos
+        )
+    else:
+        img_resized, resize_info, ms_redimensionamento = await executor_inferencia.executar_imagem(
+            preparar_imagem_cronometrada, contents, tamanho, UPLOAD_CONFIG["jpeg_draft"],
+            etapa="decodificacao", tempos=tempos
+        )
+    tempos["decodificacao"] = round(tempos["decodificacao"] - ms_redimensionamento, 3)
+    tempos["redimensionamento"] = ms_redimensionamento
+    resize_info["qualidade"] = {
+        "modo": quality,
+        "tamanho": tamanho,
+        "tamanho_inferencia": tamanho_inferencia(mosaico["tamanho"] if mosaico else tamanho, versao),
+        "conf": conf,
+    }
+    
+    chave = chave_deteccao(origem, (tamanho, conf), mosaico, versao) if cache_resultados is not None and origem else None
+    if mosaico:
+        mosaico.update(tiles=len(janelas), grade=list(plano["grade"]), escala=round(plano["escala"], 4))
+    if chave:
+        deteccoes = cache_resultados.obter("deteccao", chave)
+        if deteccoes is not None:
+            logger.info("♻️ Detecções do cache")
+            return img_resized, resize_info, deteccoes
+    
+    if mosaico:
+        # Visão global + janelas no mesmo forward pass (o lote já está formado, sem micro-batching)
+        logger.info(f"🔍 Executando detecção em mosaico ({len(janelas)} janelas)...")
+        with medir_versao(versao):
+            results = await executor_inferencia.executar(
+                partial(detectar_lote, versao=versao), [(img, mosaico["tamanho"]) for img in (img_resized, *janelas)],
+                etapa="yolo", tempos=tempos
+            )
+        deteccoes = await executor_inferencia.executar(
+            processar_deteccoes_mosaico, results, plano, resize_info, mosaico["fusao"], conf, versao,
+            etapa="pos_processamento", tempos=tempos
+        )
+    else:
+        logger.info(f"🔍 Executando detecção ({tamanho} px)...")
+        results = await executar_deteccao(img_resized, tamanho, tempos, versao)
+        
+        deteccoes = await executor_inferencia.executar(
+            processar_deteccoes_yolo, results, conf, versao, etapa="pos_processamento", tempos=tempos
+        )
+        sombrear(
+            "yolo", executar_deteccao, img_resized, tamanho,
+            comparar=lambda resultado: len(processar_deteccoes_yolo(resultado, conf)) == len(deteccoes)
+        )
+    if chave:
+        cache_resultados.guardar("deteccao", chave, deteccoes)
+    return img_resized, resize_info, deteccoes
+
+async def classificar_caixas(img, caixas, vistas=None, tempos=None, versao=None):
+    """Recorta, pré-processa e classifica as caixas na versão da requisição (ou `versao`)"""
+    versao = versao or versao_em_uso("classificacao")
+    lote = await executor_inferencia.executar(
+        recortar_e_preprocessar, img, caixas, vistas, versao,
+        etapa="preprocessamento", tempos=tempos
+    )
+    return await executar_classificacao(lote, tempos, versao)
+
+async def pipeline_classificacao(img, deteccoes, tempos, origem=None, vistas=None, embeddings=False):
+    """Classifica as caixas de `deteccoes` em um único forward pass
+    
+    Com `origem` (identificador da imagem), caixas já classificadas vêm do
+    cache e só as restantes vão para o modelo. Com `vistas` (TTA), todas
+    as vistas de todas as caixas vão no mesmo lote e cada caixa recebe a
+    média das suas vistas e a medida de incerteza em `tta`. Com
+    `embeddings`, cada item traz o `embedding` (array) do mesmo forward
+    pass (o cache não guarda embeddings, então todas as caixas vão para o modelo).
+    """
+    versao = versao_em_uso("classificacao")
+    coords = [chave_caixa(det) for det in deteccoes]
+    unicas = list(dict.fromkeys(coords))
+    
+    classificadas = {}
+    chaves = {}
+    vetores = {}
+    if cache_resultados is not None and origem:
+        for caixa in unicas:
+            chaves[caixa] = chave_classificacao(origem, caixa, vistas, versao)
+            valor = None if embeddings else cache_resultados.obter("classificacao", chaves[caixa])
+            if valor is not None:
+                classificadas[caixa] = valor
+    
+    faltando = [caixa for caixa in unicas if caixa not in classificadas]
+    if faltando:
+        # Todas as caixas em um único forward pass (que pode dividir lote com outras requisições)
+        preds, embs = await classificar_caixas(img, faltando, vistas, tempos, versao)
+        escolhidas = preds.argmax(axis=1)
+        sombrear(
+            "classificacao", classificar_caixas, img, faltando, vistas,
+            comparar=lambda resultado: np.array_equal(resultado[0].argmax(axis=1), escolhidas)
+        )
+        if vistas:
+            preds, concordancia, variancia = agregar(preds, len(vistas))
+            if embs is not None:
+                embs = embs.reshape(len(faltando), len(vistas), -1).mean(axis=1)
+        if embs is not None:
+            vetores = dict(zip(faltando, embs))
+
+        for i, (caixa, pred) in enumerate(zip(faltando, preds)):
+            index = np.argmax(pred)
+            classificadas[caixa] = {
+                "classe_classificacao": LABEL_COLS[index],
+                "confianca_classificacao": float(np.max(pred))
+            }
+            if vistas:
+                classificadas[caixa]["tta"] = {
+                    "vistas": len(vistas),
+                    "concordancia": round(float(concordancia[i]), 4),
+                    "variancia": round(float(variancia[i]), 6),
+                    "probabilidades": {rotulo: round(float(p), 4) for rotulo, p in zip(LABEL_COLS, pred)},
+                }
+            if caixa in chaves:
+                cache_resultados.guardar("classificacao", chaves[caixa], classificadas[caixa])
+    elif unicas:
+        logger.info(f"♻️ {len(unicas)} classificações do cache")
+
+    resultados = []
+    for det, caixa in zip(deteccoes, coords):
+        xmin, ymin, xmax, ymax = caixa
+        resultados.append({
+            "xmin": xmin,
+            "ymin": ymin,
+            "xmax": xmax,
+            "ymax": ymax,
+            "classe_deteccao": det.get("classe"),
+            "confianca_deteccao": det.get("confianca"),
+            **classificadas[caixa]
+        })
+        if embeddings:
+            resultados[-1]["embedding"] = vetores.get(caixa)
+    return resultados
+
+async def anexar_subimagens(itens, imagem_id, sessao, modo, tempos):
+    """Preenche `subimagem` de cada item conforme ?crops=.
+    
+    - full: JPEG do recorte (reaproveita os já codificados na sessão)
+    - thumb: miniatura JPEG
+    - none: sem recorte
+    - ref: sem recorte, com `subimagem_url` servida a partir da sessão
+    - blob: JPEG do recorte gravado no armazenamento de blobs, com `subimagem_blob`/`subimagem_url`
+    - blob_thumb: como blob, mais a miniatura em `subimagem_miniatura`
+    """
+    coords = [chave_caixa(item) for item in itens]
+    
+    if modo in ("none", "ref"):
+        for item, (xmin, ymin, xmax, ymax) in zip(itens, coords):
+            item["subimagem"] = None
+            if modo == "ref":
+                item["subimagem_url"] = (
+                    f"/imagens/{imagem_id}/recorte?xmin={xmin}&ymin={ymin}&xmax={xmax}&ymax={ymax}"
+                )
+        return
+    
+    formato = "thumb" if modo == "thumb" else "full"
+    prontas = sessao.subimagens if formato == "full" else {}
+    faltando = [caixa for caixa in dict.fromkeys(coords) if caixa not in prontas]
+    codificadas = {}
+    if faltando:
+        codificadas = dict(zip(faltando, await executor_inferencia.executar_imagem(
+            codificar_recortes, sessao.imagem, faltando, formato, etapa="codificacao", tempos=tempos
+        )))
+        if formato == "full":
+            prontas.update(codificadas)
+    jpegs = {caixa: prontas[caixa] if caixa in prontas else codificadas[caixa] for caixa in coords}
+    
+    if modo in ("full", "thumb"):
+        for item, caixa in zip(itens, coords):
+            item["subimagem"] = jpegs[caixa]
+        return
+    
+    miniaturas = {}
+    if modo == "blob_thumb":
+        unicas = list(jpegs)
+        miniaturas = dict(zip(unicas, await executor_inferencia.executar_imagem(
+            codificar_recortes, sessao.imagem, unicas, "thumb", etapa="codificacao", tempos=tempos
+        )))
+    with cronometrar(tempos, "armazenamento"):
+        blobs = {caixa: armazenamento_blobs.guardar(jpeg) for caixa, jpeg in jpegs.items()}
+    for item, caixa in zip(itens, coords):
+        item["subimagem"] = None
+        item["subimagem_blob"] = blobs[caixa]
+        item["subimagem_url"] = f"/blobs/{blobs[caixa]}"
+        if modo == "blob_thumb":
+            item["subimagem_miniatura"] = miniaturas[caixa]
+
+def anexar_imagem(conteudo, imagem_jpeg, modo, tempos):
+    """`imagem_redimensionada` em base64 ou, nos modos blob, `imagem_blob`/`imagem_url`"""
+    if modo not in ("blob", "blob_thumb"):
+        conteudo["imagem_redimensionada"] = imagem_jpeg
+        return
+    with cronometrar(tempos, "armazenamento"):
+        blob_id = armazenamento_blobs.guardar(imagem_jpeg)
+    conteudo["imagem_redimensionada"] = None
+    conteudo["imagem_blob"] = blob_id
+    conteudo["imagem_url"] = f"/blobs/{blob_id}"
+
+# Campos de uma região que dependem do recorte (descartados quando a caixa muda)
+CAMPOS_RECORTE = (
+    "classe_classificacao", "confianca_classificacao", "tta", "embedding", "historico", "mesma_lesao",
+    "subimagem", "subimagem_url", "subimagem_blob", "subimagem_miniatura",
+)
+
+def caixa_regiao(caixa):
+    """Coordenadas inteiras de uma caixa do delta; ValueError se for vazia"""
+    xmin, ymin, xmax, ymax = chave_caixa(caixa)
+    if xmax <= xmin or ymax <= ymin:
+        raise ValueError(f"Caixa vazia: {[xmin, ymin, xmax, ymax]}")
+    return {"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax}
+
+def aplicar_delta_regioes(regioes, delta):
+    """Aplica a edição às regiões; retorna (regiões, índices das que vão para o classificador)
+
+    `delta`: {"removidas": [caixa], "movidas": [{"de": caixa, "para": caixa}],
+    "adicionadas": [caixa]}, com as caixas identificadas pelas coordenadas.
+    Movidas mantêm a posição e os dados da detecção; adicionadas vão para o
+    final. Regiões ainda sem classificação também vão para o classificador.
+    Levanta LookupError se uma caixa removida/movida não está nas regiões.
+    """
+    regioes = [dict(regiao) for regiao in regioes]
+
+    def localizar(caixa):
+        alvo = chave_caixa(caixa)
+        for i, regiao in enumerate(regioes):
+            if chave_caixa(regiao) == alvo:
+                return i
+        raise LookupError(f"Região {list(alvo)} não encontrada")
+
+    def sem_recorte(regiao):
+        return {campo: valor for campo, valor in regiao.items() if campo not in CAMPOS_RECORTE}
+
+    for caixa in delta.get("removidas", []):
+        del regioes[localizar(caixa)]
+    alteradas = []
+    for movida in delta.get("movidas", []):
+        i = localizar(movida["de"])
+        regioes[i] = {**sem_recorte(regioes[i]), **caixa_regiao(movida["para"])}
+        alteradas.append(regioes[i])
+    for caixa in delta.get("adicionadas", []):
+        regioes.append({**sem_recorte(caixa), **caixa_regiao(caixa)})
+        alteradas.append(regioes[-1])
+
+    pendentes = [
+        i for i, regiao in enumerate(regioes)
+        if "classe_classificacao" not in regiao or any(regiao is alterada for alterada in alteradas)
+    ]
+    return regioes, pendentes
+
+async def sessao_regioes(imagem_id, imagem_blob, tempos):
+    """(imagem_id, sessão) da sessão ou, se expirou, de uma nova a partir do blob da imagem redimensionada"""
+    sessao = sessoes_imagem.obter(imagem_id) if imagem_id else None
+    if sessao is not None:
+        return imagem_id, sessao
+    if imagem_blob and armazenamento_blobs.tamanho(imagem_blob) is not None:
+        with cronometrar(tempos, "armazenamento"):
+            conteudo = armazenamento_blobs.ler(imagem_blob)
+        img = await executor_inferencia.executar_imagem(
+            decodificar_rgb, conteudo, etapa="decodificacao", tempos=tempos
+        )
+        imagem_id = sessoes_imagem.guardar(img, None, origem=f"blob:{imagem_blob}")
+        return imagem_id, sessoes_imagem.obter(imagem_id)
+    if imagem_id or imagem_blob:
+        raise HTTPException(status_code=410, detail="Imagem expirada, reenvie a imagem")
+    raise HTTPException(status_code=400, detail="Envie o imagem_id ou o imagem_blob")
+
+def exigir_embeddings(paciente_id, embeddings):
+    """Valida `paciente_id`/?embeddings=; retorna se a requisição usa embeddings"""
+    if not (paciente_id or embeddings):
+        return False
+    if paciente_id and not id_paciente_valido(paciente_id):
+        raise HTTPException(status_code=400, detail="paciente_id inválido (use letras, números, _ ou -)")
+    versao = versao_em_uso("classificacao")
+    if versao is None or versao.recursos["extrator"] is None or (paciente_id and indice_embeddings is None):
+        raise HTTPException(status_code=503, detail="Embeddings indisponíveis (EMBEDDINGS_ENABLED=0 ou modelo sem a saída)")
+    return True
+
+def acompanhar_lesoes(itens, paciente_id, analise_id, devolver, tempos):
+    """Compara os recortes com o histórico do paciente e os acrescenta ao índice
+    
+    Cada item ganha `historico` (k vizinhos mais próximos das análises
+    anteriores) e `mesma_lesao` (o mais próximo, se a similaridade passa de
+    EMBEDDINGS_MATCH); com `devolver`, `embedding` vai na resposta (float32).
+    """
+    vetores = [item.pop("embedding", None) for item in itens]
+    validos = [i for i, vetor in enumerate(vetores) if vetor is not None]
+    
+    if paciente_id and validos:
+        matriz = np.stack([vetores[i] for i in validos])
+        with cronometrar(tempos, "indice"):
+            vizinhos = indice_embeddings.buscar(paciente_id, matriz, EMBEDDINGS_CONFIG["k"])
+            for i, historico in zip(validos, vizinhos):
+                mais_proximo = historico[0] if historico else None
+                itens[i]["historico"] = historico
+                itens[i]["mesma_lesao"] = (
+                    mais_proximo if mais_proximo and mais_proximo["similaridade"] >= EMBEDDINGS_CONFIG["mesma_lesao"]
+                    else None
+                )
+            indice_embeddings.adicionar(paciente_id, matriz, [
+                {
+                    "analise_id": analise_id,
+                    "caixa": list(chave_caixa(itens[i])),
+                    "classe": itens[i]["classe_classificacao"],
+                    "confianca": round(itens[i]["confianca_classificacao"], 4),
+                    "subimagem_blob": itens[i].get("subimagem_blob"),
+                    # Embeddings de versões diferentes do classificador não são comparáveis
+                    "modelo": versao_em_uso("classificacao").chave,
+                }
+                for i in validos
+            ])
+    
+    if devolver:
+        for item, vetor in zip(itens, vetores):
+            item["embedding"] = None if vetor is None else np.asarray(vetor, dtype=np.float32).tobytes()
+
+async def analise_completa(contents, tempos, crops, mosaico, degrau, quality, vistas=None, progresso=None):
+    """Detecção + classificação de um upload (/predict/full e trabalhos assíncronos)
+    
+    `progresso(etapa)`, se dado, é aguardado no início de cada etapa.
+    Retorna o conteúdo da resposta, sem os tempos totais.
+    """
+    if progresso is None:
+        async def progresso(etapa):
+            pass
+    
+    await progresso("deteccao")
+    origem = await identificar_conteudo(contents, tempos)
+    img_resized, resize_info, deteccoes = await pipeline_deteccao(
+        contents, tempos, origem, mosaico, degrau, quality
+    )
+    origem_sessao = origem_redimensionada(origem, degrau[0])
+    imagem_id = sessoes_imagem.guardar(img_resized, resize_info, origem=origem_sessao)
+    
+    resultados = []
+    if deteccoes:
+        await progresso("classificacao")
+        resultados = await pipeline_classificacao(img_resized, deteccoes, tempos, origem_sessao, vistas)
+        await anexar_subimagens(resultados, imagem_id, sessoes_imagem.obter(imagem_id), crops, tempos)
+    
+    await progresso("codificacao")
+    imagem_jpeg = await executor_inferencia.executar_imagem(
+        codificar_jpeg, img_resized, etapa="codificacao", tempos=tempos
+    )
+    
+    conteudo = {
+        "boxes": deteccoes,
+        "resultados": resultados,
+        "dimensoes": resize_info,
+        "imagem_id": imagem_id,
+    }
+    anexar_imagem(conteudo, imagem_jpeg, crops, tempos)
+    if mosaico:
+        conteudo["mosaico"] = mosaico
+    return conteudo
+
+# ========================================
+# TRABALHOS ASSÍNCRONOS
+# ========================================
+def abrir_fila_trabalhos():
+    """Abre a fila em SQLite (no processo do worker: conexões SQLite não atravessam fork)"""
+    global fila_trabalhos, sinal_trabalhos
+    if not JOBS_CONFIG["habilitado"] or fila_trabalhos is not None:
+        return
+    fila_trabalhos = FilaTrabalhos(
+        JOBS_CONFIG["banco"],
+        arrendamento_s=JOBS_CONFIG["arrendamento_s"],
+        max_tentativas=JOBS_CONFIG["max_tentativas"],
+        ttl_s=JOBS_CONFIG["ttl_s"]
+    )
+    sinal_trabalhos = asyncio.Event()
+    logger.info(f"🗂️ Fila de trabalhos: {JOBS_CONFIG['banco']} {fila_trabalhos.contagem()}")
+
+def iniciar_trabalhadores():
+    """Inicia as tarefas que consomem a fila de trabalhos"""
+    if fila_trabalhos is None or tarefas_trabalhos:
+        return
+    for indice in range(max(1, JOBS_CONFIG["workers"])):
+        tarefas_trabalhos.append(asyncio.get_running_loop().create_task(trabalhador(indice)))
+    logger.info(f"👷 {len(tarefas_trabalhos)} workers de trabalhos assíncronos")
+
+async def parar_trabalhadores():
+    """Cancela os workers (trabalhos interrompidos voltam para a fila) e fecha o banco"""
+    global fila_trabalhos
+    for tarefa in tarefas_trabalhos:
+        tarefa.cancel()
+    await asyncio.gather(*tarefas_trabalhos, return_exceptions=True)
+    tarefas_trabalhos.clear()
+    if fila_trabalhos is not None:
+        fila_trabalhos.fechar()
+        fila_trabalhos = None
+
+async def trabalhador(indice):
+    """Laço de um worker: reserva, executa e grava o resultado; sem trabalho, espera um sinal ou 1 s
+    
+    As chamadas à fila (SQLite, que pode esperar o lock de outro worker) rodam
+    fora do event loop, para não travar as rotas /predict e o /health.
+    """
+    ultima_limpeza = 0.0
+    while True:
+        if indice == 0 and time.time() - ultima_limpeza > 60:
+            ultima_limpeza = time.time()
+            removidos = await asyncio.to_thread(fila_trabalhos.limpar)
+            if removidos:
+                logger.info(f"🧹 {removidos} trabalhos antigos removidos")
+        
+        try:
+            reservado = await asyncio.to_thread(fila_trabalhos.reservar)
+        except Exception as e:
+            logger.error(f"Erro ao reservar trabalho: {e}")
+            reservado = None
+        
+        if reservado is None:
+            # O sinal acorda na hora para trabalhos deste processo; o timeout cobre os de outros workers
+            try:
+                await asyncio.wait_for(sinal_trabalhos.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            sinal_trabalhos.clear()
+            continue
+        
+        await executar_trabalho(*reservado)
+
+async def executar_trabalho(trabalho_id, contents, parametros):
+    """Executa um trabalho da fila e grava o resultado (ou o erro)"""
+    start_time = time.time()
+    tempos = {}
+    try:
+        degrau = escolher_qualidade(parametros["quality"])
+        vistas = parametros.get("tta")
+        # Como nas rotas /predict: versões (ativa ou canário) fixas e reservadas durante o trabalho;
+        # sem memória no orçamento o trabalho espera (não falha como uma requisição)
+        with rotear(registros_modelos) as escolhas:
+            async with reservar_memoria(
+                "trabalho", tempos, contents, MEMORIA_CONFIG["caixas_previstas"], vistas, degrau[0],
+                parametros["mosaico"], esperar_sempre=True
+            ) as reserva:
+                conteudo = await analise_completa(
+                    contents, tempos, parametros["crops"], parametros["mosaico"], degrau, parametros["quality"],
+                    tuple(vistas) if vistas else None,
+                    lambda etapa: asyncio.to_thread(fila_trabalhos.progresso, trabalho_id, etapa)
+                )
+                anexar_memoria(conteudo, reserva)
+        tempo = time.time() - start_time
+        conteudo.update(
+            tempo_inferencia=round(tempo, 3),
+            tempos_etapas=tempos,
+            versoes_modelos={tipo: principal.nome for tipo, (principal, _) in escolhas.items()},
+            device=HARDWARE_CONFIG['device']
+        )
+        await asyncio.to_thread(fila_trabalhos.concluir, trabalho_id, conteudo)
+        observar_etapas(tempos)
+        logger.info(f"✅ Trabalho {trabalho_id[:8]}: {len(conteudo['boxes'])} detecções em {tempo:.2f}s")
+    except asyncio.CancelledError:
+        # Encerramento: volta para a fila e é retomado no próximo start (ou por outro worker).
+        # Síncrono de propósito: a tarefa já foi cancelada e o loop está parando
+        fila_trabalhos.liberar(trabalho_id)
+        raise
+    except Exception as e:
+        logger.error(f"Erro no trabalho {trabalho_id[:8]}: {e}")
+        await asyncio.to_thread(fila_trabalhos.falhar, trabalho_id, e)
+
+def exigir_fila_trabalhos():
+    if fila_trabalhos is None:
+        raise HTTPException(status_code=503, detail="Fila de trabalhos indisponível (JOBS_ENABLED=0)")
+
 # ========================================
 # ENDPOINTS
 # ========================================
@@ -496,7 +2185,7 @@ async def root():
         "version": "2.0.0",
         "status": "online",
         "hardware": HARDWARE_CONFIG,
-        "endpoints": ["/predict/detection", "/predict/classification", "/health"]
+        "endpoints": ["/predict/detection", "/predict/classification", "/predict/regions", "/predict/full", "/jobs", "/blobs", "/health", "/batching/stats", "/cache/stats", "/memory/stats", "/models/versions"]
     }
 
 @app.get("/favicon.ico", include_in_schema=False)
@@ -506,109 +2195,202 @@ async def favicon():
 
 @app.get("/health")
 async def health_check():
-    """Status da API"""
+    """Status da API (liveness + readiness)"""
+    pronto = CARREGAMENTO["fase"] == "pronto"
+    trabalhos = await asyncio.to_thread(fila_trabalhos.contagem) if fila_trabalhos else None
     return {
-        "status": "healthy",
+        "status": "healthy" if pronto else "loading",
+        "live": True,
+        "ready": pronto,
+        "carregamento": CARREGAMENTO,
         "models": {
             "classificacao": modelo_classificacao is not None,
             "classificador_info": CLASSIFIER_INFO,
-            "yolo": modelo_yolo is not None
+            "yolo": modelo_yolo is not None,
+            "versoes": {
+                tipo: {"ativa": r.ativa and r.ativa.nome, "canario": r.canario and r.canario.nome,
+                       "sombra": r.sombra and r.sombra.nome}
+                for tipo, r in registros_modelos.items()
+            },
         },
+        "executor": executor_inferencia.estatisticas() if executor_inferencia else None,
+        "sessoes_imagem": sessoes_imagem.estatisticas(),
+        "cache": cache_resultados.estatisticas() if cache_resultados else None,
+        "uploads": UPLOAD_CONFIG,
+        "mosaico": MOSAICO_CONFIG,
+        "qualidade": controle_qualidade.estatisticas(),
+        "trabalhos": trabalhos,
+        "tta": TTA_CONFIG,
+        "embeddings": {
+            "extrator": extrator_embeddings is not None,
+            **(indice_embeddings.estatisticas() if indice_embeddings else {}),
+        },
+        "blobs": armazenamento_blobs.estatisticas(),
+        "memoria": governador_memoria.estatisticas() if governador_memoria else None,
         "hardware": HARDWARE_CONFIG
     }
 
+@app.get("/health/live")
+async def health_live():
+    """Liveness: o processo responde (não depende dos modelos)"""
+    return {"live": True}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: 200 só quando os modelos estão prontos para receber tráfego"""
+    pronto = CARREGAMENTO["fase"] == "pronto"
+    return JSONResponse(
+        status_code=200 if pronto else 503,
+        content={"ready": pronto, "fase": CARREGAMENTO["fase"], "modelos": CARREGAMENTO["modelos"]},
+        headers=None if pronto else {"Retry-After": "5"}
+    )
+
 @app.post("/predict/detection")
-async def predict_detection(file: UploadFile = File(...)):
+async def predict_detection(
+    request: Request,
+    file: UploadFile = File(...),
+    crops: str = Query("full"),
+    tiles: bool = Query(None),
+    tile_size: int = Query(None),
+    tile_overlap: float = Query(None),
+    max_tiles: int = Query(None),
+    quality: str = Query("auto")
+):
     """Detecção de objetos"""
-    if modelo_yolo is None:
-        raise HTTPException(status_code=503, detail="Modelo YOLO não carregado")
+    exigir_modelos("yolo")
+    validar_modo_recorte(crops)
+    mosaico = opcoes_mosaico(tiles, tile_size, tile_overlap, max_tiles)
+    formato = escolher_formato(request.headers.get("accept"))
     
     try:
-        start_time = time.time()
-        
-        contents = await file.read()
-        img_original = Image.open(io.BytesIO(contents)).convert("RGB")
-        
-        img_resized, resize_info = redimensionar_imagem(img_original)
-        
-        logger.info("🔍 Executando detecção...")
-        results = modelo_yolo(img_resized)
-        
-        deteccoes = processar_deteccoes_yolo(results, img_resized)
-        
-        imagem_base64 = image_to_base64(img_resized)
-        
-        tempo = time.time() - start_time
-        logger.info(f"✅ {len(deteccoes)} detecções em {tempo:.2f}s")
+        async with executor_inferencia.admitir():
+            start_time = time.time()
+            tempos = {}
+            
+            degrau = escolher_qualidade(quality)
+            contents = await ler_upload(file, UPLOAD_CONFIG["max_bytes"])
+            async with reservar_memoria("deteccao", tempos, contents, tamanho=degrau[0], mosaico=mosaico) as reserva:
+                origem = await identificar_conteudo(contents, tempos)
+                img_resized, resize_info, deteccoes = await pipeline_deteccao(
+                    contents, tempos, origem, mosaico, degrau, quality
+                )
+            
+                origem_sessao = origem_redimensionada(origem, degrau[0])
+                imagem_id = sessoes_imagem.guardar(img_resized, resize_info, origem=origem_sessao)
+                await anexar_subimagens(deteccoes, imagem_id, sessoes_imagem.obter(imagem_id), crops, tempos)
+            
+                imagem_jpeg = await executor_inferencia.executar_imagem(
+                    codificar_jpeg, img_resized, etapa="codificacao", tempos=tempos
+                )
+            
+                tempo = time.time() - start_time
+                if not mosaico:
+                    controle_qualidade.observar(degrau[0], tempo * 1000, requisicoes_em_andamento())
+                logger.info(f"✅ {len(deteccoes)} detecções em {tempo:.2f}s {tempos}")
 
-        return JSONResponse(content={
-            "boxes": deteccoes,
-            "dimensoes": resize_info,
-            "imagem_redimensionada": imagem_base64,
-            "tempo_inferencia": round(tempo, 3),
-            "device": HARDWARE_CONFIG['device']
-        })
+                conteudo = {
+                    "boxes": deteccoes,
+                    "dimensoes": resize_info,
+                    "imagem_id": imagem_id,
+                    "tempo_inferencia": round(tempo, 3),
+                    "tempos_etapas": tempos,
+                    "device": HARDWARE_CONFIG['device']
+                }
+                anexar_imagem(conteudo, imagem_jpeg, crops, tempos)
+                anexar_memoria(conteudo, reserva)
+                if mosaico:
+                    conteudo["mosaico"] = mosaico
+                with cronometrar(tempos, "serializacao"):
+                    resposta = renderizar(conteudo, formato)
+                finalizar_tempos(resposta, tempos)
+                return resposta
     
+    except FilaCheia as e:
+        raise resposta_fila_cheia(e)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro na detecção: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/predict/classification")
-async def predict_classification(file: UploadFile = File(...), deteccoes_json: str = Form(...)):
-    """Classificação de subimagens"""
-    if modelo_classificacao is None:
-        raise HTTPException(status_code=503, detail="Modelo de classificação não carregado")
+async def predict_classification(
+    request: Request,
+    file: UploadFile = File(None),
+    deteccoes_json: str = Form(...),
+    imagem_id: str = Form(None),
+    paciente_id: str = Form(None),
+    analise_id: str = Form(None),
+    crops: str = Query("full"),
+    tta: bool = Query(None),
+    embeddings: bool = Query(False)
+):
+    """Classificação de subimagens
+    
+    Aceita a imagem redimensionada (`file`) ou o `imagem_id` retornado pela
+    detecção, que reaproveita a imagem decodificada e os recortes já gerados.
+    Com ?tta=true cada caixa é classificada pela média das vistas aumentadas.
+    Com `paciente_id` cada recorte é comparado com as análises anteriores do
+    paciente (`historico`, `mesma_lesao`) e entra no índice; ?embeddings=true
+    devolve o embedding float32 de cada recorte.
+    """
+    exigir_modelos("classificacao")
+    validar_modo_recorte(crops)
+    usar_embeddings = exigir_embeddings(paciente_id, embeddings)
+    formato = escolher_formato(request.headers.get("accept"))
     
     try:
         deteccoes = json.loads(deteccoes_json)
-        contents = await file.read()
-        img_original = Image.open(io.BytesIO(contents)).convert("RGB")
         
         resultados_finais = []
 
         if not deteccoes:
-            return JSONResponse(content={"resultados": resultados_finais})
+            return renderizar({"resultados": resultados_finais}, formato)
 
-        for det in deteccoes:
-            xmin = int(det.get("xmin", 0))
-            ymin = int(det.get("ymin", 0))
-            xmax = int(det.get("xmax", 0))
-            ymax = int(det.get("ymax", 0))
-            
-            cropped_img = img_original.crop((xmin, ymin, xmax, ymax))
-            img_resized = cropped_img.resize((224, 224))
+        sessao = sessoes_imagem.obter(imagem_id) if imagem_id else None
+        if sessao is None and file is None:
+            if imagem_id:
+                raise HTTPException(status_code=410, detail="imagem_id expirado, reenvie a imagem")
+            raise HTTPException(status_code=400, detail="Envie a imagem (file) ou o imagem_id")
 
-            img_array = image.img_to_array(img_resized)
-            # Aplicar preprocessamento adequado ao classificador
-            # Se for ResNet (modelo padrão), use o preprocess_input da ResNet (modo 'caffe').
-            try:
-                if CLASSIFIER_INFO.get("name") and "resnet" in CLASSIFIER_INFO["name"].lower():
-                    img_array = resnet_preprocess(np.expand_dims(img_array.copy(), axis=0))
-                else:
-                    img_array = np.expand_dims(img_array.astype(np.float32) / 255.0, axis=0)
-            except Exception:
-                img_array = np.expand_dims(img_array.astype(np.float32) / 255.0, axis=0)
-
-            pred = modelo_classificacao.predict(img_array, verbose=0)
-            index = np.argmax(pred[0])
-            classe_predita = LABEL_COLS[index]
-            confianca_maxima = float(np.max(pred[0]))
-            subimagem_base64 = image_to_base64(cropped_img)
-            
-            resultados_finais.append({
-                "xmin": xmin,
-                "ymin": ymin,
-                "xmax": xmax,
-                "ymax": ymax,
-                "classe_deteccao": det.get("classe"),
-                "confianca_deteccao": det.get("confianca"),
-                "classe_classificacao": classe_predita,
-                "confianca_classificacao": confianca_maxima,
-                "subimagem": subimagem_base64
-            })
+        vistas = vistas_tta(tta)
+        async with executor_inferencia.admitir():
+            tempos = {}
+            contents = None
+            if sessao is None:
+                contents = await ler_upload(file, UPLOAD_CONFIG["max_bytes"])
+            async with reservar_memoria(
+                "classificacao", tempos, contents, caixas=len(deteccoes), vistas=vistas, deteccao=False, reduzir=False
+            ) as reserva:
+                if contents is not None:
+                    origem = await identificar_conteudo(contents, tempos)
+                    img_original = await executor_inferencia.executar_imagem(
+                        decodificar_rgb, contents, etapa="decodificacao", tempos=tempos
+                    )
+                    imagem_id = sessoes_imagem.guardar(img_original, None, origem=origem)
+                    sessao = sessoes_imagem.obter(imagem_id)
+
+                resultados_finais = await pipeline_classificacao(
+                    sessao.imagem, deteccoes, tempos, sessao.origem, vistas, usar_embeddings
+                )
+                await anexar_subimagens(resultados_finais, imagem_id, sessao, crops, tempos)
+                if usar_embeddings:
+                    # flock, leitura/escrita dos arquivos e k-NN: fora do event loop
+                    await asyncio.to_thread(
+                        acompanhar_lesoes, resultados_finais, paciente_id, analise_id, embeddings, tempos
+                    )
 
-        return JSONResponse(content={"resultados": resultados_finais})
+                conteudo = {"resultados": resultados_finais, "imagem_id": imagem_id, "tempos_etapas": tempos}
+                anexar_memoria(conteudo, reserva)
+                with cronometrar(tempos, "serializacao"):
+                    resposta = renderizar(conteudo, formato)
+        finalizar_tempos(resposta, tempos)
+        return resposta
     
+    except FilaCheia as e:
+        raise resposta_fila_cheia(e)
+    except HTTPException:
+        raise
     except json.JSONDecodeError as e:
         logger.error(f"Erro ao decodificar JSON: {e}")
         raise HTTPException(status_code=400, detail="Formato JSON inválido.")
@@ -616,6 +2398,407 @@ async def predict_classification(file: UploadFile = File(...), deteccoes_json: s
         logger.error(f"Erro na classificação: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/predict/regions")
+async def predict_regions(
+    request: Request,
+    delta_json: str = Form(...),
+    regioes_json: str = Form("[]"),
+    imagem_id: str = Form(None),
+    imagem_blob: str = Form(None),
+    crops: str = Query("full"),
+    tta: bool = Query(None)
+):
+    """Reclassifica só as regiões editadas de uma imagem já analisada
+
+    `regioes_json` são as regiões atuais (resultados anteriores ou caixas da
+    detecção, de preferência sem `subimagem`) e `delta_json` a edição (ver
+    `aplicar_delta_regioes`). Só as caixas adicionadas/movidas (e as ainda
+    sem classificação) passam pelo classificador e ganham recorte conforme
+    ?crops=; as demais voltam como vieram. `alteradas` lista os índices das
+    regiões reprocessadas. A imagem vem da sessão (`imagem_id`) ou, se ela
+    expirou, do blob da imagem redimensionada (`imagem_blob` de ?crops=blob),
+    que vira uma nova sessão (o `imagem_id` da resposta).
+    """
+    exigir_modelos("classificacao")
+    validar_modo_recorte(crops)
+    formato = escolher_formato(request.headers.get("accept"))
+
+    try:
+        regioes = json.loads(regioes_json)
+        delta = json.loads(delta_json)
+        if not isinstance(regioes, list) or not isinstance(delta, dict):
+            raise HTTPException(status_code=400, detail="regioes_json deve ser uma lista e delta_json um objeto")
+        try:
+            regioes, pendentes = aplicar_delta_regioes(regioes, delta)
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f"Campo ausente no delta: {e}")
+        except LookupError as e:
+            raise HTTPException(status_code=409, detail=f"Delta não corresponde às regiões: {e}")
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Delta inválido: {e}")
+
+        vistas = vistas_tta(tta)
+        async with executor_inferencia.admitir():
+            tempos = {}
+            async with reservar_memoria(
+                "regioes", tempos, caixas=len(pendentes), vistas=vistas, deteccao=False
+            ) as reserva:
+                imagem_id, sessao = await sessao_regioes(imagem_id, imagem_blob, tempos)
+
+                if pendentes:
+                    alteradas = [regioes[i] for i in pendentes]
+                    deteccoes = [
+                        {**regiao, "classe": regiao.get("classe_deteccao", regiao.get("classe")),
+                         "confianca": regiao.get("confianca_deteccao", regiao.get("confianca"))}
+                        for regiao in alteradas
+                    ]
+                    resultados = await pipeline_classificacao(
+                        sessao.imagem, deteccoes, tempos, sessao.origem, vistas
+                    )
+                    for regiao, resultado in zip(alteradas, resultados):
+                        regiao.update(resultado)
+                    await anexar_subimagens(alteradas, imagem_id, sessao, crops, tempos)
+                logger.info(f"✏️ {len(pendentes)} regiões reclassificadas, {len(regioes) - len(pendentes)} mantidas")
+
+                conteudo = {"resultados": regioes, "alteradas": pendentes, "imagem_id": imagem_id, "tempos_etapas": tempos}
+                anexar_memoria(conteudo, reserva)
+                with cronometrar(tempos, "serializacao"):
+                    resposta = renderizar(conteudo, formato)
+        finalizar_tempos(resposta, tempos)
+        return resposta
+
+    except FilaCheia as e:
+        raise resposta_fila_cheia(e)
+    except HTTPException:
+        raise
+    except json.JSONDecodeError as e:
+        logger.error(f"Erro ao decodificar JSON: {e}")
+        raise HTTPException(status_code=400, detail="Formato JSON inválido.")
+    except Exception as e:
+        logger.error(f"Erro na edição de regiões: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/predict/full")
+async def predict_full(
+    request: Request,
+    file: UploadFile = File(...),
+    crops: str = Query("full"),
+    tiles: bool = Query(None),
+    tile_size: int = Query(None),
+    tile_overlap: float = Query(None),
+    max_tiles: int = Query(None),
+    quality: str = Query("auto"),
+    tta: bool = Query(None)
+):
+    """Detecção + classificação em uma única chamada (um upload, um decode, um JPEG por recorte)"""
+    exigir_modelos("yolo", "classificacao")
+    validar_modo_recorte(crops)
+    mosaico = opcoes_mosaico(tiles, tile_size, tile_overlap, max_tiles)
+    formato = escolher_formato(request.headers.get("accept"))
+    
+    try:
+        async with executor_inferencia.admitir():
+            start_time = time.time()
+            tempos = {}
+            
+            degrau = escolher_qualidade(quality)
+            vistas = vistas_tta(tta)
+            contents = await ler_upload(file, UPLOAD_CONFIG["max_bytes"])
+            async with reservar_memoria(
+                "completa", tempos, contents, MEMORIA_CONFIG["caixas_previstas"], vistas, degrau[0], mosaico
+            ) as reserva:
+                conteudo = await analise_completa(contents, tempos, crops, mosaico, degrau, quality, vistas)
+                
+                tempo = time.time() - start_time
+                if not mosaico:
+                    controle_qualidade.observar(degrau[0], tempo * 1000, requisicoes_em_andamento())
+                logger.info(f"✅ {len(conteudo['boxes'])} detecções classificadas em {tempo:.2f}s {tempos}")
+                
+                conteudo.update(
+                    tempo_inferencia=round(tempo, 3),
+                    tempos_etapas=tempos,
+                    device=HARDWARE_CONFIG['device']
+                )
+                anexar_memoria(conteudo, reserva)
+                with cronometrar(tempos, "serializacao"):
+                    resposta = renderizar(conteudo, formato)
+            finalizar_tempos(resposta, tempos)
+            return resposta
+    
+    except FilaCheia as e:
+        raise resposta_fila_cheia(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro no pipeline completo: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/jobs", status_code=202)
+async def criar_job(
+    file: UploadFile = File(...),
+    crops: str = Query("full"),
+    tiles: bool = Query(None),
+    tile_size: int = Query(None),
+    tile_overlap: float = Query(None),
+    max_tiles: int = Query(None),
+    quality: str = Query("auto"),
+    tta: bool = Query(None)
+):
+    """Enfileira detecção + classificação (como /predict/full) e responde na hora com o id do trabalho
+    
+    Acompanhe por GET /jobs/{job_id} (polling) ou GET /jobs/{job_id}/eventos (SSE).
+    """
+    exigir_fila_trabalhos()
+    validar_modo_recorte(crops)
+    mosaico = opcoes_mosaico(tiles, tile_size, tile_overlap, max_tiles)
+    validar_qualidade(quality)
+    
+    if (await asyncio.to_thread(fila_trabalhos.contagem))["pendente"] >= JOBS_CONFIG["max_pendentes"]:
+        raise HTTPException(
+            status_code=503,
+            detail="Fila de trabalhos cheia, tente novamente em instantes",
+            headers={"Retry-After": "5"}
+        )
+    
+    contents = await ler_upload(file, UPLOAD_CONFIG["max_bytes"])
+    trabalho_id = await asyncio.to_thread(
+        fila_trabalhos.criar, contents, {"crops": crops, "mosaico": mosaico, "quality": quality, "tta": vistas_tta(tta)}
+    )
+    sinal_trabalhos.set()
+    logger.info(f"📥 Trabalho {trabalho_id[:8]} enfileirado")
+    
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": trabalho_id,
+            "estado": "pendente",
+            "url": f"/jobs/{trabalho_id}",
+            "eventos": f"/jobs/{trabalho_id}/eventos",
+        },
+        headers={"Location": f"/jobs/{trabalho_id}"}
+    )
+
+@app.get("/jobs/{job_id}")
+async def obter_job(request: Request, job_id: str):
+    """Estado do trabalho; com `estado` = concluido traz o `resultado` (mesmo formato de /predict/full)"""
+    exigir_fila_trabalhos()
+    trabalho = await asyncio.to_thread(fila_trabalhos.obter, job_id)
+    if trabalho is None:
+        raise HTTPException(status_code=404, detail="Trabalho não encontrado")
+    
+    headers = {} if trabalho["estado"] in FINAIS else {"Retry-After": "1"}
+    return renderizar(trabalho, escolher_formato(request.headers.get("accept")), headers=headers)
+
+@app.get("/jobs/{job_id}/eventos")
+async def eventos_job(job_id: str):
+    """Progresso do trabalho em Server-Sent Events (estado/etapa a cada mudança; termina no estado final)"""
+    exigir_fila_trabalhos()
+    if await asyncio.to_thread(fila_trabalhos.estado, job_id) is None:
+        raise HTTPException(status_code=404, detail="Trabalho não encontrado")
+    
+    async def eventos():
+        anterior = None
+        ultimo_envio = time.time()
+        while fila_trabalhos is not None:
+            atual = await asyncio.to_thread(fila_trabalhos.estado, job_id)
+            if atual is None:
+                return
+            if atual != anterior:
+                final = atual["estado"] in FINAIS
+                yield f"event: {'fim' if final else 'progresso'}\ndata: {json.dumps(atual)}\n\n"
+                anterior = atual
+                ultimo_envio = time.time()
+                if final:
+                    return
+            elif time.time() - ultimo_envio > 15:
+                yield ": keep-alive\n\n"
+                ultimo_envio = time.time()
+            await asyncio.sleep(0.5)
+    
+    return StreamingResponse(
+        eventos(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.api_route("/blobs/{blob_id}", methods=["GET", "HEAD"])
+async def obter_blob(request: Request, blob_id: str):
+    """Imagem ou recorte gravado por ?crops=blob (imutável; aceita Range e If-None-Match)"""
+    tamanho = armazenamento_blobs.tamanho(blob_id)
+    if tamanho is None:
+        raise HTTPException(status_code=404, detail="Blob não encontrado")
+    
+    etag = f'"{blob_id}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={BLOBS_CONFIG['max_age_s']}, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        intervalo = intervalo_bytes(request.headers.get("range"), tamanho)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{tamanho}"})
+    
+    status = 200
+    inicio, fim = 0, tamanho - 1
+    if intervalo is not None:
+        status = 206
+        inicio, fim = intervalo
+        headers["Content-Range"] = f"bytes {inicio}-{fim}/{tamanho}"
+    
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(fim - inicio + 1)
+        return Response(status_code=status, headers=headers, media_type="image/jpeg")
+    return Response(
+        content=armazenamento_blobs.ler(blob_id, inicio, fim),
+        status_code=status, headers=headers, media_type="image/jpeg"
+    )
+
+@app.get("/imagens/{imagem_id}")
+async def obter_imagem(imagem_id: str):
+    """Imagem redimensionada de uma sessão (JPEG)"""
+    sessao = sessoes_imagem.obter(imagem_id)
+    if sessao is None:
+        raise HTTPException(status_code=410, detail="imagem_id expirado")
+    
+    imagem_jpeg = await executor_inferencia.executar_imagem(codificar_jpeg, sessao.imagem)
+    return Response(content=imagem_jpeg, media_type="image/jpeg", headers=cabecalhos_sessao())
+
+@app.get("/imagens/{imagem_id}/recorte")
+async def obter_recorte(imagem_id: str, xmin: int, ymin: int, xmax: int, ymax: int):
+    """Recorte de uma caixa da sessão (URL de curta duração usada por ?crops=ref)"""
+    sessao = sessoes_imagem.obter(imagem_id)
+    if sessao is None:
+        raise HTTPException(status_code=410, detail="imagem_id expirado")
+    
+    caixa = (xmin, ymin, xmax, ymax)
+    if caixa not in sessao.subimagens:
+        [sessao.subimagens[caixa]] = await executor_inferencia.executar_imagem(
+            codificar_recortes, sessao.imagem, [caixa]
+        )
+    return Response(content=sessao.subimagens[caixa], media_type="image/jpeg", headers=cabecalhos_sessao())
+
+def cabecalhos_sessao():
+    """Cache privado pelo tempo de vida da sessão"""
+    return {"Cache-Control": f"private, max-age={int(sessoes_imagem.ttl_s)}"}
+
+@app.get("/pacientes/{paciente_id}/embeddings")
+async def resumo_embeddings(paciente_id: str):
+    """Tamanho do índice de embeddings do paciente"""
+    exigir_indice_paciente(paciente_id)
+    resumo = indice_embeddings.resumo(paciente_id)
+    if resumo is None:
+        raise HTTPException(status_code=404, detail="Paciente sem embeddings")
+    return resumo
+
+@app.delete("/pacientes/{paciente_id}/embeddings")
+async def remover_embeddings(paciente_id: str):
+    """Apaga o índice de embeddings do paciente"""
+    exigir_indice_paciente(paciente_id)
+    return {"paciente_id": paciente_id, "removido": indice_embeddings.remover(paciente_id)}
+
+def exigir_indice_paciente(paciente_id):
+    if indice_embeddings is None:
+        raise HTTPException(status_code=503, detail="Índice de embeddings desabilitado (EMBEDDINGS_ENABLED=0)")
+    if not id_paciente_valido(paciente_id):
+        raise HTTPException(status_code=400, detail="paciente_id inválido (use letras, números, _ ou -)")
+
+@app.get("/batching/stats")
+async def batching_stats():
+    """Tamanho dos lotes e espera na fila (para ajustar BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS)"""
+    return {
+        "config": BATCH_CONFIG,
+        "classificacao": batcher_classificacao.estatisticas() if batcher_classificacao else None,
+        "yolo": batcher_yolo.estatisticas() if batcher_yolo else None
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas no formato Prometheus"""
+    corpo, tipo = await asyncio.to_thread(exportar)  # inclui a contagem da fila de trabalhos (SQLite)
+    return Response(content=corpo, media_type=tipo)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Acertos/faltas do cache de resultados (por detecção e classificação)"""
+    return {
+        "config": CACHE_CONFIG,
+        "versao_modelos": VERSAO_MODELOS,
+        "estatisticas": cache_resultados.estatisticas() if cache_resultados else None
+    }
+
+@app.get("/memory/stats")
+async def memory_stats():
+    """Orçamento de memória, fila e pico por rota (para ajustar MEMORY_MB_* e dimensionar a instância)"""
+    return {
+        "config": MEMORIA_CONFIG,
+        "estatisticas": governador_memoria.estatisticas() if governador_memoria else None
+    }
+
+@app.get("/models/versions")
+async def versoes_modelos():
+    """Versões carregadas de cada modelo (estado, latência, concordância da sombra) e o roteamento"""
+    estado = ler_estado(VERSOES_CONFIG["estado"])
+    return {
+        tipo: {
+            **registro.estatisticas(),
+            "desejado": estado_desejado(estado, tipo),
+            "disponiveis": versoes_disponiveis(tipo),
+        }
+        for tipo, registro in registros_modelos.items()
+    }
+
+@app.put("/models/{tipo}/routing", status_code=202)
+async def rotear_modelo(
+    request: Request,
+    tipo: str,
+    ativa: str = Query(None, description="Versão que recebe o tráfego"),
+    canario: str = Query(None, description="Versão que recebe a fração `fracao_canario` do tráfego"),
+    fracao_canario: float = Query(None, ge=0, le=1),
+    sombra: str = Query(None, description="Versão que recebe uma cópia da fração `fracao_sombra` do tráfego"),
+    fracao_sombra: float = Query(None, ge=0, le=1),
+):
+    """Altera o roteamento desejado; as versões carregam em segundo plano e a troca acontece quando estiverem prontas
+    
+    Só os parâmetros informados mudam (fracao_canario=0 / fracao_sombra=0 desligam canário/sombra).
+    """
+    exigir_admin(request)
+    if tipo not in registros_modelos:
+        raise HTTPException(status_code=404, detail=f"Modelo desconhecido: {tipo} (use {', '.join(registros_modelos)})")
+    
+    alteracoes = {
+        chave: valor for chave, valor in (
+            ("ativa", ativa), ("canario", canario), ("fracao_canario", fracao_canario),
+            ("sombra", sombra), ("fracao_sombra", fracao_sombra),
+        ) if valor is not None
+    }
+    for chave in ("ativa", "canario", "sombra"):
+        nome = alteracoes.get(chave)
+        if nome is not None and nome not in versoes_disponiveis(tipo):
+            raise HTTPException(status_code=404, detail=f"Versão não encontrada: {tipo}/{nome}")
+    
+    estado = ler_estado(VERSOES_CONFIG["estado"])
+    estado[tipo] = {**estado_desejado(estado, tipo), **alteracoes}
+    gravar_estado(VERSOES_CONFIG["estado"], estado)
+    if sinal_versoes is not None:
+        sinal_versoes.set()
+    logger.info(f"🔀 Roteamento desejado de {tipo}: {estado[tipo]}")
+    return {"tipo": tipo, "desejado": estado[tipo], "atual": registros_modelos[tipo].estatisticas()}
+
+def versoes_disponiveis(tipo):
+    """Versões que podem ser carregadas: a inicial e as pastas de models-ia/versoes/<tipo>/"""
+    pasta = VERSOES_CONFIG["diretorio"] / tipo
+    pastas = sorted(p.name for p in pasta.iterdir() if p.is_dir() and nome_versao_valido(p.name)) if pasta.is_dir() else []
+    return [VERSAO_INICIAL, *pastas]
+
+def exigir_admin(request):
+    """Com MODELS_ADMIN_TOKEN, as alterações exigem o cabeçalho X-Admin-Token"""
+    token = VERSOES_CONFIG["token"]
+    if token and not hmac.compare_digest(request.headers.get("x-admin-token", ""), token):
+        raise HTTPException(status_code=401, detail="X-Admin-Token inválido")
+
 @app.get("/models/info")
 async def models_info():
     """Informações dos modelos"""
@@ -642,7 +2825,8 @@ async def models_info():
             },
             "deteccao": {
                 **yolo_info,
-                "loaded": modelo_yolo is not None
+                "loaded": modelo_yolo is not None,
+                "detector_info": DETECTOR_INFO
             },
             "hardware": HARDWARE_CONFIG
         })
@@ -653,8 +2837,18 @@ async def models_info():
 # ========================================
 # MAIN
 # ========================================
+PERFIL_INICIALIZACAO["import_api_ia"] = round((time.perf_counter() - _INICIO_IMPORT) * 1000, 3)
+
 if __name__ == "__main__":
+    import argparse
     import uvicorn
+    
+    parser = argparse.ArgumentParser(description="Medical AI API")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="Imprime o tempo de import/carregamento de cada fase")
+    if parser.parse_args().startup_profile:
+        STARTUP_PROFILE = True
+    
     uvicorn.run(
         app,
         host="0.0.0.0",   # aceita conexões locais e da rede
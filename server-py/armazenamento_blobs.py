@@ -0,0 +1,111 @@
+"""
+Armazenamento de imagens e recortes endereçado por conteúdo (?crops=blob).
+
+Em vez de devolver cada JPEG em base64 na resposta (e o backend guardar
+isso no MongoDB), a API grava a imagem redimensionada e os recortes em
+disco e devolve só o id (SHA-256 dos bytes) e a URL `/blobs/{id}`. O mesmo
+conteúdo sempre gera o mesmo id, então reenvios não duplicam arquivos e as
+URLs podem ser guardadas e cacheadas para sempre (`immutable`).
+
+Os arquivos ficam em `<diretorio>/ab/abcdef...` (dois níveis para não
+acumular milhares de arquivos em uma pasta); a escrita é atômica (arquivo
+temporário + rename), então vários workers podem dividir a pasta.
+"""
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from cache_resultados import digest_conteudo
+
+_ID_VALIDO = re.compile(r"^[0-9a-f]{64}$")
+
+
+def intervalo_bytes(cabecalho, tamanho):
+    """Intervalo (início, fim inclusivo) de um cabeçalho Range, ou None para o arquivo inteiro
+
+    Só um intervalo é atendido; cabeçalhos inválidos ou com vários
+    intervalos são ignorados (resposta 200 completa, como permite a RFC 9110).
+    Levanta ValueError se o intervalo não cabe no arquivo (416).
+    """
+    if not cabecalho or not cabecalho.startswith("bytes=") or "," in cabecalho:
+        return None
+    inicio, _, fim = cabecalho[len("bytes="):].strip().partition("-")
+    if not (inicio or fim) or (inicio and not inicio.isdigit()) or (fim and not fim.isdigit()):
+        return None
+
+    if not inicio:
+        # Sufixo: últimos N bytes
+        n = int(fim)
+        if n == 0 or tamanho == 0:
+            raise ValueError("Intervalo vazio")
+        return max(0, tamanho - n), tamanho - 1
+
+    inicio = int(inicio)
+    fim = min(int(fim), tamanho - 1) if fim else tamanho - 1
+    if inicio >= tamanho or fim < inicio:
+        raise ValueError("Intervalo fora do arquivo")
+    return inicio, fim
+
+
+class ArmazenamentoBlobs:
+    """Pasta de blobs imutáveis identificados pelo SHA-256 do conteúdo
+
+    Operações curtas e síncronas (como a camada em disco do cache).
+    """
+
+    def __init__(self, diretorio):
+        self.diretorio = Path(diretorio)
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self._gravados = 0
+        self._reaproveitados = 0
+        self._bytes_gravados = 0
+
+    def caminho(self, blob_id):
+        """Caminho do blob ou None se o id for inválido"""
+        if not _ID_VALIDO.match(blob_id or ""):
+            return None
+        return self.diretorio / blob_id[:2] / blob_id[2:]
+
+    def guardar(self, dados):
+        """Grava os bytes (se ainda não existem); retorna o id"""
+        blob_id = digest_conteudo(dados)
+        caminho = self.caminho(blob_id)
+        if caminho.exists():
+            self._reaproveitados += 1
+            return blob_id
+
+        caminho.parent.mkdir(exist_ok=True)
+        descritor, temporario = tempfile.mkstemp(dir=caminho.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(descritor, "wb") as arquivo:
+                arquivo.write(dados)
+            os.replace(temporario, caminho)
+        except BaseException:
+            Path(temporario).unlink(missing_ok=True)
+            raise
+        self._gravados += 1
+        self._bytes_gravados += len(dados)
+        return blob_id
+
+    def tamanho(self, blob_id):
+        """Tamanho em bytes ou None se o blob não existe"""
+        caminho = self.caminho(blob_id)
+        try:
+            return caminho.stat().st_size if caminho else None
+        except FileNotFoundError:
+            return None
+
+    def ler(self, blob_id, inicio=0, fim=None):
+        """Bytes de `inicio` a `fim` (inclusivo; None = até o final)"""
+        with open(self.caminho(blob_id), "rb") as arquivo:
+            arquivo.seek(inicio)
+            return arquivo.read(-1 if fim is None else fim - inicio + 1)
+
+    def estatisticas(self):
+        return {
+            "diretorio": str(self.diretorio),
+            "gravados": self._gravados,
+            "reaproveitados": self._reaproveitados,
+            "bytes_gravados": self._bytes_gravados,
+        }
@@ -0,0 +1,337 @@
+"""
+Backends de inferência exportados (ONNX Runtime e TorchScript).
+
+`ClassificadorONNX`, `DetectorONNX` e `DetectorTorchScript` expõem a mesma
+interface usada pela API para os modelos nativos (Keras / YOLOv5
+AutoShape), de modo que o restante do pipeline não muda. Os artefatos
+são gerados por `exportar_onnx.py` e carregados sem torch.hub nem rede.
+"""
+import ast
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("native", "onnx")
+RELATORIO_QUANTIZACAO = "quantizacao.json"
+
+
+def criar_sessao_onnx(caminho, intra_threads=1, inter_threads=1, pesos_compartilhados=False):
+    """InferenceSession de CPU com threads intra/inter-op configuradas
+
+    Com `pesos_compartilhados`, carrega a versão pré-otimizada de
+    `preparar_modelo_compartilhado` (se existir): os pesos ficam no arquivo
+    externo mapeado em memória, sem otimizações nem pre-packing que os
+    copiariam, e são compartilhados entre os workers pelo page cache.
+    """
+    import onnxruntime as ort
+
+    opcoes = ort.SessionOptions()
+    opcoes.intra_op_num_threads = max(1, int(intra_threads))
+    opcoes.inter_op_num_threads = max(1, int(inter_threads))
+    opcoes.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    opcoes.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    if pesos_compartilhados:
+        compartilhado = caminho_compartilhado(caminho)
+        if modelo_compartilhado_atualizado(caminho):
+            caminho = compartilhado
+            opcoes.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            opcoes.add_session_config_entry("session.disable_prepacking", "1")
+        else:
+            logger.warning(f"⚠️ {compartilhado.name} ausente ou desatualizado: pesos de {Path(caminho).name} não serão compartilhados")
+    return ort.InferenceSession(str(caminho), sess_options=opcoes, providers=["CPUExecutionProvider"])
+
+
+def caminho_compartilhado(caminho):
+    """`modelo.onnx` -> `modelo.compartilhado.onnx` (pesos em `modelo.compartilhado.onnx.data`)"""
+    caminho = Path(caminho)
+    return caminho.with_name(f"{caminho.stem}.compartilhado{caminho.suffix}")
+
+
+def modelo_compartilhado_atualizado(caminho):
+    compartilhado = caminho_compartilhado(caminho)
+    dados = compartilhado.with_name(compartilhado.name + ".data")
+    return (compartilhado.exists() and dados.exists()
+            and compartilhado.stat().st_mtime >= Path(caminho).stat().st_mtime)
+
+
+def preparar_modelo_compartilhado(caminho):
+    """Gera a versão para workers: grafo já otimizado (nível EXTENDED) e pesos em arquivo externo
+
+    O nível ALL não é usado: o layout NCHWc reordena os pesos dos Conv em
+    memória própria de cada processo. Roda uma sessão do ONNX Runtime, então
+    deve ser chamado fora do processo que vai fazer fork (ver servidor_prefork.py).
+    """
+    import onnxruntime as ort
+
+    if modelo_compartilhado_atualizado(caminho):
+        return caminho_compartilhado(caminho)
+    destino = caminho_compartilhado(caminho)
+    opcoes = ort.SessionOptions()
+    opcoes.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    opcoes.optimized_model_filepath = str(destino)
+    opcoes.add_session_config_entry("session.optimized_model_external_initializers_file_name", destino.name + ".data")
+    opcoes.add_session_config_entry("session.optimized_model_external_initializers_min_size_in_bytes", "1024")
+    ort.InferenceSession(str(caminho), sess_options=opcoes, providers=["CPUExecutionProvider"])
+    logger.info(f"✅ {destino.name} gerado (pesos mapeados em memória pelos workers)")
+    return destino
+
+
+class ClassificadorONNX:
+    """Classificador exportado: recebe (N, 224, 224, 3) float32 já preprocessado"""
+    backend = "onnx"
+
+    def __init__(self, caminho, intra_threads=1, inter_threads=1, pesos_compartilhados=False):
+        self.caminho = Path(caminho)
+        self.sessao = criar_sessao_onnx(caminho, intra_threads, inter_threads, pesos_compartilhados)
+        self.entrada = self.sessao.get_inputs()[0].name
+        # Exportações com a segunda saída (embedding da penúltima camada, ver exportar_onnx.py)
+        self.com_embeddings = len(self.sessao.get_outputs()) > 1
+
+    def __call__(self, x):
+        return self.sessao.run(None, {self.entrada: np.asarray(x, dtype=np.float32)})[0]
+
+    def inferir_com_embeddings(self, x):
+        """(probabilidades, embeddings) no mesmo forward pass"""
+        probabilidades, embeddings = self.sessao.run(None, {self.entrada: np.asarray(x, dtype=np.float32)})[:2]
+        return probabilidades, embeddings
+
+    def predict(self, x, verbose=0):
+        return self(x)
+
+
+class ResultadoDeteccao:
+    """Mesmo formato de `results.xyxy` do YOLOv5: uma matriz (n, 6) por imagem"""
+    def __init__(self, xyxy):
+        self.xyxy = xyxy
+
+
+class DetectorYOLO:
+    """YOLOv5 exportado (saída bruta (B, N, 5 + classes)) com letterbox e NMS em NumPy.
+
+    As subclasses implementam `_inferir(lote)` para (B, 3, tamanho, tamanho) float32.
+    `dinamico` indica se o modelo aceita outro tamanho de entrada (`size=`,
+    como no AutoShape); senão `size` é ignorado.
+    """
+    dinamico = False
+
+    def __init__(self, caminho, tamanho, names):
+        self.caminho = Path(caminho)
+        self.tamanho = int(tamanho)
+        self.names = {int(k): v for k, v in names.items()}
+        self.conf = 0.25
+        self.iou = 0.45
+        self.max_det = 1000
+
+    def to(self, device):
+        return self
+
+    def _inferir(self, lote):
+        raise NotImplementedError
+
+    def __call__(self, imgs, size=None):
+        tamanho = int(size) if size and self.dinamico else self.tamanho
+        if hasattr(imgs, "numpy") or (isinstance(imgs, np.ndarray) and imgs.ndim == 4):
+            # Tensor (B, 3, H, W) já normalizado (ex.: warm-up)
+            lote = np.asarray(imgs.cpu().numpy() if hasattr(imgs, "cpu") else imgs, dtype=np.float32)
+            saida = self._inferir(lote)
+            return ResultadoDeteccao([self._nms(pred) for pred in saida])
+
+        lista = imgs if isinstance(imgs, (list, tuple)) else [imgs]
+        lote = np.empty((len(lista), 3, tamanho, tamanho), dtype=np.float32)
+        transformacoes = []
+        for i, img in enumerate(lista):
+            arr = np.asarray(img.convert("RGB") if hasattr(img, "convert") else img)
+            caixa, escala, pad = letterbox(arr, tamanho)
+            lote[i] = caixa.transpose(2, 0, 1)
+            transformacoes.append((escala, pad, arr.shape[:2]))
+        lote /= 255.0
+
+        saida = self._inferir(lote)
+
+        xyxy = []
+        for pred, (escala, (pad_x, pad_y), (h, w)) in zip(saida, transformacoes):
+            det = self._nms(pred)
+            det[:, [0, 2]] = ((det[:, [0, 2]] - pad_x) / escala).clip(0, w)
+            det[:, [1, 3]] = ((det[:, [1, 3]] - pad_y) / escala).clip(0, h)
+            xyxy.append(det)
+        return ResultadoDeteccao(xyxy)
+
+    def _nms(self, pred):
+        return nms_yolo(pred, self.conf, self.iou, self.max_det)
+
+
+class DetectorONNX(DetectorYOLO):
+    """YOLOv5 exportado para ONNX (ONNX Runtime, CPU)"""
+    backend = "onnx"
+
+    def __init__(self, caminho, tamanho=640, intra_threads=1, inter_threads=1, pesos_compartilhados=False):
+        self.sessao = criar_sessao_onnx(caminho, intra_threads, inter_threads, pesos_compartilhados)
+        entrada = self.sessao.get_inputs()[0]
+        self.entrada = entrada.name
+
+        # Exportação com tamanho fixo ignora o tamanho configurado
+        altura = entrada.shape[2]
+        self.dinamico = not isinstance(altura, int)
+        meta = self.sessao.get_modelmeta().custom_metadata_map
+        names = ast.literal_eval(meta["names"]) if "names" in meta else {0: "object"}
+        super().__init__(caminho, tamanho if self.dinamico else altura, names)
+
+    def _inferir(self, lote):
+        return self.sessao.run(None, {self.entrada: lote})[0]
+
+
+class DetectorTorchScript(DetectorYOLO):
+    """YOLOv5 exportado para TorchScript: dispensa torch.hub, o repositório do YOLOv5 e a rede.
+
+    O `config.txt` embutido no arquivo traz classes, tamanho de entrada
+    (fixo no trace) e a versão do artefato (checksum do .pt de origem).
+    """
+    backend = "torchscript"
+
+    def __init__(self, caminho, device="cpu"):
+        import torch
+
+        extras = {"config.txt": ""}
+        self.modelo = torch.jit.load(str(caminho), map_location=device, _extra_files=extras)
+        self.modelo.eval()
+        self.device = device
+        config = json.loads(extras["config.txt"] or "{}")
+        self.artefato = {k: v for k, v in config.items() if k != "names"}
+        super().__init__(caminho, config.get("imgsz", 640), config.get("names", {0: "object"}))
+
+    def to(self, device):
+        self.modelo.to(device)
+        self.device = device
+        return self
+
+    def _inferir(self, lote):
+        import torch
+
+        with torch.inference_mode():
+            saida = self.modelo(torch.from_numpy(lote).to(self.device))
+        if isinstance(saida, (list, tuple)):
+            saida = saida[0]
+        return saida.float().cpu().numpy()
+
+
+def letterbox(img, tamanho, cor=114):
+    """Redimensiona mantendo proporção e centraliza em um quadrado `tamanho` (como o AutoShape)"""
+    import cv2
+
+    h, w = img.shape[:2]
+    escala = min(tamanho / h, tamanho / w)
+    nw, nh = int(round(w * escala)), int(round(h * escala))
+    if (nw, nh) != (w, h):
+        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+
+    dw, dh = (tamanho - nw) / 2, (tamanho - nh) / 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(cor, cor, cor))
+    return img, escala, (left, top)
+
+
+def nms_yolo(pred, conf_thres=0.25, iou_thres=0.45, max_det=1000, max_wh=7680):
+    """NMS por classe sobre a saída bruta do YOLOv5 (xywh, obj, classes...)"""
+    x = pred[pred[:, 4] > conf_thres].astype(np.float32, copy=True)
+    if not len(x):
+        return np.zeros((0, 6), dtype=np.float32)
+
+    x[:, 5:] *= x[:, 4:5]
+    caixas = np.empty((len(x), 4), dtype=np.float32)
+    caixas[:, 0] = x[:, 0] - x[:, 2] / 2
+    caixas[:, 1] = x[:, 1] - x[:, 3] / 2
+    caixas[:, 2] = x[:, 0] + x[:, 2] / 2
+    caixas[:, 3] = x[:, 1] + x[:, 3] / 2
+
+    classes = x[:, 5:].argmax(1)
+    confs = x[np.arange(len(x)), 5 + classes]
+    manter = confs > conf_thres
+    det = np.concatenate([caixas, confs[:, None], classes[:, None].astype(np.float32)], axis=1)[manter]
+    if not len(det):
+        return det
+
+    det = det[det[:, 4].argsort()[::-1][:30000]]
+    deslocadas = det[:, :4] + det[:, 5:6] * max_wh  # separa classes
+    return det[_nms(deslocadas, det[:, 4], iou_thres)[:max_det]]
+
+
+def _nms(caixas, scores, iou_thres):
+    x1, y1, x2, y2 = caixas.T
+    areas = (x2 - x1) * (y2 - y1)
+    ordem = scores.argsort()[::-1]
+    manter = []
+    while ordem.size:
+        i = ordem[0]
+        manter.append(i)
+        xx1 = np.maximum(x1[i], x1[ordem[1:]])
+        yy1 = np.maximum(y1[i], y1[ordem[1:]])
+        xx2 = np.minimum(x2[i], x2[ordem[1:]])
+        yy2 = np.minimum(y2[i], y2[ordem[1:]])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[ordem[1:]] - inter + 1e-9)
+        ordem = ordem[1:][iou <= iou_thres]
+    return np.array(manter, dtype=np.int64)
+
+
+def caminho_variante(caminho, variante="fp32"):
+    """`modelo.onnx` (fp32) ou `modelo.int8.onnx` (quantizado)"""
+    caminho = Path(caminho)
+    if variante == "fp32":
+        return caminho
+    return caminho.with_name(f"{caminho.stem}.{variante}{caminho.suffix}")
+
+
+def hash_arquivo(caminho):
+    """SHA-256 do arquivo (liga o relatório de quantização ao artefato avaliado)"""
+    sha = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def selecionar_variante(caminho_fp32, variante, relatorio, chave, metrica, minimo):
+    """Escolhe o arquivo a carregar aplicando o gate de acurácia.
+
+    A variante quantizada só é usada se `relatorio` (gerado por
+    quantizar_modelos.py) tiver `metrica >= minimo` para exatamente este
+    arquivo (mesmo SHA-256). Caso contrário, volta para o FP32.
+    Retorna (caminho, info).
+    """
+    caminho_fp32 = Path(caminho_fp32)
+    if variante == "fp32":
+        return caminho_fp32, {"variant": "fp32"}
+
+    candidato = caminho_variante(caminho_fp32, variante)
+    gate = {"metric": metrica, "min": minimo, "value": None, "passed": False, "reason": None}
+    info = {"variant": "fp32", "requested_variant": variante, "gate": gate}
+
+    dados = None
+    if Path(relatorio).exists():
+        with open(relatorio, encoding="utf-8") as f:
+            dados = json.load(f).get(chave)
+
+    if not candidato.exists():
+        gate["reason"] = f"{candidato.name} não encontrado"
+    elif not dados or dados.get(metrica) is None:
+        gate["reason"] = f"sem avaliação de {chave} em {Path(relatorio).name}"
+    elif dados.get("sha256") != hash_arquivo(candidato):
+        gate["reason"] = "relatório não corresponde ao arquivo (reexecute quantizar_modelos.py)"
+    else:
+        gate["value"] = dados[metrica]
+        if dados[metrica] >= minimo:
+            gate["passed"] = True
+            info["variant"] = variante
+            logger.info(f"✅ {candidato.name} aprovado no gate ({metrica}={dados[metrica]:.4f} >= {minimo})")
+            return candidato, info
+        gate["reason"] = f"{metrica}={dados[metrica]:.4f} < {minimo}"
+
+    logger.warning(f"⚠️ Variante {variante} recusada ({gate['reason']}), usando {caminho_fp32.name}")
+    return caminho_fp32, info
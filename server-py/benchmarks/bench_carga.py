@@ -0,0 +1,386 @@
+"""
+Teste de carga dos endpoints de inferência: vazão e latência de cauda.
+
+Roda a API em processo (httpx + ASGITransport, mesmo event loop) ou em um
+uvicorn local (--uvicorn inicia um por cenário de caixas; --url usa um já
+no ar). Usa fotos sintéticas e os modelos mock (MOCK_MODELS=1:
+`carregar_yolo_mock` com MOCK_YOLO_BOXES caixas e `MockClassifier`), então
+não precisa de rede nem GPU. O cache de resultados fica desligado para que
+cada requisição execute o pipeline inteiro (--com-cache para ligar).
+
+Para cada cenário (endpoint x concorrência x caixas) mede p50/p95/p99,
+requisições/s e pico de RSS do servidor. O JSON (--saida) guarda commit e
+ambiente; --comparar base.json aponta regressões de p95/vazão acima de
+--tolerancia e termina com código 1.
+
+Uso (dentro de server-py/):
+    python benchmarks/bench_carga.py --concorrencia 1 4 16 --caixas 1 8 --saida carga.json
+    python benchmarks/bench_carga.py --uvicorn --comparar carga.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import numpy as np
+import psutil
+
+PASTA_SERVIDOR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PASTA_SERVIDOR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_preprocessamento import gerar_jpeg  # noqa: E402
+
+ENDPOINTS = {
+    "deteccao": "/predict/detection",
+    "classificacao": "/predict/classification",
+    "completo": "/predict/full",
+}
+
+
+def ambiente_servidor(caixas, com_cache):
+    """Variáveis de ambiente da API para o benchmark (sem sobrescrever as já definidas)"""
+    return {
+        "MOCK_MODELS": "1",
+        "MOCK_YOLO_BOXES": str(caixas),
+        "MODEL_LOADING": "blocking",
+        "RESULT_CACHE_ENABLED": "1" if com_cache else "0",
+    }
+
+
+def gerar_caixas(n, target_size=416):
+    """Detecções em grade, no formato enviado pelo app para /predict/classification"""
+    lado = max(1, int(np.ceil(np.sqrt(n))))
+    passo = target_size // lado
+    return [
+        {"xmin": (i % lado) * passo + 4, "ymin": (i // lado) * passo + 4,
+         "xmax": (i % lado + 1) * passo - 4, "ymax": (i // lado + 1) * passo - 4,
+         "classe": "object", "confianca": 0.9}
+        for i in range(n)
+    ]
+
+
+def percentis(latencias):
+    valores = np.array(latencias)
+    return {
+        "p50": round(float(np.percentile(valores, 50)), 2),
+        "p95": round(float(np.percentile(valores, 95)), 2),
+        "p99": round(float(np.percentile(valores, 99)), 2),
+        "max": round(float(valores.max()), 2),
+        "media": round(float(valores.mean()), 2),
+    }
+
+
+def commit_atual():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=PASTA_SERVIDOR, check=True).stdout.strip()
+        sujo = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                              text=True, cwd=PASTA_SERVIDOR).stdout.strip()
+        return f"{commit}-dirty" if sujo else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ========================================
+# SERVIDOR
+# ========================================
+class ServidorEmProcesso:
+    """API no mesmo processo (httpx + ASGITransport); o startup roda aqui mesmo"""
+
+    def __init__(self, com_cache):
+        for chave, valor in ambiente_servidor(0, com_cache).items():
+            os.environ.setdefault(chave, valor)
+        import api_ia
+        self.api = api_ia
+        self.pid = os.getpid()
+
+    async def __aenter__(self):
+        await self.api.app.router.startup()
+        transporte = httpx.ASGITransport(app=self.api.app)
+        self.cliente = httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=120)
+        return self
+
+    async def configurar(self, caixas):
+        self.api.modelo_yolo = self.api.carregar_yolo_mock(caixas)
+
+    async def __aexit__(self, *exc):
+        await self.cliente.aclose()
+        await self.api.app.router.shutdown()
+
+
+class ServidorUvicorn:
+    """uvicorn em subprocesso, reiniciado quando muda o número de caixas do YOLO mock"""
+
+    def __init__(self, com_cache, url=None, limite_conexoes=64):
+        self.com_cache = com_cache
+        self.url_fixa = url
+        self.limite_conexoes = limite_conexoes
+        self.processo = None
+        self.pid = None
+
+    async def __aenter__(self):
+        return self
+
+    async def configurar(self, caixas):
+        if self.url_fixa:
+            if not hasattr(self, "cliente"):
+                self.cliente = self._novo_cliente(self.url_fixa)
+                self.pid = None  # servidor externo: RSS pelo /metrics não é amostrado aqui
+            return
+        await self._parar()
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            porta = s.getsockname()[1]
+        env = {**os.environ, **ambiente_servidor(caixas, self.com_cache)}
+        self.processo = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api_ia:app", "--host", "127.0.0.1", "--port", str(porta),
+             "--log-level", "warning"],
+            cwd=PASTA_SERVIDOR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.pid = self.processo.pid
+        self.cliente = self._novo_cliente(f"http://127.0.0.1:{porta}")
+        await self._aguardar_pronto()
+
+    def _novo_cliente(self, url):
+        limites = httpx.Limits(max_connections=self.limite_conexoes, max_keepalive_connections=self.limite_conexoes)
+        return httpx.AsyncClient(base_url=url, timeout=120, limits=limites)
+
+    async def _aguardar_pronto(self, timeout_s=300):
+        limite = time.monotonic() + timeout_s
+        while time.monotonic() < limite:
+            if self.processo.poll() is not None:
+                raise RuntimeError(f"uvicorn terminou com código {self.processo.returncode}")
+            try:
+                if (await self.cliente.get("/health/ready")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.5)
+        raise TimeoutError("uvicorn não ficou pronto")
+
+    async def _parar(self):
+        if hasattr(self, "cliente"):
+            await self.cliente.aclose()
+        if self.processo is not None:
+            self.processo.terminate()
+            self.processo.wait(timeout=30)
+            self.processo = None
+
+    async def __aexit__(self, *exc):
+        await self._parar()
+
+
+# ========================================
+# CARGA
+# ========================================
+async def amostrar_rss(pid, pico, parar, intervalo_s=0.02):
+    """Guarda em `pico[0]` o maior RSS (bytes) do processo até `parar` ser sinalizado"""
+    processo = psutil.Process(pid)
+    while not parar.is_set():
+        pico[0] = max(pico[0], processo.memory_info().rss)
+        try:
+            await asyncio.wait_for(parar.wait(), intervalo_s)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def requisitar(cliente, endpoint, i, cargas, caixas, crops):
+    if endpoint == "classificacao":
+        arquivo = cargas["redimensionadas"][i % len(cargas["redimensionadas"])]
+        return await cliente.post(
+            ENDPOINTS[endpoint], params={"crops": crops},
+            files={"file": ("foto.jpg", arquivo, "image/jpeg")},
+            data={"deteccoes_json": json.dumps(gerar_caixas(caixas))}
+        )
+    arquivo = cargas["fotos"][i % len(cargas["fotos"])]
+    return await cliente.post(ENDPOINTS[endpoint], params={"crops": crops},
+                              files={"file": ("foto.jpg", arquivo, "image/jpeg")})
+
+
+def contar_caixas(endpoint, resposta):
+    if resposta.status_code != 200:
+        return None
+    corpo = resposta.json()
+    return len(corpo["resultados"] if endpoint == "classificacao" else corpo["boxes"])
+
+
+async def rodar_cenario(servidor, endpoint, concorrencia, caixas, args, cargas):
+    cliente = servidor.cliente
+    for i in range(args.aquecimento):
+        await requisitar(cliente, endpoint, i, cargas, caixas, args.crops)
+
+    pendentes = iter(range(args.requisicoes))
+    latencias, status, caixas_respostas = [], Counter(), []
+
+    async def trabalhador():
+        for i in pendentes:  # iterador compartilhado entre os trabalhadores
+            inicio = time.perf_counter()
+            try:
+                resposta = await requisitar(cliente, endpoint, i, cargas, caixas, args.crops)
+                status[resposta.status_code] += 1
+                encontradas = contar_caixas(endpoint, resposta)
+                if encontradas is not None:
+                    caixas_respostas.append(encontradas)
+            except httpx.HTTPError as e:
+                status[type(e).__name__] += 1
+            latencias.append((time.perf_counter() - inicio) * 1000)
+
+    pico, parar = [0], asyncio.Event()
+    amostrador = asyncio.create_task(amostrar_rss(servidor.pid, pico, parar)) if servidor.pid else None
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabalhador() for _ in range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+    if amostrador:
+        parar.set()
+        await amostrador
+
+    sucesso = status.get(200, 0)
+    return {
+        "endpoint": endpoint,
+        "concorrencia": concorrencia,
+        "caixas": caixas,
+        "requisicoes": args.requisicoes,
+        "erros": args.requisicoes - sucesso,
+        "status": {str(k): v for k, v in sorted(status.items(), key=str)},
+        "caixas_por_resposta": round(float(np.mean(caixas_respostas)), 2) if caixas_respostas else None,
+        "latencia_ms": percentis(latencias),
+        "requisicoes_s": round(sucesso / duracao, 2),
+        "rss_pico_mb": round(pico[0] / 2**20, 1) if pico[0] else None,
+    }
+
+
+async def executar(args):
+    largura, altura = (int(v) for v in args.tamanho.split("x"))
+    fotos = [gerar_jpeg(largura, altura, seed=i) for i in range(args.imagens_distintas)]
+    from processamento_imagem import codificar_jpeg, preparar_imagem
+    cargas = {
+        "fotos": fotos,
+        "redimensionadas": [codificar_jpeg(preparar_imagem(foto, 416)[0]) for foto in fotos],
+    }
+
+    if args.uvicorn or args.url:
+        servidor = ServidorUvicorn(args.com_cache, args.url, max(args.concorrencia))
+    else:
+        servidor = ServidorEmProcesso(args.com_cache)
+
+    resultados = []
+    async with servidor:
+        saude = None
+        for caixas in args.caixas:
+            await servidor.configurar(caixas)
+            if saude is None:
+                saude = (await servidor.cliente.get("/health")).json()
+            for endpoint in args.endpoints:
+                for concorrencia in args.concorrencia:
+                    resultado = await rodar_cenario(servidor, endpoint, concorrencia, caixas, args, cargas)
+                    resultados.append(resultado)
+                    if not args.json:
+                        imprimir_linha(resultado)
+
+    return {
+        "commit": commit_atual(),
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "modo": "url" if args.url else "uvicorn" if args.uvicorn else "em_processo",
+        "config": {
+            "tamanho": args.tamanho, "imagens_distintas": args.imagens_distintas, "crops": args.crops,
+            "requisicoes": args.requisicoes, "aquecimento": args.aquecimento, "com_cache": args.com_cache,
+        },
+        "ambiente": {
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "hardware": (saude or {}).get("hardware"),
+            "executor": {k: v for k, v in ((saude or {}).get("executor") or {}).items()
+                         if k in ("threads", "processos", "max_fila")},
+            "modelos": (saude or {}).get("models"),
+        },
+        "resultados": resultados,
+    }
+
+
+# ========================================
+# SAÍDA E COMPARAÇÃO
+# ========================================
+def imprimir_cabecalho():
+    print(f"{'endpoint':<14} {'conc':>5} {'caixas':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'erros':>6} {'RSS MB':>8}")
+
+
+def imprimir_linha(r):
+    lat = r["latencia_ms"]
+    rss = f"{r['rss_pico_mb']:.0f}" if r["rss_pico_mb"] else "-"
+    print(f"{r['endpoint']:<14} {r['concorrencia']:>5} {r['caixas']:>6} {r['requisicoes_s']:>8.1f} "
+          f"{lat['p50']:>9.1f} {lat['p95']:>9.1f} {lat['p99']:>9.1f} {r['erros']:>6} {rss:>8}")
+
+
+def comparar(base, atual, tolerancia):
+    """Compara p95 e vazão por cenário; retorna True se nenhuma regressão passar da tolerância"""
+    chave = lambda r: (r["endpoint"], r["concorrencia"], r["caixas"])  # noqa: E731
+    anteriores = {chave(r): r for r in base["resultados"]}
+    print(f"\n📊 Comparação com {base.get('commit')} (tolerância {tolerancia:.0%})")
+    print(f"{'endpoint':<14} {'conc':>5} {'caixas':>6} {'p95 base':>9} {'p95':>9} {'Δ':>7} "
+          f"{'req/s base':>11} {'req/s':>8} {'Δ':>7}")
+    ok = True
+    comuns = 0
+    for r in atual["resultados"]:
+        b = anteriores.get(chave(r))
+        if b is None:
+            continue
+        comuns += 1
+        d_p95 = r["latencia_ms"]["p95"] / b["latencia_ms"]["p95"] - 1
+        d_rps = r["requisicoes_s"] / b["requisicoes_s"] - 1 if b["requisicoes_s"] else 0.0
+        regressao = d_p95 > tolerancia or d_rps < -tolerancia
+        ok &= not regressao
+        print(f"{r['endpoint']:<14} {r['concorrencia']:>5} {r['caixas']:>6} {b['latencia_ms']['p95']:>9.1f} "
+              f"{r['latencia_ms']['p95']:>9.1f} {d_p95:>+7.0%} {b['requisicoes_s']:>11.1f} "
+              f"{r['requisicoes_s']:>8.1f} {d_rps:>+7.0%}{'  ❌' if regressao else ''}")
+    if not comuns:
+        print("⚠️ Nenhum cenário em comum com a execução base")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=["deteccao", "classificacao"])
+    parser.add_argument("--concorrencia", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--caixas", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requisicoes", type=int, default=200, help="Requisições medidas por cenário")
+    parser.add_argument("--aquecimento", type=int, default=5, help="Requisições descartadas por cenário")
+    parser.add_argument("--tamanho", default="1600x1200", help="Resolução das fotos sintéticas")
+    parser.add_argument("--imagens-distintas", type=int, default=8)
+    parser.add_argument("--crops", default="full", help="Modo de recortes nas respostas (?crops=)")
+    parser.add_argument("--com-cache", action="store_true", help="Mantém o cache de resultados ligado")
+    parser.add_argument("--uvicorn", action="store_true", help="Servidor uvicorn local em subprocesso")
+    parser.add_argument("--url", help="Servidor já no ar (as caixas do YOLO são as dele)")
+    parser.add_argument("--saida", help="Arquivo JSON com os resultados")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior (ex.: do commit base)")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Regressão máxima de p95/vazão")
+    parser.add_argument("--json", action="store_true", help="Saída em JSON")
+    args = parser.parse_args()
+
+    if not args.json:
+        imprimir_cabecalho()
+    relatorio = asyncio.run(executar(args))
+
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(relatorio, indent=2))
+    if args.json:
+        print(json.dumps(relatorio, indent=2))
+
+    if args.comparar:
+        base = json.loads(Path(args.comparar).read_text())
+        sys.exit(0 if comparar(base, relatorio, args.tolerancia) else 1)
+
+
+if __name__ == "__main__":
+    main()
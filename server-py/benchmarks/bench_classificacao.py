@@ -0,0 +1,98 @@
+"""
+Benchmark: latência da classificação vs número de caixas.
+
+Compara o caminho antigo (um `predict` por caixa) com o lote único
+(array (N, 224, 224, 3) + forward pass compilado) e confere se as
+classes/confianças por caixa continuam iguais.
+
+Uso (dentro de server-py/):
+    python benchmarks/bench_classificacao.py --caixas 1 2 4 8 16 --repeticoes 10
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import api_ia  # noqa: E402
+
+
+def gerar_recortes(n, seed=0):
+    """Recortes sintéticos de tamanhos variados (como caixas reais do YOLO)"""
+    rng = np.random.default_rng(seed)
+    recortes = []
+    for _ in range(n):
+        w, h = rng.integers(40, 220, size=2)
+        arr = rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8)
+        recortes.append(Image.fromarray(arr, "RGB"))
+    return recortes
+
+
+def classificar_por_caixa(recortes):
+    """Caminho antigo: preprocessamento e predict individuais"""
+    preds = []
+    for recorte in recortes:
+        img_array = api_ia.preprocessar_recortes([recorte])
+        preds.append(api_ia.modelo_classificacao.predict(img_array, verbose=0)[0])
+    return np.stack(preds)
+
+
+def classificar_em_lote(recortes):
+    """Caminho novo: um array contíguo e um forward pass compilado"""
+    return api_ia.classificar_lote(api_ia.preprocessar_recortes(recortes))
+
+
+def medir(funcao, recortes, repeticoes):
+    funcao(recortes)  # aquecimento
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(recortes)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return float(np.median(tempos))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--caixas", type=int, nargs="+", default=[1, 2, 4, 6, 8, 10, 16])
+    parser.add_argument("--repeticoes", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Saída em JSON")
+    args = parser.parse_args()
+
+    asyncio.run(api_ia.carregar_modelo_classificacao())
+
+    linhas = []
+    for n in args.caixas:
+        recortes = gerar_recortes(n)
+
+        antigo = classificar_por_caixa(recortes)
+        novo = classificar_em_lote(recortes)
+
+        linhas.append({
+            "caixas": n,
+            "por_caixa_ms": round(medir(classificar_por_caixa, recortes, args.repeticoes), 2),
+            "lote_unico_ms": round(medir(classificar_em_lote, recortes, args.repeticoes), 2),
+            "classes_iguais": bool(np.array_equal(antigo.argmax(axis=1), novo.argmax(axis=1))),
+            "max_diff_conf": float(np.abs(antigo - novo).max()),
+        })
+
+    if args.json:
+        print(json.dumps({"modelo": api_ia.CLASSIFIER_INFO, "resultados": linhas}, indent=2))
+        return
+
+    print(f"\nModelo: {api_ia.CLASSIFIER_INFO['name']} (mock={api_ia.CLASSIFIER_INFO['is_mock']})")
+    print(f"{'caixas':>7} {'por caixa (ms)':>15} {'lote único (ms)':>16} {'speedup':>8} {'iguais':>7} {'max diff':>10}")
+    for linha in linhas:
+        speedup = linha["por_caixa_ms"] / linha["lote_unico_ms"] if linha["lote_unico_ms"] else float("inf")
+        print(f"{linha['caixas']:>7} {linha['por_caixa_ms']:>15.2f} {linha['lote_unico_ms']:>16.2f} "
+              f"{speedup:>7.1f}x {str(linha['classes_iguais']):>7} {linha['max_diff_conf']:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: latência do índice de embeddings por paciente.
+
+Preenche o índice de um paciente com N embeddings (dimensão da ResNet50,
+2048) e mede a busca k-NN de um lote de recortes, a inclusão de vetores
+novos e o recarregamento a frio (outro worker lendo do disco; inclui
+gerar a projeção). `acerto` é a fração das consultas (um vetor do
+histórico com ruído, como a mesma lesão fotografada de novo) cujo vizinho
+mais próximo no índice projetado (--dimensao-indice) é o vetor de origem;
+`acerto_exato` é o mesmo na busca exata nos 2048.
+
+Uso (dentro de server-py/):
+    python benchmarks/bench_embeddings.py --vetores 100 1000 10000
+    python benchmarks/bench_embeddings.py --dimensao-indice 0   # sem projeção
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from indice_embeddings import IndiceEmbeddings, normalizar  # noqa: E402
+
+
+def medir_ms(funcao, repeticoes):
+    funcao()  # aquecimento
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return round(float(np.median(tempos)), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vetores", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--dimensao", type=int, default=2048, help="Dimensão dos embeddings do modelo")
+    parser.add_argument("--dimensao-indice", type=int, default=256, help="Projeção no índice (0 = sem)")
+    parser.add_argument("--consultas", type=int, default=4, help="Recortes por requisição")
+    parser.add_argument("--ruido", type=float, default=1.0, help="Ruído das consultas (relativo ao vetor)")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeticoes", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="Saída em JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    linhas = []
+    for n in args.vetores:
+        with tempfile.TemporaryDirectory() as pasta:
+            indice = IndiceEmbeddings(pasta, dimensao=args.dimensao_indice)
+            base = rng.standard_normal((n, args.dimensao)).astype(np.float32)
+            indice.adicionar("paciente", base, [{"i": i} for i in range(n)])
+            # Consultas parecidas com vetores do histórico (a mesma lesão fotografada de novo)
+            alvos = rng.choice(n, args.consultas, replace=False)
+            consultas = base[alvos] + args.ruido * rng.standard_normal((args.consultas, args.dimensao)).astype(np.float32)
+
+            exatos = (normalizar(consultas) @ normalizar(base).T).argmax(axis=1)
+            vizinhos = indice.buscar("paciente", consultas, args.k)
+            acerto = np.mean([achados[0]["i"] == alvo for achados, alvo in zip(vizinhos, alvos)])
+
+            def recarregar():
+                IndiceEmbeddings(pasta, dimensao=args.dimensao_indice).buscar("paciente", consultas, args.k)
+
+            def adicionar():
+                indice.adicionar("paciente", rng.standard_normal((1, args.dimensao)), [{"i": -1}])
+
+            linhas.append({
+                "vetores": n,
+                "busca_ms": medir_ms(lambda: indice.buscar("paciente", consultas, args.k), args.repeticoes),
+                "adicionar_ms": medir_ms(adicionar, min(args.repeticoes, 20)),
+                "recarregar_ms": medir_ms(recarregar, min(args.repeticoes, 5)),
+                "acerto": round(float(acerto), 3),
+                "acerto_exato": round(float(np.mean(exatos == alvos)), 3),
+                "disco_mb": round(sum(d["bytes"] for d in indice.resumo("paciente")["por_dimensao"].values()) / 2**20, 2),
+            })
+
+    if args.json:
+        print(json.dumps(linhas, indent=2))
+        return
+
+    print(f"\nDimensão {args.dimensao} -> {args.dimensao_indice or args.dimensao}, "
+          f"{args.consultas} recortes por busca, k={args.k}")
+    print(f"{'vetores':>8} {'busca (ms)':>11} {'adicionar (ms)':>15} {'a frio (ms)':>12} "
+          f"{'acerto':>7} {'exato':>6} {'disco (MB)':>11}")
+    for linha in linhas:
+        print(f"{linha['vetores']:>8} {linha['busca_ms']:>11.3f} {linha['adicionar_ms']:>15.3f} "
+              f"{linha['recarregar_ms']:>12.3f} {linha['acerto']:>7.3f} {linha['acerto_exato']:>6.3f} "
+              f"{linha['disco_mb']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
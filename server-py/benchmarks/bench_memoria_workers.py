@@ -0,0 +1,110 @@
+"""
+Benchmark: memória total do servidor pré-fork por número de workers.
+
+Sobe `servidor_prefork.py` com 1, 2, 4... workers, espera /health/ready,
+faz algumas requisições de detecção (para cada worker tocar nos modelos) e
+soma PSS/USS de toda a árvore de processos. PSS divide as páginas
+compartilhadas entre os processos, então a soma é a RAM de fato usada;
+com os modelos compartilhados ela deve crescer bem menos que N x 1 worker.
+
+Uso (dentro de server-py/):
+    python benchmarks/bench_memoria_workers.py --workers 1 2 4
+    MOCK_MODELS=1 python benchmarks/bench_memoria_workers.py --workers 1 2
+    INFERENCE_BACKEND=onnx python benchmarks/bench_memoria_workers.py --workers 1 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import psutil
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+
+from bench_preprocessamento import gerar_jpeg  # noqa: E402
+
+
+def esperar_pronto(url, processo, timeout):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f"Servidor terminou com código {processo.returncode}")
+        try:
+            if httpx.get(f"{url}/health/ready", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"Servidor não ficou pronto em {timeout}s")
+
+
+def memoria_arvore(pid):
+    """Soma de RSS, PSS e USS (MB) do processo e de todos os filhos"""
+    raiz = psutil.Process(pid)
+    total = {"rss_mb": 0.0, "pss_mb": 0.0, "uss_mb": 0.0, "processos": 0}
+    for processo in [raiz] + raiz.children(recursive=True):
+        try:
+            m = processo.memory_full_info()
+        except psutil.NoSuchProcess:
+            continue
+        total["rss_mb"] += m.rss / 2**20
+        total["pss_mb"] += m.pss / 2**20
+        total["uss_mb"] += m.uss / 2**20
+        total["processos"] += 1
+    return {k: round(v, 1) for k, v in total.items()}
+
+
+def medir(workers, porta, requisicoes, timeout):
+    url = f"http://127.0.0.1:{porta}"
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), MODEL_LOADING="blocking")
+    processo = subprocess.Popen(
+        [sys.executable, "servidor_prefork.py", "--host", "127.0.0.1", "--port", str(porta)],
+        cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        esperar_pronto(url, processo, timeout)
+        imagem = gerar_jpeg(1200, 900)
+        # Conexões novas a cada requisição para espalhar entre os workers
+        for _ in range(requisicoes * workers):
+            httpx.post(f"{url}/predict/detection", files={"file": ("foto.jpg", imagem, "image/jpeg")}, timeout=120)
+        time.sleep(1)
+        return {"workers": workers, **memoria_arvore(processo.pid)}
+    finally:
+        processo.terminate()
+        try:
+            processo.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            processo.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--porta", type=int, default=8799)
+    parser.add_argument("--requisicoes", type=int, default=4, help="Requisições de detecção por worker")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", action="store_true", help="Saída em JSON")
+    args = parser.parse_args()
+
+    resultados = [medir(n, args.porta, args.requisicoes, args.timeout) for n in args.workers]
+    base = resultados[0]["pss_mb"] / resultados[0]["workers"]
+    for r in resultados:
+        r["pss_vs_linear"] = round(r["pss_mb"] / (base * r["workers"]), 2)
+
+    if args.json:
+        print(json.dumps(resultados, indent=2))
+        return
+
+    print(f"{'workers':>8} {'processos':>10} {'RSS soma (MB)':>14} {'PSS (MB)':>10} {'USS (MB)':>10} {'PSS/linear':>11}")
+    for r in resultados:
+        print(f"{r['workers']:>8} {r['processos']:>10} {r['rss_mb']:>14.1f} {r['pss_mb']:>10.1f} "
+              f"{r['uss_mb']:>10.1f} {r['pss_vs_linear']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark: preprocessamento PIL (por imagem/recorte) vs NumPy/OpenCV vetorizado.
+
+Compara, para cada tamanho de foto:
+- decodificação + letterbox (`decodificar_imagem` + `redimensionar_imagem`
+  vs `preparar_imagem`, que usa `decodificar_rgb` + `redimensionar_array`)
+- decodificação reduzida de JPEG (modo draft, `preparar_imagem(..., reduzir=True)`):
+  latência e memória do array decodificado
+- lote do classificador com N caixas (crop + resize PIL por caixa vs
+  `montar_lote` no buffer reutilizado)
+
+e confere as saídas: decodificação idêntica, `resize_info` idêntico e
+diferença de pixels dentro da tolerância (o filtro do OpenCV não é o do
+PIL). Termina com código 1 se alguma tolerância for violada.
+
+Uso (dentro de server-py/):
+    python benchmarks/bench_preprocessamento.py --tamanhos 1200x900 4032x3024 --caixas 1 4 8 16
+    python benchmarks/bench_preprocessamento.py --imagens fotos/
+"""
+import argparse
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from preprocessamento import decodificar_reduzido, decodificar_rgb, montar_lote, normalizar_lote  # noqa: E402
+from processamento_imagem import decodificar_imagem, preparar_imagem, redimensionar_imagem  # noqa: E402
+
+TARGET_SIZE = 416
+
+
+def gerar_jpeg(largura, altura, seed=0):
+    """Foto sintética (mesmo conteúdo em qualquer resolução + ruído de sensor), codificada em JPEG"""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8)
+    arr = cv2.resize(base, (largura, altura), interpolation=cv2.INTER_CUBIC)
+    arr = np.clip(arr + rng.normal(0, 4, arr.shape), 0, 255).astype(np.uint8)
+    buffered = io.BytesIO()
+    Image.fromarray(arr).save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+
+def gerar_caixas(n, target_size, seed=1):
+    rng = np.random.default_rng(seed)
+    caixas = []
+    for _ in range(n):
+        w, h = rng.integers(30, target_size // 2, size=2)
+        x1, y1 = rng.integers(0, target_size - w), rng.integers(0, target_size - h)
+        caixas.append((int(x1), int(y1), int(x1 + w), int(y1 + h)))
+    return caixas
+
+
+def preparar_pil(contents):
+    return redimensionar_imagem(decodificar_imagem(contents), TARGET_SIZE)
+
+
+def lote_pil(img, caixas):
+    """Caminho anterior: crop + resize PIL por caixa, copiados para o lote float32"""
+    lote = np.empty((len(caixas), 224, 224, 3), dtype=np.float32)
+    for i, caixa in enumerate(caixas):
+        lote[i] = np.asarray(img.crop(caixa).resize((224, 224)), dtype=np.float32)
+    return lote
+
+
+def medir(funcao, *args, repeticoes=10):
+    funcao(*args)  # aquecimento
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(*args)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return float(np.median(tempos))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", nargs="+", default=["1200x900", "4032x3024"])
+    parser.add_argument("--imagens", help="Pasta com fotos reais (substitui --tamanhos)")
+    parser.add_argument("--caixas", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--repeticoes", type=int, default=10)
+    parser.add_argument("--tol-media", type=float, default=2.0, help="Diferença média máxima (níveis de cinza)")
+    parser.add_argument("--json", action="store_true", help="Saída em JSON")
+    args = parser.parse_args()
+
+    linhas = []
+    ok = True
+    if args.imagens:
+        caminhos = sorted(p for p in Path(args.imagens).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+        entradas = [(p.name, p.read_bytes()) for p in caminhos]
+    else:
+        entradas = [(t, gerar_jpeg(*(int(v) for v in t.split("x")))) for t in args.tamanhos]
+
+    for tamanho, contents in entradas:
+
+        decod_igual = bool(np.array_equal(np.asarray(decodificar_imagem(contents)), decodificar_rgb(contents)))
+        img_pil, info_pil = preparar_pil(contents)
+        img_np, info_np = preparar_imagem(contents, TARGET_SIZE, reduzir=False)
+        diff_letterbox = np.abs(np.asarray(img_pil, dtype=np.int16) - img_np.astype(np.int16))
+        img_draft, info_draft = preparar_imagem(contents, TARGET_SIZE)
+        diff_draft = np.abs(img_draft.astype(np.int16) - img_np.astype(np.int16))
+
+        linha = {
+            "tamanho": tamanho,
+            "decodificacao_identica": decod_igual,
+            "resize_info_identico": info_pil == info_np,
+            "letterbox_diff_media": round(float(diff_letterbox.mean()), 3),
+            "letterbox_diff_max": int(diff_letterbox.max()),
+            "letterbox_pil_ms": round(medir(preparar_pil, contents, repeticoes=args.repeticoes), 2),
+            "letterbox_vetorizado_ms": round(medir(preparar_imagem, contents, TARGET_SIZE, False, repeticoes=args.repeticoes), 2),
+            "draft_ms": round(medir(preparar_imagem, contents, TARGET_SIZE, repeticoes=args.repeticoes), 2),
+            "draft_resize_info_identico": info_draft == info_np,
+            "draft_diff_media": round(float(diff_draft.mean()), 3),
+            "decodificado_mb": round(decodificar_rgb(contents).nbytes / 2**20, 2),
+            "decodificado_draft_mb": round(decodificar_reduzido(contents, TARGET_SIZE)[0].nbytes / 2**20, 2),
+            "lotes": [],
+        }
+        ok &= linha["resize_info_identico"] and linha["letterbox_diff_media"] <= args.tol_media
+        ok &= linha["draft_resize_info_identico"] and linha["draft_diff_media"] <= args.tol_media
+
+        for n in args.caixas:
+            caixas = gerar_caixas(n, TARGET_SIZE)
+            referencia = lote_pil(img_pil, caixas)
+            vetorizado = montar_lote(img_np, caixas, modo="escala") * np.float32(255.0)
+            diff = np.abs(referencia - vetorizado)
+            lote = {
+                "caixas": n,
+                "diff_media": round(float(diff.mean()), 3),
+                "diff_max": round(float(diff.max()), 1),
+                "pil_ms": round(medir(lambda: normalizar_lote(lote_pil(img_pil, caixas).astype(np.uint8)),
+                                      repeticoes=args.repeticoes), 2),
+                "vetorizado_ms": round(medir(montar_lote, img_np, caixas, repeticoes=args.repeticoes), 2),
+            }
+            ok &= lote["diff_media"] <= args.tol_media
+            linha["lotes"].append(lote)
+        linhas.append(linha)
+
+    if args.json:
+        print(json.dumps({"target_size": TARGET_SIZE, "ok": ok, "resultados": linhas}, indent=2))
+        sys.exit(0 if ok else 1)
+
+    for linha in linhas:
+        print(f"\n📷 {linha['tamanho']} -> {TARGET_SIZE}: decodificação idêntica={linha['decodificacao_identica']}, "
+              f"resize_info idêntico={linha['resize_info_identico']}")
+        print(f"   letterbox: PIL {linha['letterbox_pil_ms']:.2f} ms | vetorizado {linha['letterbox_vetorizado_ms']:.2f} ms "
+              f"| diff média {linha['letterbox_diff_media']} (máx {linha['letterbox_diff_max']})")
+        print(f"   draft: {linha['draft_ms']:.2f} ms | decodificado {linha['decodificado_mb']} MB -> "
+              f"{linha['decodificado_draft_mb']} MB | diff média {linha['draft_diff_media']} "
+              f"| resize_info idêntico={linha['draft_resize_info_identico']}")
+        print(f"   {'caixas':>7} {'PIL (ms)':>10} {'vetorizado (ms)':>16} {'speedup':>8} {'diff média':>11} {'diff máx':>9}")
+        for lote in linha["lotes"]:
+            speedup = lote["pil_ms"] / lote["vetorizado_ms"] if lote["vetorizado_ms"] else float("inf")
+            print(f"   {lote['caixas']:>7} {lote['pil_ms']:>10.2f} {lote['vetorizado_ms']:>16.2f} {speedup:>7.1f}x "
+                  f"{lote['diff_media']:>11} {lote['diff_max']:>9}")
+    print(f"\n{'✅' if ok else '❌'} Tolerância: diferença média <= {args.tol_media}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: custo da classificação com TTA (?tta=true).
+
+Compara, para N caixas e as K vistas de TTA_VIEWS:
+- sem TTA: um forward pass com N recortes (referência)
+- TTA ingênuo: um `predict` por vista de cada caixa (N x K chamadas)
+- TTA em lote: as N x K vistas em um único forward pass (o da API)
+
+Uso (dentro de server-py/):
+    python benchmarks/bench_tta.py --caixas 1 4 8 --repeticoes 5
+    TTA_VIEWS=original,flip_h python benchmarks/bench_tta.py
+"""
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import api_ia  # noqa: E402
+from bench_classificacao import gerar_recortes, medir  # noqa: E402
+from tta import agregar, expandir_lote  # noqa: E402
+
+
+def sem_tta(recortes):
+    return api_ia.classificar_lote(api_ia.preprocessar_recortes(recortes))
+
+
+def tta_ingenuo(recortes):
+    """Uma chamada por vista de cada caixa"""
+    vistas = api_ia.TTA_CONFIG["vistas"]
+    preds = []
+    for recorte in recortes:
+        for vista in expandir_lote(api_ia.preprocessar_recortes([recorte]), vistas):
+            preds.append(api_ia.modelo_classificacao.predict(vista[None], verbose=0)[0])
+    return agregar(np.stack(preds), len(vistas))[0]
+
+
+def tta_em_lote(recortes):
+    """Todas as vistas de todas as caixas em um forward pass"""
+    vistas = api_ia.TTA_CONFIG["vistas"]
+    lote = expandir_lote(api_ia.preprocessar_recortes(recortes), vistas)
+    return agregar(api_ia.classificar_lote(lote), len(vistas))[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--caixas", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Saída em JSON")
+    args = parser.parse_args()
+
+    asyncio.run(api_ia.carregar_modelo_classificacao())
+    k = len(api_ia.TTA_CONFIG["vistas"])
+
+    linhas = []
+    for n in args.caixas:
+        recortes = gerar_recortes(n)
+        linhas.append({
+            "caixas": n,
+            "vistas": k,
+            "sem_tta_ms": round(medir(sem_tta, recortes, args.repeticoes), 2),
+            "tta_ingenuo_ms": round(medir(tta_ingenuo, recortes, args.repeticoes), 2),
+            "tta_lote_ms": round(medir(tta_em_lote, recortes, args.repeticoes), 2),
+            "max_diff_prob": float(np.abs(tta_ingenuo(recortes) - tta_em_lote(recortes)).max()),
+        })
+
+    if args.json:
+        print(json.dumps({"modelo": api_ia.CLASSIFIER_INFO, "vistas": api_ia.TTA_CONFIG["vistas"],
+                          "resultados": linhas}, indent=2))
+        return
+
+    print(f"\nModelo: {api_ia.CLASSIFIER_INFO['name']} (mock={api_ia.CLASSIFIER_INFO['is_mock']}), "
+          f"vistas: {', '.join(api_ia.TTA_CONFIG['vistas'])}")
+    print(f"{'caixas':>7} {'sem TTA (ms)':>13} {'ingênuo (ms)':>13} {'lote (ms)':>10} "
+          f"{'lote/sem':>9} {'ingênuo/lote':>13} {'max diff':>10}")
+    for linha in linhas:
+        print(f"{linha['caixas']:>7} {linha['sem_tta_ms']:>13.2f} {linha['tta_ingenuo_ms']:>13.2f} "
+              f"{linha['tta_lote_ms']:>10.2f} {linha['tta_lote_ms'] / linha['sem_tta_ms']:>8.1f}x "
+              f"{linha['tta_ingenuo_ms'] / linha['tta_lote_ms']:>12.1f}x {linha['max_diff_prob']:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Cache de resultados de inferência endereçado por conteúdo.
+
+A chave é o SHA-256 dos bytes da imagem combinado com a versão dos
+modelos, limiares e `target_size` (ver `chave_cache`). Os valores
+(JSON) ficam em memória com LRU/TTL limitado em bytes e, opcionalmente,
+em uma camada em disco que sobrevive a reinícios.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+
+def digest_conteudo(dados):
+    """SHA-256 (hex) dos bytes de uma imagem"""
+    return hashlib.sha256(dados).hexdigest()
+
+
+def chave_cache(*partes):
+    """Chave estável a partir de partes serializáveis em JSON"""
+    return hashlib.sha256(json.dumps(partes, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class CacheResultados:
+    """LRU + TTL em memória (limite em bytes) com camada opcional em disco.
+
+    Os valores são guardados serializados: quem lê recebe uma cópia nova,
+    que pode ser alterada sem afetar o cache.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_s=3600, pasta=None, max_bytes_disco=512 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.ttl_s = float(ttl_s)
+        self.pasta = Path(pasta) if pasta else None
+        self.max_bytes_disco = int(max_bytes_disco)
+        self._itens = OrderedDict()  # chave -> (criado_em, bytes)
+        self._bytes = 0
+        self._contadores = defaultdict(lambda: defaultdict(int))
+
+        self._bytes_disco = 0
+        if self.pasta is not None:
+            self.pasta.mkdir(parents=True, exist_ok=True)
+            self._bytes_disco = sum(p.stat().st_size for p in self.pasta.glob("*.json"))
+
+    def obter(self, tipo, chave):
+        """Valor guardado ou None (contabiliza acerto/falta por `tipo`)"""
+        contadores = self._contadores[tipo]
+        item = self._itens.get(chave)
+        if item is not None:
+            criado_em, dados = item
+            if time.time() - criado_em <= self.ttl_s:
+                self._itens.move_to_end(chave)
+                contadores["acertos_memoria"] += 1
+                return json.loads(dados)
+            self._remover(chave)
+            contadores["expiradas"] += 1
+
+        dados = self._ler_disco(chave)
+        if dados is not None:
+            contadores["acertos_disco"] += 1
+            self._guardar_memoria(chave, dados, time.time())
+            return json.loads(dados)
+
+        contadores["faltas"] += 1
+        return None
+
+    def guardar(self, tipo, chave, valor):
+        dados = json.dumps(valor, separators=(",", ":")).encode()
+        self._guardar_memoria(chave, dados, time.time())
+        self._gravar_disco(chave, dados)
+        self._contadores[tipo]["gravacoes"] += 1
+
+    def _guardar_memoria(self, chave, dados, criado_em):
+        if len(dados) > self.max_bytes:
+            return
+        if chave in self._itens:
+            self._remover(chave)
+        self._itens[chave] = (criado_em, dados)
+        self._bytes += len(dados)
+        while self._bytes > self.max_bytes:
+            antiga = next(iter(self._itens))
+            self._remover(antiga)
+            self._contadores["_memoria"]["removidas"] += 1
+
+    def _remover(self, chave):
+        _, dados = self._itens.pop(chave)
+        self._bytes -= len(dados)
+
+    # ---------- disco ----------
+    def _arquivo(self, chave):
+        return self.pasta / f"{chave}.json"
+
+    def _ler_disco(self, chave):
+        if self.pasta is None:
+            return None
+        arquivo = self._arquivo(chave)
+        try:
+            if time.time() - arquivo.stat().st_mtime > self.ttl_s:
+                self._apagar_disco(arquivo)
+                return None
+            return arquivo.read_bytes()
+        except OSError:
+            return None
+
+    def _gravar_disco(self, chave, dados):
+        if self.pasta is None:
+            return
+        arquivo = self._arquivo(chave)
+        temporario = arquivo.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            anterior = arquivo.stat().st_size if arquivo.exists() else 0
+            temporario.write_bytes(dados)
+            os.replace(temporario, arquivo)  # escrita atômica (vários workers)
+            self._bytes_disco += len(dados) - anterior
+        except OSError:
+            return
+        if self._bytes_disco > self.max_bytes_disco:
+            self._podar_disco()
+
+    def _apagar_disco(self, arquivo):
+        try:
+            tamanho = arquivo.stat().st_size
+            arquivo.unlink()
+            self._bytes_disco -= tamanho
+        except OSError:
+            pass
+
+    def _podar_disco(self):
+        """Remove os arquivos mais antigos até ficar em 90% do limite"""
+        arquivos = []
+        for arquivo in self.pasta.glob("*.json"):
+            try:
+                estado = arquivo.stat()
+                arquivos.append((estado.st_mtime, estado.st_size, arquivo))
+            except OSError:
+                continue
+        self._bytes_disco = sum(tamanho for _, tamanho, _ in arquivos)
+        for _, _, arquivo in sorted(arquivos):
+            if self._bytes_disco <= self.max_bytes_disco * 0.9:
+                break
+            self._apagar_disco(arquivo)
+            self._contadores["_disco"]["removidas"] += 1
+
+    def estatisticas(self):
+        por_tipo = {}
+        for tipo, contadores in self._contadores.items():
+            if tipo.startswith("_"):
+                continue
+            acertos = contadores["acertos_memoria"] + contadores["acertos_disco"]
+            consultas = acertos + contadores["faltas"]
+            por_tipo[tipo] = {**contadores, "taxa_acerto": round(acertos / consultas, 4) if consultas else None}
+        return {
+            "itens": len(self._itens),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl_s,
+            "removidas_memoria": self._contadores["_memoria"]["removidas"],
+            "disco": {
+                "pasta": str(self.pasta),
+                "bytes": self._bytes_disco,
+                "max_bytes": self.max_bytes_disco,
+                "removidas": self._contadores["_disco"]["removidas"],
+            } if self.pasta is not None else None,
+            "por_tipo": por_tipo,
+        }
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class FilaCheia(Exception):
+    """Limite de requisições em andamento atingido"""
+
+
+class ExecutorInferencia:
+    """Executor dedicado e limitado para trabalho bloqueante.
+
+    - Pool de threads para TensorFlow/PyTorch (liberam o GIL) e codecs PIL.
+    - Pool de processos opcional para o trabalho PIL (decode/resize/JPEG).
+    - Admissão limitada: acima de `max_fila` requisições em andamento,
+      `admitir()` levanta `FilaCheia` (a API responde 503).
+    """
+
+    def __init__(self, threads=4, processos=0, max_fila=32):
+        self.threads = max(1, int(threads))
+        self.processos = max(0, int(processos))
+        self.max_fila = max(1, int(max_fila))
+
+        self.pool_threads = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="inferencia")
+        self.pool_processos = None
+        if self.processos:
+            # spawn: não herda o estado de threads do TF/PyTorch do processo pai
+            self.pool_processos = ProcessPoolExecutor(
+                max_workers=self.processos,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+        self._em_andamento = 0
+        self._total_admitidas = 0
+        self._total_rejeitadas = 0
+
+        logger.info(f"🧵 Executor de inferência: {self.threads} threads, "
+                    f"{self.processos} processos, fila máx. {self.max_fila}")
+
+    async def aquecer(self):
+        """Inicia os processos do pool antes da primeira requisição"""
+        if self.pool_processos is None:
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self.pool_processos, os.getpid) for _ in range(self.processos)
+        ])
+
+    @asynccontextmanager
+    async def admitir(self):
+        """Reserva uma vaga para a requisição ou levanta FilaCheia"""
+        if self._em_andamento >= self.max_fila:
+            self._total_rejeitadas += 1
+            raise FilaCheia(f"{self._em_andamento} requisições em andamento (máx. {self.max_fila})")
+        self._em_andamento += 1
+        self._total_admitidas += 1
+        try:
+            yield
+        finally:
+            self._em_andamento -= 1
+
+    async def executar(self, funcao, *args, etapa=None, tempos=None):
+        """Executa `funcao(*args)` no pool de threads"""
+        return await self._executar(self.pool_threads, funcao, args, etapa, tempos)
+
+    async def executar_imagem(self, funcao, *args, etapa=None, tempos=None):
+        """Executa trabalho PIL no pool de processos (se habilitado) ou de threads"""
+        pool = self.pool_processos or self.pool_threads
+        return await self._executar(pool, funcao, args, etapa, tempos)
+
+    async def _executar(self, pool, funcao, args, etapa, tempos):
+        with cronometrar(tempos, etapa):
+            return await asyncio.get_running_loop().run_in_executor(pool, funcao, *args)
+
+    def estatisticas(self):
+        return {
+            "threads": self.threads,
+            "processos": self.processos,
+            "max_fila": self.max_fila,
+            "em_andamento": self._em_andamento,
+            "total_admitidas": self._total_admitidas,
+            "total_rejeitadas": self._total_rejeitadas,
+        }
+
+    def encerrar(self):
+        self.pool_threads.shutdown(wait=False, cancel_futures=True)
+        if self.pool_processos is not None:
+            self.pool_processos.shutdown(wait=False, cancel_futures=True)
+
+
+@contextmanager
+def cronometrar(tempos, etapa):
+    """Acumula a duração do bloco em `tempos[etapa]` (ms)"""
+    if tempos is None or etapa is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tempos[etapa] = round(tempos.get(etapa, 0.0) + (time.perf_counter() - inicio) * 1000, 3)
+
+
+def server_timing(tempos):
+    """Formata os tempos por etapa para o header Server-Timing"""
+    return ", ".join(f"{etapa};dur={dur}" for etapa, dur in tempos.items())
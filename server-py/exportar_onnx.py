@@ -0,0 +1,255 @@
+"""
+Exporta os modelos para ONNX (backend INFERENCE_BACKEND=onnx) e TorchScript
+(YOLO offline, sem torch.hub) e verifica paridade.
+
+    python exportar_onnx.py --classificador --yolo --torchscript [--verificar --imagens pasta/]
+
+Gera em models-ia/:
+    resnet50_consolidado.onnx     (a partir do .keras)
+    bestYolov5_test.onnx          (a partir do .pt; batch/altura/largura dinâmicos)
+    bestYolov5_test.torchscript   (a partir do .pt; tamanho fixo --tamanho-yolo,
+                                   classes e checksum do .pt embutidos)
+
+--verificar compara o modelo nativo com o ONNX (classes iguais e diferença
+de confiança <= --tolerancia; caixas com mesma classe e IoU >= --iou-min) e
+termina com código 1 se a paridade falhar.
+
+As variantes INT8 são geradas por `quantizar_modelos.py`.
+
+Dependências extras (apenas para exportar): pip install onnx tf2onnx
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import api_ia
+from backends_inferencia import ClassificadorONNX, DetectorONNX, DetectorTorchScript, hash_arquivo
+from preprocessamento import redimensionar_array
+
+CLASSIFICADOR_ONNX = api_ia.MODELS_DIR / "resnet50_consolidado.onnx"
+YOLO_ONNX = api_ia.MODELS_DIR / "bestYolov5_test.onnx"
+YOLO_TORCHSCRIPT = api_ia.MODELS_DIR / "bestYolov5_test.torchscript"
+
+
+# ========================================
+# EXPORTAÇÃO
+# ========================================
+def exportar_classificador(destino=CLASSIFICADOR_ONNX):
+    """Keras -> ONNX via tf2onnx (batch dinâmico; saídas: probabilidades e embedding)"""
+    import tensorflow as tf
+    import tf2onnx
+
+    asyncio.run(api_ia.carregar_modelo_classificacao())
+    if api_ia.CLASSIFIER_INFO["name"] != "resnet50_consolidado.keras":
+        # O backend ONNX aplica o preprocessamento da ResNet (nome do arquivo)
+        raise RuntimeError(f"Esperado resnet50_consolidado.keras, carregado: {api_ia.CLASSIFIER_INFO['name']}")
+    modelo = api_ia.modelo_classificacao
+    # Segunda saída: entrada da última camada (embedding usado no índice por paciente)
+    extrator = tf.keras.Model(modelo.inputs, [modelo.outputs[0], modelo.layers[-1].input])
+
+    spec = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name="input"),)
+
+    @tf.function(input_signature=spec)
+    def inferir(x):
+        return extrator(x, training=False)
+
+    tf2onnx.convert.from_function(inferir, input_signature=spec, opset=13, output_path=str(destino))
+    print(f"✅ Classificador exportado: {destino}")
+    return destino
+
+
+def carregar_modelo_deteccao():
+    """DetectionModel do YOLOv5 (sem AutoShape) configurado para exportação; retorna (modelo, names)"""
+    autoshape = asyncio.run(api_ia.carregar_yolo_customizado())
+    modelo = autoshape.model.model  # AutoShape -> DetectMultiBackend -> DetectionModel
+    modelo.float().eval()
+    for m in modelo.modules():
+        if type(m).__name__ == "Detect":
+            m.inplace = False
+            m.export = True  # retorna só as predições concatenadas
+    names = autoshape.names
+    return modelo, dict(enumerate(names)) if isinstance(names, (list, tuple)) else dict(names)
+
+
+def exportar_yolo(destino=YOLO_ONNX, tamanho=640):
+    """YOLOv5 (.pt) -> ONNX com saída bruta (B, N, 5 + classes) e nomes das classes nos metadados"""
+    import onnx
+    import torch
+
+    modelo, names = carregar_modelo_deteccao()
+    dummy = torch.zeros(1, 3, tamanho, tamanho)
+    extras = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        extras["dynamo"] = False  # exportador TorchScript (torch >= 2.5 usa dynamo por padrão)
+    torch.onnx.export(
+        modelo, dummy, str(destino),
+        opset_version=12,
+        input_names=["images"],
+        output_names=["output0"],
+        dynamic_axes={"images": {0: "batch", 2: "height", 3: "width"}, "output0": {0: "batch", 1: "anchors"}},
+        do_constant_folding=True,
+        **extras
+    )
+
+    modelo_onnx = onnx.load(str(destino))
+    metadados = {"stride": int(max(modelo.stride)), "names": names}
+    for chave, valor in metadados.items():
+        item = modelo_onnx.metadata_props.add()
+        item.key, item.value = chave, str(valor)
+    onnx.save(modelo_onnx, str(destino))
+    print(f"✅ YOLO exportado: {destino}")
+    return destino
+
+
+def exportar_yolo_torchscript(destino=YOLO_TORCHSCRIPT, tamanho=640):
+    """YOLOv5 (.pt) -> TorchScript (trace em tamanho fixo) com config.txt versionado"""
+    import torch
+
+    modelo, names = carregar_modelo_deteccao()
+    dummy = torch.zeros(1, 3, tamanho, tamanho)
+    with torch.no_grad():
+        modelo(dummy)  # inicializa as grades do Detect para este tamanho
+        script = torch.jit.trace(modelo, dummy, strict=False)
+
+    origem = api_ia.MODELS_DIR / "bestYolov5_test.pt"
+    sha256_origem = hash_arquivo(origem)
+    config = {
+        "imgsz": tamanho,
+        "stride": int(max(modelo.stride)),
+        "names": names,
+        "origem": origem.name,
+        "sha256_origem": sha256_origem,
+        "versao": f"{origem.stem}-{sha256_origem[:12]}",
+        "torch": torch.__version__,
+        "exportado_em": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    script.save(str(destino), _extra_files={"config.txt": json.dumps(config)})
+    print(f"✅ YOLO TorchScript exportado: {destino} ({config['versao']})")
+    return destino
+
+
+# ========================================
+# PARIDADE
+# ========================================
+def carregar_imagens(pasta, quantidade, seed=0):
+    """Imagens da pasta (jpg/png) ou sintéticas se nenhuma pasta for informada"""
+    if pasta:
+        caminhos = sorted(p for p in Path(pasta).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+        return [Image.open(p).convert("RGB") for p in caminhos[:quantidade]]
+    rng = np.random.default_rng(seed)
+    return [Image.fromarray(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)) for _ in range(quantidade)]
+
+
+def verificar_classificador(caminho, imagens, tolerancia):
+    rng = np.random.default_rng(1)
+    recortes = []
+    for img in imagens:
+        w, h = img.size
+        for _ in range(4):
+            x1, y1 = int(rng.integers(0, w // 2)), int(rng.integers(0, h // 2))
+            recortes.append(img.crop((x1, y1, x1 + int(rng.integers(32, w // 2)), y1 + int(rng.integers(32, h // 2)))))
+
+    # O nome do arquivo define o preprocessamento (ResNet vs /255), como na API
+    lote = api_ia.preprocessar_recortes(recortes)
+    nativo = np.asarray(api_ia.modelo_classificacao.predict(lote, verbose=0))
+    onnx = ClassificadorONNX(caminho)(lote)
+
+    rotulos_iguais = float((nativo.argmax(1) == onnx.argmax(1)).mean())
+    diferenca = float(np.abs(nativo - onnx).max())
+    ok = rotulos_iguais == 1.0 and diferenca <= tolerancia
+    print(f"{'✅' if ok else '❌'} Classificador {caminho.name}: {len(recortes)} recortes, "
+          f"rótulos iguais {rotulos_iguais:.1%}, max |Δconf| {diferenca:.2e} (tol {tolerancia:g})")
+    return ok
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    uniao = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / uniao if uniao > 0 else 0.0
+
+
+def verificar_yolo(caminho, imagens, iou_min, tamanho):
+    nativo_modelo = asyncio.run(api_ia.carregar_yolo_customizado())
+    if caminho.suffix == ".torchscript":
+        exportado_modelo = DetectorTorchScript(caminho)
+    else:
+        exportado_modelo = DetectorONNX(caminho, tamanho)
+    nativo_modelo.conf = exportado_modelo.conf = 0.25
+    nativo_modelo.iou = exportado_modelo.iou = 0.45
+
+    total = casadas = 0
+    for img in imagens:
+        img_resized, _ = redimensionar_array(np.asarray(img), api_ia.HARDWARE_CONFIG['target_size'])
+        nativas = nativo_modelo(img_resized, size=tamanho).xyxy[0].cpu().numpy()
+        exportadas = exportado_modelo(img_resized).xyxy[0]
+        for caixa in nativas:
+            total += 1
+            melhor = max((iou(caixa, outra) for outra in exportadas if int(outra[5]) == int(caixa[5])), default=0.0)
+            casadas += melhor >= iou_min
+        total += max(0, len(exportadas) - len(nativas))  # caixas extras no ONNX contam como falha
+
+    taxa = casadas / total if total else 1.0
+    ok = taxa == 1.0
+    print(f"{'✅' if ok else '❌'} YOLO {caminho.name}: {casadas}/{total} caixas com IoU >= {iou_min}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--classificador", action="store_true", help="Exporta o classificador")
+    parser.add_argument("--yolo", action="store_true", help="Exporta o YOLO")
+    parser.add_argument("--torchscript", action="store_true", help="Exporta o YOLO para TorchScript (carregamento offline)")
+    parser.add_argument("--tamanho-yolo", type=int, default=640, help="Tamanho de entrada do YOLO (padrão do AutoShape)")
+    parser.add_argument("--verificar", action="store_true", help="Compara nativo x ONNX")
+    parser.add_argument("--sem-exportar", action="store_true", help="Apenas verifica arquivos já exportados")
+    parser.add_argument("--imagens", help="Pasta com imagens de pé para a verificação")
+    parser.add_argument("--quantidade", type=int, default=8)
+    parser.add_argument("--tolerancia", type=float, default=1e-3)
+    parser.add_argument("--iou-min", type=float, default=0.9)
+    args = parser.parse_args()
+
+    if not (args.classificador or args.yolo or args.torchscript):
+        parser.error("informe --classificador, --yolo e/ou --torchscript")
+
+    # A referência é sempre o modelo nativo, mesmo com INFERENCE_BACKEND=onnx no ambiente
+    api_ia.INFERENCE_BACKEND = "native"
+
+    alvos = []
+    if args.classificador:
+        caminho = CLASSIFICADOR_ONNX if args.sem_exportar else exportar_classificador()
+        alvos.append(("classificador", caminho))
+    if args.yolo:
+        caminho = YOLO_ONNX if args.sem_exportar else exportar_yolo(tamanho=args.tamanho_yolo)
+        alvos.append(("yolo", caminho))
+    if args.torchscript:
+        caminho = YOLO_TORCHSCRIPT if args.sem_exportar else exportar_yolo_torchscript(tamanho=args.tamanho_yolo)
+        alvos.append(("yolo", caminho))
+
+    if not args.verificar:
+        return
+
+    imagens = carregar_imagens(args.imagens, args.quantidade)
+    if args.classificador:
+        asyncio.run(api_ia.carregar_modelo_classificacao())
+
+    ok = True
+    for tipo, caminho in alvos:
+        if tipo == "classificador":
+            paridade = verificar_classificador(caminho, imagens, args.tolerancia)
+        else:
+            paridade = verificar_yolo(caminho, imagens, args.iou_min, args.tamanho_yolo)
+        ok &= paridade
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
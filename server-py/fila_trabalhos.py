@@ -0,0 +1,234 @@
+"""
+Fila de trabalhos assíncronos (POST /jobs) persistida em SQLite.
+
+Cada trabalho guarda o upload, os parâmetros, o estado
+(pendente -> executando -> concluido | erro), a etapa atual e o resultado.
+Os workers reservam trabalhos com um arrendamento (`expira_em`) renovado a
+cada etapa; se o processo morrer no meio, o arrendamento expira e outro
+worker (ou o mesmo processo, depois do restart) retoma o trabalho. Depois
+de `max_tentativas` reservas o trabalho vai para `erro`, para que uma foto
+que derruba o processo não fique em loop.
+
+O banco fica em modo WAL e as reservas usam transação IMMEDIATE, então
+vários processos (servidor_prefork.py) podem dividir a mesma fila.
+"""
+import base64
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+ESTADOS = ("pendente", "executando", "concluido", "erro")
+FINAIS = ("concluido", "erro")
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabalhos (
+    id TEXT PRIMARY KEY,
+    estado TEXT NOT NULL,
+    etapa TEXT,
+    parametros TEXT NOT NULL,
+    entrada BLOB,
+    resultado TEXT,
+    erro TEXT,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    criado_em REAL NOT NULL,
+    iniciado_em REAL,
+    concluido_em REAL,
+    expira_em REAL
+);
+CREATE INDEX IF NOT EXISTS trabalhos_estado ON trabalhos (estado, criado_em);
+"""
+
+
+def _para_json(valor):
+    """Serializa o resultado preservando bytes (JPEG) para a negociação de formato na leitura"""
+    def codificar(v):
+        if isinstance(v, (bytes, bytearray)):
+            return {"__bytes__": base64.b64encode(bytes(v)).decode()}
+        if isinstance(v, dict):
+            return {k: codificar(x) for k, x in v.items()}
+        if isinstance(v, (list, tuple)):
+            return [codificar(x) for x in v]
+        return v
+    return json.dumps(codificar(valor), separators=(",", ":"))
+
+
+def _de_json(texto):
+    def decodificar(v):
+        if isinstance(v, dict):
+            if set(v) == {"__bytes__"}:
+                return base64.b64decode(v["__bytes__"])
+            return {k: decodificar(x) for k, x in v.items()}
+        if isinstance(v, list):
+            return [decodificar(x) for x in v]
+        return v
+    return decodificar(json.loads(texto))
+
+
+class FilaTrabalhos:
+    """Fila durável de trabalhos; operações curtas e síncronas (como a camada em disco do cache)"""
+
+    def __init__(self, caminho, arrendamento_s=120, max_tentativas=3, ttl_s=86400):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self.arrendamento_s = float(arrendamento_s)
+        self.max_tentativas = max(1, int(max_tentativas))
+        self.ttl_s = float(ttl_s)
+
+        self._conexao = sqlite3.connect(str(self.caminho), timeout=30, isolation_level=None, check_same_thread=False)
+        self._conexao.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("PRAGMA synchronous=NORMAL")
+            self._conexao.executescript(_ESQUEMA)
+
+    def _executar(self, sql, parametros=()):
+        with self._lock:
+            return self._conexao.execute(sql, parametros)
+
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            return self._conexao.execute(sql, parametros).fetchall()
+
+    def criar(self, entrada, parametros):
+        """Enfileira um trabalho; retorna o id"""
+        trabalho_id = uuid.uuid4().hex
+        self._executar(
+            "INSERT INTO trabalhos (id, estado, parametros, entrada, criado_em) VALUES (?, 'pendente', ?, ?, ?)",
+            (trabalho_id, json.dumps(parametros), sqlite3.Binary(entrada), time.time())
+        )
+        return trabalho_id
+
+    def reservar(self):
+        """Próximo trabalho pendente (ou com arrendamento vencido): (id, entrada, parametros) ou None"""
+        agora = time.time()
+        with self._lock:
+            cursor = self._conexao.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # Trabalhos que já esgotaram as tentativas (ex.: derrubaram o processo) viram erro
+                cursor.execute(
+                    "UPDATE trabalhos SET estado = 'erro', erro = ?, entrada = NULL, concluido_em = ? "
+                    "WHERE estado = 'executando' AND expira_em < ? AND tentativas >= ?",
+                    (f"Interrompido {self.max_tentativas} vezes", agora, agora, self.max_tentativas)
+                )
+                linha = cursor.execute(
+                    "SELECT id, entrada, parametros FROM trabalhos "
+                    "WHERE estado = 'pendente' OR (estado = 'executando' AND expira_em < ?) "
+                    "ORDER BY criado_em LIMIT 1",
+                    (agora,)
+                ).fetchone()
+                if linha is not None:
+                    cursor.execute(
+                        "UPDATE trabalhos SET estado = 'executando', etapa = NULL, tentativas = tentativas + 1, "
+                        "iniciado_em = ?, expira_em = ? WHERE id = ?",
+                        (agora, agora + self.arrendamento_s, linha["id"])
+                    )
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+        if linha is None:
+            return None
+        return linha["id"], bytes(linha["entrada"]), json.loads(linha["parametros"])
+
+    def progresso(self, trabalho_id, etapa):
+        """Registra a etapa atual e renova o arrendamento"""
+        self._executar(
+            "UPDATE trabalhos SET etapa = ?, expira_em = ? WHERE id = ? AND estado = 'executando'",
+            (etapa, time.time() + self.arrendamento_s, trabalho_id)
+        )
+
+    def concluir(self, trabalho_id, resultado):
+        self._executar(
+            "UPDATE trabalhos SET estado = 'concluido', etapa = NULL, resultado = ?, entrada = NULL, "
+            "concluido_em = ? WHERE id = ?",
+            (_para_json(resultado), time.time(), trabalho_id)
+        )
+
+    def liberar(self, trabalho_id):
+        """Devolve à fila um trabalho interrompido pelo encerramento (a tentativa não conta)"""
+        self._executar(
+            "UPDATE trabalhos SET estado = 'pendente', etapa = NULL, expira_em = NULL, "
+            "tentativas = MAX(tentativas - 1, 0) WHERE id = ? AND estado = 'executando'",
+            (trabalho_id,)
+        )
+
+    def falhar(self, trabalho_id, erro):
+        self._executar(
+            "UPDATE trabalhos SET estado = 'erro', etapa = NULL, erro = ?, entrada = NULL, concluido_em = ? "
+            "WHERE id = ?",
+            (str(erro), time.time(), trabalho_id)
+        )
+
+    def obter(self, trabalho_id):
+        """Estado do trabalho (com o resultado, se concluído) ou None"""
+        linhas = self._consultar(
+            "SELECT id, estado, etapa, parametros, resultado, erro, tentativas, criado_em, iniciado_em, "
+            "concluido_em FROM trabalhos WHERE id = ?",
+            (trabalho_id,)
+        )
+        if not linhas:
+            return None
+        linha = linhas[0]
+        trabalho = {
+            "job_id": linha["id"],
+            "estado": linha["estado"],
+            "etapa": linha["etapa"],
+            "parametros": json.loads(linha["parametros"]),
+            "tentativas": linha["tentativas"],
+            "criado_em": linha["criado_em"],
+            "iniciado_em": linha["iniciado_em"],
+            "concluido_em": linha["concluido_em"],
+        }
+        if linha["estado"] == "pendente":
+            trabalho["posicao"] = self._consultar(
+                "SELECT COUNT(*) FROM trabalhos WHERE estado = 'pendente' AND criado_em < ?",
+                (linha["criado_em"],)
+            )[0][0]
+        if linha["resultado"] is not None:
+            trabalho["resultado"] = _de_json(linha["resultado"])
+        if linha["erro"] is not None:
+            trabalho["erro"] = linha["erro"]
+        return trabalho
+
+    def estado(self, trabalho_id):
+        """Só estado/etapa/posição/erro (sem decodificar o resultado), para acompanhar o progresso; ou None"""
+        linhas = self._consultar(
+            "SELECT id, estado, etapa, erro, "
+            "CASE WHEN estado = 'pendente' THEN "
+            "(SELECT COUNT(*) FROM trabalhos AS t WHERE t.estado = 'pendente' AND t.criado_em < trabalhos.criado_em) "
+            "END AS posicao FROM trabalhos WHERE id = ?",
+            (trabalho_id,)
+        )
+        if not linhas:
+            return None
+        linha = linhas[0]
+        estado = {"job_id": linha["id"], "estado": linha["estado"], "etapa": linha["etapa"]}
+        if linha["posicao"] is not None:
+            estado["posicao"] = linha["posicao"]
+        if linha["erro"] is not None:
+            estado["erro"] = linha["erro"]
+        return estado
+
+    def contagem(self):
+        """Trabalhos por estado"""
+        contagem = dict.fromkeys(ESTADOS, 0)
+        for estado, n in self._consultar("SELECT estado, COUNT(*) FROM trabalhos GROUP BY estado"):
+            contagem[estado] = n
+        return contagem
+
+    def limpar(self):
+        """Remove trabalhos concluídos/com erro há mais de `ttl_s`; retorna quantos"""
+        cursor = self._executar(
+            "DELETE FROM trabalhos WHERE estado IN ('concluido', 'erro') AND concluido_em < ?",
+            (time.time() - self.ttl_s,)
+        )
+        return cursor.rowcount
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
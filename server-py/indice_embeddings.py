@@ -0,0 +1,258 @@
+"""
+Índice de embeddings por paciente (acompanhamento longitudinal das lesões).
+
+Cada recorte classificado com `paciente_id` tem o embedding da penúltima
+camada do classificador (mesmo forward pass da classificação) guardado no
+índice do paciente; um recorte novo é comparado com o histórico para
+achar a mesma úlcera em análises anteriores.
+
+Os embeddings (2048 na ResNet50) são reduzidos por uma projeção aleatória
+ortonormal fixa (`dimensao`, padrão 256) antes de entrar no índice: o
+cosseno é preservado com erro pequeno (Johnson-Lindenstrauss) e a busca
+lê 8x menos memória. A semente é fixa, então todos os workers e
+reinícios projetam igual.
+
+Por paciente, em `<diretorio>/<paciente_id>/`:
+    vetores.<d>.f32   linhas float32 (d) normalizadas (L2), só acrescentadas
+    meta.<d>.jsonl    uma linha JSON por vetor (análise, caixa, classe, blob...)
+
+Mudar a dimensão começa arquivos novos em vez de ler os antigos errado.
+Os arquivos só crescem (append) e a escrita é serializada com `flock`,
+então vários workers podem dividir a pasta; cada processo mantém os
+vetores em memória e lê só o que foi acrescentado desde a última consulta
+(as chamadas podem vir de threads: o estado em memória fica sob um lock).
+O k-NN é força bruta (produto interno = cosseno): o histórico de um
+paciente tem centenas/milhares de vetores e a busca fica abaixo de 1 ms
+(ver benchmarks/bench_embeddings.py).
+"""
+import fcntl
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+_ID_VALIDO = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+SEMENTE_PROJECAO = 0
+
+
+def id_paciente_valido(paciente_id):
+    return bool(_ID_VALIDO.match(paciente_id or ""))
+
+
+def normalizar(vetores):
+    """Linhas com norma L2 = 1 (float32)"""
+    vetores = np.asarray(vetores, dtype=np.float32).reshape(len(vetores), -1)
+    normas = np.linalg.norm(vetores, axis=1, keepdims=True)
+    return vetores / np.maximum(normas, 1e-12)
+
+
+class _IndicePaciente:
+    """Vetores (buffer que cresce por dobra) e metadados de um paciente em memória"""
+    __slots__ = ("buffer", "n", "meta", "bytes_lidos", "arquivo")
+
+    def __init__(self, dimensao):
+        self.buffer = np.empty((64, dimensao), dtype=np.float32)
+        self.n = 0
+        self.meta = []
+        self.bytes_lidos = 0
+        self.arquivo = None  # (st_dev, st_ino) do meta.jsonl lido
+
+    @property
+    def vetores(self):
+        return self.buffer[:self.n]
+
+    def acrescentar(self, novos):
+        if self.n + len(novos) > len(self.buffer):
+            buffer = np.empty((max(2 * len(self.buffer), self.n + len(novos)), self.buffer.shape[1]), dtype=np.float32)
+            buffer[:self.n] = self.vetores
+            self.buffer = buffer
+        self.buffer[self.n:self.n + len(novos)] = novos
+        self.n += len(novos)
+
+
+class IndiceEmbeddings:
+    """Índices por paciente em disco, com os mais usados em memória (LRU)"""
+
+    def __init__(self, diretorio, dimensao=256, max_pacientes=256, duplicado=0.9999):
+        self.diretorio = Path(diretorio)
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.dimensao = int(dimensao)  # 0 = sem redução
+        self.max_pacientes = max(1, int(max_pacientes))
+        # Similaridade a partir da qual o vetor já está no índice (mesmo recorte reenviado)
+        self.duplicado = float(duplicado)
+        self._indices = OrderedDict()  # (paciente_id, d) -> _IndicePaciente
+        self._projecoes = {}  # dimensão de entrada -> matriz (entrada, dimensao)
+        self._lock = threading.Lock()
+
+        self._buscas = 0
+        self._adicionados = 0
+        self._duplicados = 0
+
+    def _pasta(self, paciente_id):
+        if not id_paciente_valido(paciente_id):
+            raise ValueError(f"paciente_id inválido: {paciente_id!r}")
+        return self.diretorio / paciente_id
+
+    def reduzir(self, vetores):
+        """Projeta e normaliza os embeddings para o espaço do índice"""
+        vetores = np.asarray(vetores, dtype=np.float32).reshape(len(vetores), -1)
+        entrada = vetores.shape[1]
+        if not self.dimensao or self.dimensao >= entrada:
+            return normalizar(vetores)
+        projecao = self._projecoes.get(entrada)
+        if projecao is None:
+            gaussiana = np.random.default_rng(SEMENTE_PROJECAO).standard_normal((entrada, self.dimensao))
+            projecao = np.linalg.qr(gaussiana)[0].astype(np.float32)
+            self._projecoes[entrada] = projecao
+        return normalizar(vetores @ projecao)
+
+    def _carregar(self, paciente_id, dimensao):
+        """Índice do paciente em memória, atualizado com o que outros processos acrescentaram"""
+        pasta = self._pasta(paciente_id)
+        chave = (paciente_id, dimensao)
+        arquivo_meta = pasta / f"meta.{dimensao}.jsonl"
+        try:
+            estado = os.stat(arquivo_meta)
+        except FileNotFoundError:
+            estado = None
+
+        indice = self._indices.get(chave)
+        # Apagado, truncado ou recriado por outro processo: a cópia em memória não vale mais
+        if indice is None or (indice.arquivo and (
+            estado is None
+            or (estado.st_dev, estado.st_ino) != indice.arquivo
+            or estado.st_size < indice.bytes_lidos
+        )):
+            indice = self._indices[chave] = _IndicePaciente(dimensao)
+        self._indices.move_to_end(chave)
+        while len(self._indices) > self.max_pacientes:
+            self._indices.popitem(last=False)
+
+        if estado is None:
+            return indice
+        indice.arquivo = (estado.st_dev, estado.st_ino)
+
+        with open(arquivo_meta, "rb") as arquivo:
+            arquivo.seek(indice.bytes_lidos)
+            novas = arquivo.read()
+        # Só linhas completas (um append pode estar em andamento)
+        completas = novas[:novas.rfind(b"\n") + 1]
+        if not completas:
+            return indice
+
+        linhas = [json.loads(linha) for linha in completas.splitlines()]
+        tamanho_linha = dimensao * 4
+        with open(pasta / f"vetores.{dimensao}.f32", "rb") as arquivo:
+            arquivo.seek(indice.n * tamanho_linha)
+            dados = arquivo.read(len(linhas) * tamanho_linha)
+        indice.acrescentar(np.frombuffer(dados, dtype=np.float32).reshape(-1, dimensao))
+        indice.meta.extend(linhas)
+        indice.bytes_lidos += len(completas)
+        return indice
+
+    def buscar(self, paciente_id, vetores, k=3):
+        """k vizinhos mais próximos de cada embedding: lista (por vetor) de [{similaridade, **meta}]"""
+        with self._lock:
+            consultas = self.reduzir(vetores)
+            indice = self._carregar(paciente_id, consultas.shape[1])
+            self._buscas += len(consultas)
+            if not indice.n or not len(consultas):
+                return [[] for _ in consultas]
+            similaridades = consultas @ indice.vetores.T
+            meta = indice.meta  # só cresce (ou é trocada inteira): as posições lidas continuam válidas
+
+        k = min(k, similaridades.shape[1])
+        melhores = np.argpartition(-similaridades, k - 1, axis=1)[:, :k]
+        vizinhos = []
+        for linha, candidatos in zip(similaridades, melhores):
+            ordem = candidatos[np.argsort(-linha[candidatos])]
+            vizinhos.append([
+                {"similaridade": round(float(linha[i]), 4), **meta[i]} for i in ordem
+            ])
+        return vizinhos
+
+    def adicionar(self, paciente_id, vetores, metadados):
+        """Acrescenta os embeddings (com um dict de metadados cada); ignora os já presentes. Retorna quantos entraram"""
+        with self._lock:
+            vetores = self.reduzir(vetores)
+        if not len(vetores):
+            return 0
+        dimensao = vetores.shape[1]
+        pasta = self._pasta(paciente_id)
+        pasta.mkdir(exist_ok=True)
+
+        novos, linhas = [], []
+        with self._lock, open(pasta / ".lock", "w") as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            indice = self._carregar(paciente_id, dimensao)
+            agora = time.time()
+            for vetor, meta in zip(vetores, metadados):
+                if indice.n and float((indice.vetores @ vetor).max()) >= self.duplicado:
+                    self._duplicados += 1
+                    continue
+                if novos and float((np.stack(novos) @ vetor).max()) >= self.duplicado:
+                    self._duplicados += 1
+                    continue
+                novos.append(vetor)
+                linhas.append(json.dumps({**meta, "criado_em": agora}, separators=(",", ":")) + "\n")
+
+            if novos:
+                # Vetores antes dos metadados: quem lê só considera linhas com meta completa.
+                # Sobras de uma escrita interrompida (processo morreu no meio) são descartadas
+                arquivo_vetores = pasta / f"vetores.{dimensao}.f32"
+                arquivo_meta = pasta / f"meta.{dimensao}.jsonl"
+                if arquivo_vetores.exists() and arquivo_vetores.stat().st_size != indice.n * dimensao * 4:
+                    os.truncate(arquivo_vetores, indice.n * dimensao * 4)
+                if arquivo_meta.exists() and arquivo_meta.stat().st_size != indice.bytes_lidos:
+                    os.truncate(arquivo_meta, indice.bytes_lidos)
+                with open(arquivo_vetores, "ab") as arquivo:
+                    arquivo.write(np.stack(novos).tobytes())
+                with open(arquivo_meta, "ab") as arquivo:
+                    arquivo.write("".join(linhas).encode())
+                self._carregar(paciente_id, dimensao)
+        self._adicionados += len(novos)
+        return len(novos)
+
+    def resumo(self, paciente_id):
+        """Vetores e bytes por dimensão do índice do paciente (None se não existe)"""
+        pasta = self._pasta(paciente_id)
+        dimensoes = {}
+        for arquivo_meta in sorted(pasta.glob("meta.*.jsonl")):
+            dimensao = int(arquivo_meta.name.split(".")[1])
+            with open(arquivo_meta, "rb") as arquivo:
+                total = sum(1 for _ in arquivo)
+            dimensoes[dimensao] = {"vetores": total, "bytes": total * dimensao * 4}
+        if not dimensoes:
+            return None
+        return {
+            "paciente_id": paciente_id,
+            "vetores": sum(d["vetores"] for d in dimensoes.values()),
+            "por_dimensao": dimensoes,
+        }
+
+    def remover(self, paciente_id):
+        """Apaga o índice do paciente; retorna se existia"""
+        pasta = self._pasta(paciente_id)
+        with self._lock:
+            for chave in [c for c in self._indices if c[0] == paciente_id]:
+                del self._indices[chave]
+        if not pasta.exists():
+            return False
+        shutil.rmtree(pasta)
+        return True
+
+    def estatisticas(self):
+        return {
+            "diretorio": str(self.diretorio),
+            "dimensao": self.dimensao,
+            "pacientes_em_memoria": len(self._indices),
+            "buscas": self._buscas,
+            "adicionados": self._adicionados,
+            "duplicados": self._duplicados,
+        }
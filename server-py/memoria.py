@@ -0,0 +1,388 @@
+"""
+Governador de memória: orçamento de RAM para as requisições em andamento.
+
+Em instâncias pequenas o processo (TensorFlow + PyTorch + as imagens de
+cada requisição) é morto por falta de memória quando chegam vários
+uploads ao mesmo tempo. Cada requisição estima o próprio pico
+(`estimar_bytes`: dimensões da foto lidas do cabeçalho, caixas, vistas de
+TTA, janelas do mosaico) e reserva essa memória antes de decodificar
+(`GovernadorMemoria.reservar`). Sem espaço no orçamento a requisição
+espera na fila, por ordem de chegada, até `espera_max_s` (depois
+`FilaCheia` -> 503). Uma requisição maior que o orçamento inteiro roda
+sozinha, em vez de nunca ser admitida.
+
+O limite do processo vem da RAM disponível (a menor entre a RAM da
+máquina e o limite do cgroup do container, `ram_disponivel`) dividida
+entre os workers, vezes uma fração; o orçamento das requisições é esse
+limite menos o RSS de base, medido com os modelos carregados (`calibrar`).
+
+Um vigia amostra o RSS a cada `intervalo_s`: a ocupação usada na
+admissão é o maior valor entre as reservas e o RSS acima da base (o que
+as estimativas não contam também segura a fila), e acima do limite os
+alocadores devolvem ao sistema a memória livre (`aparar_memoria`: gc,
+malloc_trim da glibc e cache da GPU do PyTorch).
+
+Cada reserva guarda o pico de RSS do processo enquanto esteve ativa. Com
+requisições simultâneas o pico é do processo, não só da requisição; a
+razão acréscimo/estimativa por rota (`estatisticas`) serve para calibrar
+os coeficientes (MEMORY_MB_*) e dimensionar a instância.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import gc
+import io
+import logging
+import sys
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from executor_inferencia import FilaCheia, cronometrar
+from metricas import processo
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+TAMANHO_CLASSIFICADOR = 224
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+    _malloc_trim = getattr(_libc, "malloc_trim", None)  # só na glibc
+except OSError:
+    _malloc_trim = None
+
+
+def rss():
+    """Memória residente do processo (bytes)"""
+    return processo().memory_info().rss
+
+
+def ram_disponivel(ram_total):
+    """Menor entre a RAM da máquina e o limite de memória do cgroup (container), em bytes"""
+    for caminho in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            valor = Path(caminho).read_text().strip()
+        except OSError:
+            continue
+        # cgroup v2 sem limite = "max"; v1 sem limite = um número enorme
+        if valor.isdigit() and 0 < int(valor) < ram_total:
+            return int(valor)
+    return int(ram_total)
+
+
+def aparar_memoria():
+    """Devolve ao sistema a memória livre dos alocadores"""
+    gc.collect()
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def dimensoes_imagem(contents):
+    """(largura, altura, formato) lidos só do cabeçalho; None se não for uma imagem"""
+    try:
+        with Image.open(io.BytesIO(contents)) as img:
+            return img.width, img.height, img.format
+    except Exception:
+        return None
+
+
+def escala_draft(largura, altura, tamanho):
+    """Redução (1, 2, 4 ou 8) que o modo draft do libjpeg aplica ao decodificar para `tamanho`"""
+    fator = min(tamanho / largura, tamanho / altura)
+    reducao = 1
+    while reducao < 8 and fator * reducao * 2 <= 1:
+        reducao *= 2
+    return reducao
+
+
+def estimar_bytes(dimensoes=None, bytes_upload=0, tamanho=640, caixas=0, vistas=1,
+                  janelas=0, tamanho_janela=0, reduzir=True, deteccao=True,
+                  mb_deteccao=150.0, mb_caixa=12.0):
+    """Pico de memória estimado de uma requisição (bytes)
+
+    - `dimensoes`: (largura, altura, formato) da foto a decodificar (None se
+      a imagem já está decodificada, ex.: sessão do `imagem_id`)
+    - upload em memória, decode (com a redução do draft em JPEG) e a cópia
+      RGB, letterbox, JPEG/base64 da resposta
+    - janelas do mosaico: imagem de trabalho e lote float32 do YOLO
+    - recortes: lote float32 do classificador e JPEG/base64 de cada recorte
+    - `mb_deteccao` (por imagem no forward do YOLO) e `mb_caixa` (por vista
+      no forward do classificador): ativações e buffers dos frameworks
+    """
+    total = 2 * bytes_upload
+    if dimensoes is not None:
+        largura, altura, formato = dimensoes
+        reducao = 1
+        if reduzir and formato == "JPEG" and not janelas:
+            reducao = escala_draft(largura, altura, tamanho)
+        total += 2 * (largura // reducao) * (altura // reducao) * 3
+    if deteccao:
+        imagens = 1 + janelas
+        total += tamanho * tamanho * 3 * 2  # letterbox + JPEG/base64 da resposta
+        total += janelas * tamanho_janela * tamanho_janela * 3
+        total += imagens * max(tamanho, tamanho_janela) ** 2 * 3 * 4
+        total += imagens * mb_deteccao * MB
+    recortes = caixas * vistas
+    total += recortes * TAMANHO_CLASSIFICADOR * TAMANHO_CLASSIFICADOR * 3 * (4 + 1)
+    total += caixas * TAMANHO_CLASSIFICADOR * TAMANHO_CLASSIFICADOR * 3
+    total += recortes * mb_caixa * MB
+    return int(total)
+
+
+class ReservaMemoria:
+    """Memória reservada por uma requisição e o pico de RSS enquanto está ativa"""
+    __slots__ = ("custo", "rota", "rss_inicial", "pico", "espera_ms")
+
+    def __init__(self, custo, rota):
+        self.custo = int(custo)
+        self.rota = rota
+        self.rss_inicial = None
+        self.pico = None
+        self.espera_ms = 0.0
+
+    def observar(self, valor):
+        self.pico = valor if self.pico is None else max(self.pico, valor)
+
+    @property
+    def acrescimo(self):
+        """Pico de RSS acima do RSS na admissão (bytes)"""
+        return max(0, self.pico - self.rss_inicial) if self.pico is not None else 0
+
+    def resumo(self):
+        """Estimativa e pico até agora (MB), para a resposta"""
+        self.observar(rss())
+        return {
+            "estimada_mb": round(self.custo / MB, 1),
+            "pico_rss_mb": round(self.pico / MB, 1),
+            "acrescimo_mb": round(self.acrescimo / MB, 1),
+            "espera_ms": round(self.espera_ms, 3),
+        }
+
+
+class GovernadorMemoria:
+    """Admissão das requisições por um orçamento de RAM, com vigia de RSS
+
+    Usado só no event loop (sem locks), como o `ControladorQualidade`.
+    `limite` é a memória total do processo; o orçamento das requisições é
+    `limite` menos o RSS de base (ou `orcamento` fixo, se dado).
+    """
+
+    def __init__(self, limite, orcamento=None, espera_max_s=30.0, intervalo_s=0.2,
+                 intervalo_aparar_s=5.0, margem_aparar=64 * MB, janela=512, observar=None):
+        self.limite = int(limite)
+        self.orcamento_fixo = int(orcamento) if orcamento else None
+        self.espera_max_s = float(espera_max_s)
+        self.intervalo_s = float(intervalo_s)
+        self.intervalo_aparar_s = float(intervalo_aparar_s)
+        # Só apara de novo se o RSS cresceu essa margem desde a última vez (o gc segura o GIL)
+        self.margem_aparar = int(margem_aparar)
+        # Callback (rota, bytes) com o acréscimo de cada requisição (histograma do /metrics)
+        self._observar = observar
+
+        self.rss_base = rss()
+        self.rss_atual = self.rss_base
+        self.reservado = 0
+        self._ativas = set()
+        self._fila = deque()  # (reserva, future), por ordem de chegada
+        self._tarefa = None
+        self._ultima_aparada = 0.0
+        self._rss_aparado = 0  # RSS logo depois da última aparada
+
+        self._admitidas = 0
+        self._esperaram = 0
+        self._rejeitadas = 0
+        self._aparadas = 0
+        self._liberado_aparando = 0
+        self._por_rota = {}  # rota -> deque de (estimativa, acréscimo)
+        self._janela = janela
+
+    @property
+    def orcamento(self):
+        """Memória (bytes) para as requisições em andamento"""
+        if self.orcamento_fixo:
+            return self.orcamento_fixo
+        return max(0, self.limite - self.rss_base)
+
+    def calibrar(self, aparar=True):
+        """Mede o RSS de base (modelos carregados), descontando as reservas em andamento
+
+        Chamado no fim do carregamento e a cada versão de modelo carregada ou descarregada.
+        """
+        if aparar:
+            aparar_memoria()
+        self.rss_atual = rss()
+        self.rss_base = max(0, self.rss_atual - self.reservado)
+        if not self.orcamento_fixo and self.orcamento < 512 * MB:
+            logger.warning(f"⚠️ Orçamento de memória baixo: {self.orcamento / MB:.0f} MB "
+                           f"(limite {self.limite / MB:.0f} MB, base {self.rss_base / MB:.0f} MB)")
+        logger.info(f"🧠 Memória: limite {self.limite / MB:.0f} MB, base {self.rss_base / MB:.0f} MB, "
+                    f"orçamento {self.orcamento / MB:.0f} MB para as requisições")
+
+    def ocupado(self):
+        """Memória das requisições: reservas ou, se maior, o RSS acima da base"""
+        return max(self.reservado, self.rss_atual - self.rss_base)
+
+    def _cabe(self, reserva):
+        return not self._ativas or self.ocupado() + reserva.custo <= self.orcamento
+
+    def _admitir(self, reserva):
+        self.reservado += reserva.custo
+        self._ativas.add(reserva)
+        self._admitidas += 1
+        reserva.rss_inicial = self.rss_atual = rss()
+        reserva.observar(self.rss_atual)
+
+    def _despachar(self):
+        """Admite as da fila, por ordem, enquanto couberem"""
+        while self._fila:
+            reserva, futuro = self._fila[0]
+            if futuro.done():
+                self._fila.popleft()
+                continue
+            if not self._cabe(reserva):
+                return
+            self._fila.popleft()
+            self._admitir(reserva)
+            futuro.set_result(None)
+
+    def _liberar(self, reserva, registrar=True):
+        self._ativas.discard(reserva)
+        self.reservado -= reserva.custo
+        if not registrar:
+            self._despachar()
+            return
+        reserva.observar(rss())
+        amostras = self._por_rota.setdefault(reserva.rota, deque(maxlen=self._janela))
+        amostras.append((reserva.custo, reserva.acrescimo))
+        if self._observar is not None:
+            self._observar(reserva.rota, reserva.acrescimo)
+        self._despachar()
+
+    @asynccontextmanager
+    async def reservar(self, custo, rota="", tempos=None, esperar_sempre=False):
+        """Reserva `custo` bytes enquanto o bloco roda; espera na fila ou levanta FilaCheia
+
+        Com `esperar_sempre` (trabalhos assíncronos) espera sem limite de tempo.
+        A espera entra em `tempos["fila_memoria"]`.
+        """
+        reserva = ReservaMemoria(custo, rota)
+        self._despachar()
+        if not self._fila and self._cabe(reserva):
+            self._admitir(reserva)
+        else:
+            await self._esperar(reserva, tempos, esperar_sempre)
+        try:
+            yield reserva
+        finally:
+            self._liberar(reserva)
+
+    async def _esperar(self, reserva, tempos, esperar_sempre):
+        futuro = asyncio.get_running_loop().create_future()
+        self._fila.append((reserva, futuro))
+        self._despachar()
+        if not futuro.done():
+            self._esperaram += 1
+        inicio = time.perf_counter()
+        try:
+            with cronometrar(tempos, "fila_memoria"):
+                await asyncio.wait_for(futuro, None if esperar_sempre else self.espera_max_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if futuro.done() and not futuro.cancelled():
+                # Admitida no mesmo instante do timeout/cancelamento: devolve a reserva
+                self._liberar(reserva, registrar=False)
+            else:
+                futuro.cancel()
+                self._despachar()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._rejeitadas += 1
+            raise FilaCheia(
+                f"Memória ocupada: {self.ocupado() / MB:.0f} de {self.orcamento / MB:.0f} MB "
+                f"({len(self._fila)} requisições aguardando)"
+            )
+        finally:
+            reserva.espera_ms = (time.perf_counter() - inicio) * 1000
+
+    # ========================================
+    # VIGIA DE RSS
+    # ========================================
+    def iniciar(self):
+        if self._tarefa is None:
+            self._tarefa = asyncio.create_task(self._vigiar())
+
+    async def parar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+
+    async def _vigiar(self):
+        while True:
+            await asyncio.sleep(self.intervalo_s)
+            try:
+                await self.amostrar()
+            except Exception as e:
+                logger.error(f"Erro no vigia de memória: {e}")
+
+    async def amostrar(self):
+        """Lê o RSS, atualiza os picos e, acima do limite, apara os alocadores"""
+        self.rss_atual = rss()
+        for reserva in self._ativas:
+            reserva.observar(self.rss_atual)
+
+        agora = time.monotonic()
+        acima = self.rss_atual > self.rss_base + self.orcamento
+        cresceu = self.rss_atual > self._rss_aparado + self.margem_aparar
+        if acima and cresceu and agora - self._ultima_aparada >= self.intervalo_aparar_s:
+            self._ultima_aparada = agora
+            antes = self.rss_atual
+            await asyncio.to_thread(aparar_memoria)
+            self.rss_atual = self._rss_aparado = rss()
+            self._aparadas += 1
+            self._liberado_aparando += max(0, antes - self.rss_atual)
+            logger.warning(f"🧹 RSS {antes / MB:.0f} MB acima do limite: alocadores aparados "
+                           f"(-{max(0, antes - self.rss_atual) / MB:.0f} MB)")
+        self._despachar()
+
+    def estatisticas(self):
+        por_rota = {}
+        for rota, amostras in self._por_rota.items():
+            custos, acrescimos = np.asarray(amostras, dtype=np.float64).T
+            razoes = acrescimos / np.maximum(custos, 1)
+            por_rota[rota or "-"] = {
+                "amostras": len(amostras),
+                "estimada_mb_media": round(float(custos.mean()) / MB, 1),
+                "acrescimo_mb_p50": round(float(np.percentile(acrescimos, 50)) / MB, 1),
+                "acrescimo_mb_p95": round(float(np.percentile(acrescimos, 95)) / MB, 1),
+                "acrescimo_mb_max": round(float(acrescimos.max()) / MB, 1),
+                # > 1: a estimativa está baixa (aumentar MEMORY_MB_*)
+                "razao_acrescimo_estimativa_p95": round(float(np.percentile(razoes, 95)), 3),
+            }
+        return {
+            "limite_mb": round(self.limite / MB, 1),
+            "rss_base_mb": round(self.rss_base / MB, 1),
+            "rss_mb": round(self.rss_atual / MB, 1),
+            "orcamento_mb": round(self.orcamento / MB, 1),
+            "reservado_mb": round(self.reservado / MB, 1),
+            "ocupado_mb": round(self.ocupado() / MB, 1),
+            "em_andamento": len(self._ativas),
+            "aguardando": sum(1 for _, futuro in self._fila if not futuro.done()),
+            "admitidas": self._admitidas,
+            "esperaram": self._esperaram,
+            "rejeitadas": self._rejeitadas,
+            "aparadas": self._aparadas,
+            "liberado_aparando_mb": round(self._liberado_aparando / MB, 1),
+            "malloc_trim": _malloc_trim is not None,
+            "por_rota": por_rota,
+        }
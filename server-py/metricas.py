@@ -0,0 +1,173 @@
+"""
+Métricas Prometheus da API (exportadas em /metrics).
+
+- `api_etapa_duracao_segundos{etapa}`: histograma por etapa do pipeline,
+  alimentado pelos mesmos `tempos_etapas` do Server-Timing (hash,
+  decodificacao, redimensionamento, yolo, pos_processamento,
+  preprocessamento = recorte das caixas, classificacao, codificacao =
+  JPEG da imagem e dos recortes, armazenamento = gravação dos blobs,
+  serializacao)
+- `api_modelo_duracao_segundos{modelo,versao}`: chamada a cada versão de
+  modelo carregada (ativa, canário e sombra), incluindo a espera no lote
+- `api_requisicao_memoria_bytes{rota}`: pico de RSS acima do RSS na
+  admissão de cada requisição (governador de memória, memoria.py)
+- `api_requisicoes_total{rota,metodo,status}`, `api_requisicao_duracao_segundos{rota}`
+  e `api_requisicoes_em_andamento`: middleware ASGI `MetricasHTTP`
+- medidores lidos só no scrape (`ColetorEstado`): filas, carregamento
+  dos modelos e RSS/CPU do processo (psutil)
+
+No caminho quente cada etapa custa um `observe` (alguns µs); os estados
+(filas, memória) não têm custo fora do scrape.
+"""
+import os
+import time
+
+import psutil
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+REGISTRO = CollectorRegistry(auto_describe=True)
+
+# 0,5 ms a 10 s: decode/serialização ficam nos primeiros baldes, inferência em CPU nos últimos
+BALDES_ETAPA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 8 MB a 4 GB
+BALDES_MEMORIA = tuple(2 ** n * 1024 * 1024 for n in range(3, 13))
+BALDES_REQUISICAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+DURACAO_ETAPA = Histogram(
+    "api_etapa_duracao_segundos", "Duração de cada etapa do pipeline de inferência",
+    ["etapa"], buckets=BALDES_ETAPA, registry=REGISTRO
+)
+REQUISICOES = Counter(
+    "api_requisicoes_total", "Requisições HTTP por rota, método e status",
+    ["rota", "metodo", "status"], registry=REGISTRO
+)
+DURACAO_REQUISICAO = Histogram(
+    "api_requisicao_duracao_segundos", "Duração das requisições HTTP por rota",
+    ["rota"], buckets=BALDES_REQUISICAO, registry=REGISTRO
+)
+DURACAO_MODELO = Histogram(
+    "api_modelo_duracao_segundos", "Duração das chamadas a cada versão de modelo (com a espera no lote)",
+    ["modelo", "versao"], buckets=BALDES_ETAPA, registry=REGISTRO
+)
+MEMORIA_REQUISICAO = Histogram(
+    "api_requisicao_memoria_bytes", "Pico de RSS acima do RSS na admissão de cada requisição",
+    ["rota"], buckets=BALDES_MEMORIA, registry=REGISTRO
+)
+EM_ANDAMENTO = Gauge(
+    "api_requisicoes_em_andamento", "Requisições HTTP em andamento", registry=REGISTRO
+)
+
+_processo = None
+
+
+def processo():
+    """psutil.Process do processo atual (os workers do pré-fork herdam o objeto do pai)"""
+    global _processo
+    if _processo is None or _processo.pid != os.getpid():
+        _processo = psutil.Process()
+    return _processo
+
+
+def observar_etapas(tempos):
+    """Registra os tempos (ms) de uma requisição no histograma por etapa"""
+    for etapa, ms in tempos.items():
+        DURACAO_ETAPA.labels(etapa).observe(ms / 1000)
+
+
+def observar_modelo(modelo, versao, ms):
+    DURACAO_MODELO.labels(modelo, versao).observe(ms / 1000)
+
+
+def observar_memoria(rota, acrescimo):
+    MEMORIA_REQUISICAO.labels(rota).observe(acrescimo)
+
+
+def exportar():
+    """(corpo, content-type) no formato texto do Prometheus"""
+    return generate_latest(REGISTRO), CONTENT_TYPE_LATEST
+
+
+class ColetorEstado:
+    """Medidores calculados no scrape a partir de funções registradas
+
+    `medidores` é uma lista de (nome, descrição, rótulo, função); a função
+    retorna um número ou um dicionário {valor do rótulo: número}.
+    """
+
+    def __init__(self, medidores):
+        self.medidores = medidores
+
+    def collect(self):
+        for nome, descricao, rotulo, funcao in self.medidores:
+            try:
+                valor = funcao()
+            except Exception:
+                continue
+            if isinstance(valor, dict):
+                familia = GaugeMetricFamily(nome, descricao, labels=[rotulo])
+                for chave, numero in valor.items():
+                    if numero is not None:
+                        familia.add_metric([str(chave)], float(numero))
+            else:
+                familia = GaugeMetricFamily(nome, descricao, value=float(valor or 0))
+            yield familia
+
+
+def registrar_estado(medidores):
+    REGISTRO.register(ColetorEstado(medidores))
+
+
+def medidores_processo():
+    """RSS, CPU e threads do processo (psutil)"""
+    return [
+        ("api_processo_rss_bytes", "Memória residente do processo", None,
+         lambda: processo().memory_info().rss),
+        ("api_processo_cpu_percentual", "Uso de CPU do processo desde o último scrape", None,
+         lambda: processo().cpu_percent(interval=None)),
+        ("api_processo_threads", "Threads do processo", None,
+         lambda: processo().num_threads()),
+    ]
+
+
+class MetricasHTTP:
+    """Middleware ASGI: contagem por rota/status, duração e requisições em andamento
+
+    A rota é o template (ex.: /imagens/{imagem_id}), para não criar uma
+    série por id; caminhos sem rota ficam como `desconhecida`.
+    """
+
+    def __init__(self, app, ignorar=("/metrics",)):
+        self.app = app
+        self.ignorar = set(ignorar)
+        self._rotas = None
+
+    def _rota(self, scope):
+        if self._rotas is None:
+            self._rotas = {
+                getattr(r, "endpoint", None): r.path
+                for r in scope["app"].routes if hasattr(r, "path")
+            }
+        return self._rotas.get(scope.get("endpoint"), "desconhecida")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.ignorar:
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_com_status(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+            await send(mensagem)
+
+        EM_ANDAMENTO.inc()
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_com_status)
+        finally:
+            EM_ANDAMENTO.dec()
+            rota = self._rota(scope)
+            DURACAO_REQUISICAO.labels(rota).observe(time.perf_counter() - inicio)
+            REQUISICOES.labels(rota, scope["method"], str(status)).inc()
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _ItemLote:
+    """Trabalho individual aguardando um lote"""
+    __slots__ = ("dados", "n", "futuro", "chegada")
+
+    def __init__(self, dados, n, futuro):
+        self.dados = dados
+        self.n = n
+        self.futuro = futuro
+        self.chegada = time.perf_counter()
+
+
+class MicroBatcher:
+    """Agrupa requisições concorrentes em um único forward pass.
+
+    Cada chamada a `submeter` entra em uma fila; um laço em background junta
+    itens até `max_lote` elementos ou `max_espera_ms` desde o primeiro item,
+    chama `processar_lote(lista_de_dados)` uma única vez e devolve a cada
+    chamador o seu resultado (mesma ordem da lista).
+    """
+
+    def __init__(self, nome, processar_lote, max_lote=8, max_espera_ms=10.0,
+                 executor=None, tamanho_item=None, historico=1000):
+        self.nome = nome
+        self.processar_lote = processar_lote
+        self.max_lote = max(1, int(max_lote))
+        self.max_espera = max(0.0, float(max_espera_ms)) / 1000.0
+        self.executor = executor
+        self.tamanho_item = tamanho_item or (lambda dados: 1)
+
+        self._fila = None
+        self._tarefa = None
+        self._pendente = None
+
+        # Estatísticas
+        self._tamanhos_lote = Counter()
+        self._esperas_ms = deque(maxlen=historico)
+        self._execucoes_ms = deque(maxlen=historico)
+        self._total_lotes = 0
+        self._total_itens = 0
+        self._total_erros = 0
+
+    # ----------------------------------------
+    # Ciclo de vida
+    # ----------------------------------------
+    def iniciar(self):
+        """Inicia o laço de agrupamento no event loop atual"""
+        if self._tarefa is not None and not self._tarefa.done():
+            return
+        self._fila = asyncio.Queue()
+        self._tarefa = asyncio.get_running_loop().create_task(self._laco())
+        logger.info(f"📦 Batcher '{self.nome}' ativo (max_lote={self.max_lote}, "
+                    f"max_espera={self.max_espera * 1000:.1f}ms)")
+
+    async def parar(self):
+        """Cancela o laço e falha os itens ainda na fila"""
+        if self._tarefa is None:
+            return
+        self._tarefa.cancel()
+        try:
+            await self._tarefa
+        except asyncio.CancelledError:
+            pass
+        self._tarefa = None
+
+        pendentes = [self._pendente] if self._pendente else []
+        self._pendente = None
+        while self._fila is not None and not self._fila.empty():
+            pendentes.append(self._fila.get_nowait())
+        for item in pendentes:
+            if not item.futuro.done():
+                item.futuro.set_exception(RuntimeError(f"Batcher '{self.nome}' encerrado"))
+
+    @property
+    def ativo(self):
+        return self._tarefa is not None and not self._tarefa.done()
+
+    # ----------------------------------------
+    # API
+    # ----------------------------------------
+    async def submeter(self, dados):
+        """Enfileira um item e aguarda o resultado do lote"""
+        if not self.ativo:
+            self.iniciar()
+        futuro = asyncio.get_running_loop().create_future()
+        self._fila.put_nowait(_ItemLote(dados, self.tamanho_item(dados), futuro))
+        return await futuro
+
+    def profundidade_fila(self):
+        fila = self._fila.qsize() if self._fila is not None else 0
+        return fila + (1 if self._pendente else 0)
+
+    def estatisticas(self):
+        """Distribuição de tamanhos de lote e tempos de espera na fila"""
+        esperas = np.array(self._esperas_ms) if self._esperas_ms else None
+        execucoes = np.array(self._execucoes_ms) if self._execucoes_ms else None
+
+        def resumo(valores):
+            if valores is None:
+                return None
+            return {
+                "p50": round(float(np.percentile(valores, 50)), 3),
+                "p95": round(float(np.percentile(valores, 95)), 3),
+                "p99": round(float(np.percentile(valores, 99)), 3),
+                "max": round(float(valores.max()), 3),
+                "media": round(float(valores.mean()), 3),
+            }
+
+        return {
+            "nome": self.nome,
+            "ativo": self.ativo,
+            "max_lote": self.max_lote,
+            "max_espera_ms": self.max_espera * 1000,
+            "fila": self.profundidade_fila(),
+            "total_lotes": self._total_lotes,
+            "total_itens": self._total_itens,
+            "total_erros": self._total_erros,
+            "itens_por_lote": round(self._total_itens / self._total_lotes, 3) if self._total_lotes else 0,
+            "tamanhos_lote": {str(k): v for k, v in sorted(self._tamanhos_lote.items())},
+            "espera_fila_ms": resumo(esperas),
+            "execucao_lote_ms": resumo(execucoes),
+        }
+
+    # ----------------------------------------
+    # Laço interno
+    # ----------------------------------------
+    async def _proximo(self, timeout=None):
+        if self._pendente is not None:
+            item, self._pendente = self._pendente, None
+            return item
+        if timeout is None:
+            return await self._fila.get()
+        if timeout <= 0:
+            return self._fila.get_nowait()
+        return await asyncio.wait_for(self._fila.get(), timeout)
+
+    async def _coletar(self):
+        primeiro = await self._proximo()
+        lote, total = [primeiro], primeiro.n
+        prazo = primeiro.chegada + self.max_espera
+
+        while total < self.max_lote:
+            try:
+                item = await self._proximo(prazo - time.perf_counter())
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            if total + item.n > self.max_lote:
+                # Não cabe neste lote: fica para o próximo
+                self._pendente = item
+                break
+            lote.append(item)
+            total += item.n
+
+        return lote, total
+
+    async def _laco(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            lote, _ = await self._coletar()
+            lote = [item for item in lote if not item.futuro.cancelled()]
+            if not lote:
+                continue
+            total = sum(item.n for item in lote)  # só o que vai mesmo para o forward pass
+
+            inicio = time.perf_counter()
+            for item in lote:
+                self._esperas_ms.append((inicio - item.chegada) * 1000)
+
+            try:
+                resultados = await loop.run_in_executor(
+                    self.executor, self.processar_lote, [item.dados for item in lote]
+                )
+                if len(resultados) != len(lote):
+                    raise RuntimeError(f"processar_lote retornou {len(resultados)} resultados para {len(lote)} itens")
+            except Exception as e:
+                self._total_erros += 1
+                logger.error(f"❌ Batcher '{self.nome}': erro no lote de {total}: {e}")
+                for item in lote:
+                    if not item.futuro.done():
+                        item.futuro.set_exception(e)
+                continue
+            finally:
+                self._execucoes_ms.append((time.perf_counter() - inicio) * 1000)
+
+            self._total_lotes += 1
+            self._total_itens += total
+            self._tamanhos_lote[total] += 1
+
+            for item, resultado in zip(lote, resultados):
+                if not item.futuro.done():
+                    item.futuro.set_result(resultado)
+
+
+def concatenar_e_dividir(funcao_lote):
+    """Adapta `funcao_lote(array_N)` para listas de arrays (n_i, ...).
+
+    Concatena os arrays no eixo 0, faz um único forward pass e divide a saída
+    de volta na mesma ordem.
+    """
+    def processar(arrays):
+        tamanhos = [len(a) for a in arrays]
+        saida = np.asarray(funcao_lote(np.concatenate(arrays, axis=0)))
+        return np.split(saida, np.cumsum(tamanhos)[:-1])
+    return processar
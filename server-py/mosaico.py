@@ -0,0 +1,193 @@
+"""
+Detecção em mosaico (tiles sobrepostos) para fotos de alta resolução.
+
+No modo normal a foto inteira vira 416 px e lesões pequenas somem. Aqui a
+foto é decodificada uma única vez em uma resolução de trabalho, cortada em
+janelas sobrepostas do tamanho de entrada do YOLO e todas as janelas, mais
+a visão global (o letterbox de sempre, que pega lesões maiores que uma
+janela), vão para o YOLO em um único forward pass.
+
+As caixas de cada janela voltam para as coordenadas da foto original e
+são unidas por NMS ou WBF (weighted boxes fusion); no fim são projetadas
+no letterbox, como as do modo normal, para que `dimensoes`, a sessão da
+imagem e a classificação continuem valendo.
+
+`max_tiles` limita o custo: se a grade na resolução original passar do
+limite, a resolução de trabalho é reduzida até caber.
+"""
+import math
+import time
+
+import numpy as np
+
+from preprocessamento import decodificar_escalado, redimensionar_array, redimensionar_em
+
+METODOS_FUSAO = ("wbf", "nms")
+
+# Caixas a menos disso de uma borda interna da janela estão cortadas pela janela
+MARGEM_BORDA = 2
+
+
+def planejar_mosaico(largura, altura, tamanho, sobreposicao, max_tiles):
+    """Escala de trabalho e janelas (x1, y1, x2, y2) que cobrem a imagem com até `max_tiles` janelas
+
+    Escolhe a grade (colunas x linhas) que permite a maior escala (<= 1,
+    nunca amplia); as janelas de cada eixo ficam igualmente espaçadas.
+    """
+    passo = tamanho * (1 - sobreposicao)
+    melhor = None
+    for colunas in range(1, max_tiles + 1):
+        linhas = max_tiles // colunas
+        escala = min(1.0, (tamanho + (colunas - 1) * passo) / largura, (tamanho + (linhas - 1) * passo) / altura)
+        if melhor is None or escala > melhor + 1e-9:
+            melhor = escala
+
+    # Arredondar para cima poderia pedir uma janela a mais
+    w_trabalho = max(1, min(largura, int(largura * melhor)))
+    h_trabalho = max(1, min(altura, int(altura * melhor)))
+    xs = _posicoes(w_trabalho, tamanho, passo)
+    ys = _posicoes(h_trabalho, tamanho, passo)
+    janelas = [
+        (x, y, min(x + tamanho, w_trabalho), min(y + tamanho, h_trabalho))
+        for y in ys for x in xs
+    ]
+    return {
+        "escala": w_trabalho / largura,
+        "tamanho_trabalho": (w_trabalho, h_trabalho),
+        "grade": (len(xs), len(ys)),
+        "janelas": janelas,
+    }
+
+
+def _posicoes(comprimento, tamanho, passo):
+    if comprimento <= tamanho:
+        return [0]
+    n = math.ceil((comprimento - tamanho) / passo - 1e-9) + 1
+    return [int(round(v)) for v in np.linspace(0, comprimento - tamanho, n)]
+
+
+def preparar_mosaico(contents, target_size, tamanho, sobreposicao, max_tiles, reduzir=True):
+    """Decodifica uma vez e gera o letterbox e as janelas do mosaico
+
+    Retorna (letterbox, resize_info, janelas (arrays RGB), plano, ms do redimensionamento).
+    Com `reduzir`, JPEGs são decodificados em modo draft já perto da escala de trabalho.
+    """
+    plano = {}
+
+    def escala(w, h):
+        plano.update(planejar_mosaico(w, h, tamanho, sobreposicao, max_tiles))
+        return plano["escala"] if reduzir else 1.0
+
+    arr, (w, h) = decodificar_escalado(contents, escala)
+
+    inicio = time.perf_counter()
+    w_trabalho, h_trabalho = plano["tamanho_trabalho"]
+    if arr.shape[:2] != (h_trabalho, w_trabalho):
+        arr = redimensionar_em(arr, np.empty((h_trabalho, w_trabalho, 3), dtype=np.uint8))
+    img, info = redimensionar_array(arr, target_size, (w, h))
+    ms = round((time.perf_counter() - inicio) * 1000, 3)
+
+    recortes = [arr[y1:y2, x1:x2] for x1, y1, x2, y2 in plano["janelas"]]
+    return img, info, recortes, plano, ms
+
+
+def como_array(xyxy):
+    """(n, 6) float32 a partir de tensor torch ou array"""
+    if hasattr(xyxy, "cpu"):
+        xyxy = xyxy.cpu().numpy()
+    return np.asarray(xyxy, dtype=np.float32).reshape(-1, 6)
+
+
+def unir_mosaico(global_xyxy, janelas_xyxy, plano, resize_info, metodo="wbf", iou=0.5):
+    """Une as detecções da visão global e das janelas; retorna (n, 6) no letterbox
+
+    Caixas encostadas em uma borda interna da janela (objeto cortado) são
+    descartadas: o objeto inteiro aparece na janela vizinha (sobreposição)
+    ou na visão global.
+    """
+    escala_lb = resize_info["scale_factor"]
+    pad_x, pad_y = resize_info["padding"]["x"], resize_info["padding"]["y"]
+    w, h = resize_info["original_size"]["width"], resize_info["original_size"]["height"]
+    w_trabalho, h_trabalho = plano["tamanho_trabalho"]
+
+    # Tudo em coordenadas da foto original
+    partes = []
+    det = como_array(global_xyxy).copy()
+    det[:, [0, 2]] = (det[:, [0, 2]] - pad_x) / escala_lb
+    det[:, [1, 3]] = (det[:, [1, 3]] - pad_y) / escala_lb
+    partes.append(det)
+
+    for (x1, y1, x2, y2), xyxy in zip(plano["janelas"], janelas_xyxy):
+        det = como_array(xyxy)
+        cortada = np.zeros(len(det), dtype=bool)
+        if x1 > 0:
+            cortada |= det[:, 0] <= MARGEM_BORDA
+        if y1 > 0:
+            cortada |= det[:, 1] <= MARGEM_BORDA
+        if x2 < w_trabalho:
+            cortada |= det[:, 2] >= (x2 - x1) - MARGEM_BORDA
+        if y2 < h_trabalho:
+            cortada |= det[:, 3] >= (y2 - y1) - MARGEM_BORDA
+        det = det[~cortada].copy()
+        det[:, [0, 2]] = (det[:, [0, 2]] + x1) * (w / w_trabalho)
+        det[:, [1, 3]] = (det[:, [1, 3]] + y1) * (h / h_trabalho)
+        partes.append(det)
+
+    todas = np.concatenate(partes)
+    unidas = fundir_caixas(todas, iou) if metodo == "wbf" else suprimir_caixas(todas, iou)
+
+    # De volta ao letterbox (mesmo sistema de coordenadas do modo normal)
+    unidas[:, [0, 2]] = unidas[:, [0, 2]].clip(0, w) * escala_lb + pad_x
+    unidas[:, [1, 3]] = unidas[:, [1, 3]].clip(0, h) * escala_lb + pad_y
+    return unidas
+
+
+def iou_caixas(caixa, caixas):
+    """IoU de uma caixa (4,) contra (n, 4)"""
+    ix1 = np.maximum(caixa[0], caixas[:, 0])
+    iy1 = np.maximum(caixa[1], caixas[:, 1])
+    ix2 = np.minimum(caixa[2], caixas[:, 2])
+    iy2 = np.minimum(caixa[3], caixas[:, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area = (caixa[2] - caixa[0]) * (caixa[3] - caixa[1])
+    areas = (caixas[:, 2] - caixas[:, 0]) * (caixas[:, 3] - caixas[:, 1])
+    return inter / (area + areas - inter + 1e-9)
+
+
+def suprimir_caixas(det, iou=0.5):
+    """NMS por classe: fica a caixa de maior confiança de cada grupo"""
+    det = det[det[:, 4].argsort()[::-1]]
+    manter = []
+    for i in range(len(det)):
+        mesmas = [j for j in manter if det[j, 5] == det[i, 5]]
+        if not mesmas or iou_caixas(det[i, :4], det[mesmas, :4]).max() <= iou:
+            manter.append(i)
+    return det[manter].copy()
+
+
+def fundir_caixas(det, iou=0.5):
+    """WBF por classe: caixas do mesmo objeto viram a média ponderada pela confiança
+
+    A confiança do grupo é a maior entre as caixas (uma lesão pequena só
+    aparece em uma janela e não deve ser penalizada por isso).
+    """
+    det = det[det[:, 4].argsort()[::-1]]
+    grupos = []  # (classe, caixa fundida, membros)
+    for linha in det:
+        candidatos = [g for g in grupos if g[0] == linha[5]]
+        if candidatos:
+            ious = iou_caixas(linha[:4], np.array([g[1] for g in candidatos]))
+            melhor = int(ious.argmax())
+            if ious[melhor] > iou:
+                grupo = candidatos[melhor]
+                grupo[2].append(linha)
+                membros = np.array(grupo[2])
+                grupo[1][:] = (membros[:, :4] * membros[:, 4:5]).sum(0) / membros[:, 4].sum()
+                continue
+        grupos.append((linha[5], linha[:4].copy(), [linha]))
+
+    if not grupos:
+        return np.zeros((0, 6), dtype=np.float32)
+    return np.array([
+        [*caixa, max(m[4] for m in membros), classe] for classe, caixa, membros in grupos
+    ], dtype=np.float32)
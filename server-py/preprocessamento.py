@@ -0,0 +1,152 @@
+"""
+Pré-processamento vetorizado (NumPy/OpenCV) das imagens e recortes.
+
+A imagem é decodificada uma única vez para um array uint8 (H, W, 3) RGB
+e colocada em um canvas pré-alocado (letterbox). Os recortes das caixas
+são redimensionados direto para um buffer (N, 224, 224, 3) reutilizado
+por thread e convertidos para float32 em uma única operação, sem objetos
+PIL intermediários.
+
+Equivale às funções PIL de `processamento_imagem` dentro de uma
+tolerância (o OpenCV não reproduz o filtro do PIL bit a bit); a
+comparação e o ganho estão em benchmarks/bench_preprocessamento.py.
+"""
+import io
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+TAMANHO_CLASSIFICADOR = 224
+
+# Médias BGR do modo 'caffe' (tensorflow.keras.applications.resnet50.preprocess_input)
+MEDIA_RESNET_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+_local = threading.local()
+
+
+def decodificar_rgb(contents):
+    """Decodifica bytes de upload para array uint8 (H, W, 3) RGB (ignora a orientação EXIF, como o PIL)"""
+    arr = cv2.imdecode(
+        np.frombuffer(contents, dtype=np.uint8),
+        cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+    )
+    if arr is None:
+        # Formatos que o OpenCV não lê (ex.: GIF)
+        from processamento_imagem import decodificar_imagem
+        return np.asarray(decodificar_imagem(contents))
+    return cv2.cvtColor(arr, cv2.COLOR_BGR2RGB, dst=arr)
+
+
+def decodificar_reduzido(contents, target_size):
+    """Decodifica já reduzido para o letterbox de `target_size`; retorna (array RGB, (largura, altura) originais)
+
+    JPEG usa o modo draft do libjpeg (escala 1/2, 1/4 ou 1/8 no próprio
+    decode), parando no menor tamanho que ainda cobre o redimensionamento
+    final: uma foto de 12 MP vira ~0,2-0,8 MP sem nunca existir em
+    resolução cheia. Outros formatos são decodificados normalmente.
+    """
+    return decodificar_escalado(contents, lambda w, h: min(target_size / w, target_size / h))
+
+
+def decodificar_escalado(contents, escala):
+    """Como `decodificar_reduzido`, com a escala mínima dada por `escala(largura, altura)`"""
+    img = Image.open(io.BytesIO(contents))
+    w, h = img.size
+    fator = escala(w, h)
+    if img.format != "JPEG":
+        return decodificar_rgb(contents), (w, h)
+
+    if fator < 1:
+        img.draft("RGB", (max(1, int(w * fator)), max(1, int(h * fator))))
+    return np.asarray(img.convert("RGB")), (w, h)
+
+
+def redimensionar_em(origem, destino, reducao=cv2.INTER_AREA, ampliacao=cv2.INTER_LINEAR):
+    """Redimensiona `origem` para dentro de `destino` (view do buffer final)"""
+    h, w = destino.shape[:2]
+    if not origem.size:
+        destino[...] = 0
+        return destino
+    reduzindo = w <= origem.shape[1] and h <= origem.shape[0]
+    interpolacao = reducao if reduzindo else ampliacao
+    if destino.flags.c_contiguous:
+        cv2.resize(origem, (w, h), dst=destino, interpolation=interpolacao)
+    else:
+        destino[...] = cv2.resize(origem, (w, h), interpolation=interpolacao)
+    return destino
+
+
+def redimensionar_array(arr, target_size, tamanho_original=None):
+    """Equivalente de `redimensionar_imagem`: mantém a proporção e centraliza em um canvas preto
+
+    `tamanho_original` (largura, altura) é o da foto enviada quando `arr`
+    veio reduzido do decode; o `resize_info` sempre se refere a ele.
+    """
+    w, h = tamanho_original or (arr.shape[1], arr.shape[0])
+    scale = min(target_size / w, target_size / h)
+
+    new_w, new_h = int(w * scale), int(h * scale)
+    paste_x = (target_size - new_w) // 2
+    paste_y = (target_size - new_h) // 2
+
+    canvas = np.zeros((target_size, target_size, 3), dtype=np.uint8)
+    redimensionar_em(arr, canvas[paste_y:paste_y + new_h, paste_x:paste_x + new_w])
+
+    return canvas, {
+        "original_size": {"width": w, "height": h},
+        "resized_size": {"width": new_w, "height": new_h},
+        "final_size": {"width": target_size, "height": target_size},
+        "padding": {"x": paste_x, "y": paste_y},
+        "scale_factor": scale
+    }
+
+
+def recortar(arr, caixa):
+    """Região (x1, y1, x2, y2) como `PIL.Image.crop`: view se estiver dentro da imagem, senão completa com preto"""
+    x1, y1, x2, y2 = (int(v) for v in caixa)
+    h, w = arr.shape[:2]
+    if 0 <= x1 <= x2 <= w and 0 <= y1 <= y2 <= h:
+        return arr[y1:y2, x1:x2]
+
+    saida = np.zeros((max(0, y2 - y1), max(0, x2 - x1), 3), dtype=np.uint8)
+    ix1, iy1, ix2, iy2 = max(x1, 0), max(y1, 0), min(x2, w), min(y2, h)
+    if ix2 > ix1 and iy2 > iy1:
+        saida[iy1 - y1:iy2 - y1, ix1 - x1:ix2 - x1] = arr[iy1:iy2, ix1:ix2]
+    return saida
+
+
+def _buffer_lote(n):
+    """Buffer uint8 (n, 224, 224, 3) da thread atual (cresce sob demanda e é reutilizado)"""
+    buffer = getattr(_local, "lote", None)
+    if buffer is None or len(buffer) < n:
+        buffer = np.empty((max(n, 8), TAMANHO_CLASSIFICADOR, TAMANHO_CLASSIFICADOR, 3), dtype=np.uint8)
+        _local.lote = buffer
+    return buffer[:n]
+
+
+def normalizar_lote(lote_uint8, modo="resnet"):
+    """uint8 -> float32 em uma única passada: `resnet` (BGR - médias, modo caffe) ou `escala` (/255)"""
+    lote = np.empty(lote_uint8.shape, dtype=np.float32)
+    if modo == "resnet":
+        np.subtract(lote_uint8[..., ::-1], MEDIA_RESNET_BGR, out=lote, dtype=np.float32)
+    else:
+        np.divide(lote_uint8, np.float32(255.0), out=lote, dtype=np.float32)
+    return lote
+
+
+def montar_lote(arr, caixas, modo="resnet"):
+    """Recorta e redimensiona as caixas direto no buffer do lote; retorna (N, 224, 224, 3) float32"""
+    buffer = _buffer_lote(len(caixas))
+    for i, caixa in enumerate(caixas):
+        redimensionar_em(recortar(arr, caixa), buffer[i], ampliacao=cv2.INTER_CUBIC)
+    return normalizar_lote(buffer, modo)
+
+
+def montar_lote_recortes(recortes, modo="resnet"):
+    """Como `montar_lote`, para recortes já separados (arrays ou PIL)"""
+    buffer = _buffer_lote(len(recortes))
+    for i, recorte in enumerate(recortes):
+        redimensionar_em(np.asarray(recorte), buffer[i], ampliacao=cv2.INTER_CUBIC)
+    return normalizar_lote(buffer, modo)
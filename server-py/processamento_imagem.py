@@ -0,0 +1,103 @@
+"""
+Funções de decodificação/redimensionamento/codificação de imagens.
+
+Módulo leve (PIL/NumPy/OpenCV): pode rodar em um pool de processos sem
+importar TensorFlow/PyTorch. A API trabalha com arrays uint8 RGB
+(`preprocessamento`); as versões PIL ficam como referência.
+"""
+import base64
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from preprocessamento import decodificar_reduzido, decodificar_rgb, recortar, redimensionar_array
+
+
+def decodificar_imagem(contents):
+    """Decodifica bytes de upload para PIL Image RGB (referência; a API usa `decodificar_rgb`)"""
+    return Image.open(io.BytesIO(contents)).convert("RGB")
+
+
+def redimensionar_imagem(img, target_size):
+    """Redimensiona mantendo proporção (referência PIL de `redimensionar_array`)"""
+    w, h = img.size
+    scale = min(target_size / w, target_size / h)
+
+    new_w, new_h = int(w * scale), int(h * scale)
+    img_resized = img.resize((new_w, new_h), Image.Resampling.BILINEAR)
+
+    img_padded = Image.new('RGB', (target_size, target_size), (0, 0, 0))
+    paste_x = (target_size - new_w) // 2
+    paste_y = (target_size - new_h) // 2
+    img_padded.paste(img_resized, (paste_x, paste_y))
+
+    return img_padded, {
+        "original_size": {"width": w, "height": h},
+        "resized_size": {"width": new_w, "height": new_h},
+        "final_size": {"width": target_size, "height": target_size},
+        "padding": {"x": paste_x, "y": paste_y},
+        "scale_factor": scale
+    }
+
+
+def preparar_imagem(contents, target_size, reduzir=True):
+    """Decodifica e redimensiona em um único passo (evita trafegar a imagem cheia entre processos)
+
+    Com `reduzir`, JPEGs são decodificados já reduzidos (modo draft).
+    Retorna (array uint8 (target, target, 3) RGB, resize_info).
+    """
+    img, info, _ = preparar_imagem_cronometrada(contents, target_size, reduzir)
+    return img, info
+
+
+def preparar_imagem_cronometrada(contents, target_size, reduzir=True):
+    """Como `preparar_imagem`, mais a duração (ms) do redimensionamento
+
+    Roda inteira no pool (talvez em outro processo); a API separa
+    decodificação e redimensionamento com o tempo devolvido.
+    """
+    if reduzir:
+        arr, tamanho_original = decodificar_reduzido(contents, target_size)
+    else:
+        arr, tamanho_original = decodificar_rgb(contents), None
+    inicio = time.perf_counter()
+    img, info = redimensionar_array(arr, target_size, tamanho_original)
+    return img, info, round((time.perf_counter() - inicio) * 1000, 3)
+
+
+# Modos de recorte nas respostas (?crops=); blob/blob_thumb gravam no armazenamento de blobs
+MODOS_RECORTE = ("full", "thumb", "none", "ref", "blob", "blob_thumb")
+TAMANHO_MINIATURA = 96
+
+
+def como_pil(img):
+    """PIL Image a partir de um array uint8 RGB (ou a própria imagem)"""
+    return Image.fromarray(np.ascontiguousarray(img)) if isinstance(img, np.ndarray) else img
+
+
+def codificar_jpeg(img, quality=90):
+    """Converte imagem (PIL ou array RGB) para bytes JPEG"""
+    img = como_pil(img)
+    buffered = io.BytesIO()
+    img.save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+def image_to_base64(img):
+    """Converte PIL Image para base64"""
+    return base64.b64encode(codificar_jpeg(img)).decode()
+
+
+def codificar_recortes(img, caixas, modo="full"):
+    """Recorta cada caixa (x1, y1, x2, y2) e codifica em JPEG (`full`) ou miniatura (`thumb`)"""
+    recortes = []
+    for caixa in caixas:
+        recorte = como_pil(recortar(img, caixa)) if isinstance(img, np.ndarray) else img.crop(caixa)
+        if modo == "thumb":
+            recorte.thumbnail((TAMANHO_MINIATURA, TAMANHO_MINIATURA))
+            recortes.append(codificar_jpeg(recorte, quality=80))
+        else:
+            recortes.append(codificar_jpeg(recorte))
+    return recortes
@@ -0,0 +1,132 @@
+"""
+Controle de qualidade de serviço: resolução de entrada do YOLO conforme a carga.
+
+A escada de resoluções (ex.: 320/416/512/640) vem de QOS_LADDER; cada
+degrau pode trazer um limiar de confiança próprio (`320:0.35`), aplicado
+sobre as detecções: menos caixas também significa menos recortes para o
+classificador.
+
+No modo automático o controlador desce um degrau quando a fila de
+requisições em andamento passa de `fila_alta` (rajada) ou quando a latência
+recente do degrau atual passa do SLO, e sobe quando a latência estimada do
+degrau de cima (escala com a área) cabe no SLO com folga e a fila está
+vazia. Depois de `ocioso_s` sem requisições volta à qualidade máxima.
+"""
+import time
+from collections import Counter
+
+# ?quality=: automático, extremos da escada, o topo automático ou um tamanho da escada
+QUALIDADES = ("auto", "low", "high", "max")
+
+
+def ler_escada(texto, conf_padrao):
+    """Lê QOS_LADDER: `320:0.35,416,512` -> [(320, 0.35), (416, conf_padrao), (512, conf_padrao)]"""
+    degraus = {}
+    for parte in texto.split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        tamanho, _, conf = parte.partition(":")
+        degraus[int(tamanho)] = float(conf) if conf else conf_padrao
+    if not degraus:
+        raise ValueError("QOS_LADDER vazio")
+    return sorted(degraus.items())
+
+
+class ControladorQualidade:
+    """Escolhe o degrau da escada por requisição a partir da fila e da latência observada
+
+    Usado só no event loop (sem locks), como o `MicroBatcher`.
+    """
+
+    def __init__(self, escada, topo, slo_ms, fila_alta=4, intervalo_s=2.0, ocioso_s=10.0, folga=0.8, alfa=0.3):
+        self.escada = list(escada)
+        tamanhos = [t for t, _ in self.escada]
+        # Topo automático: maior degrau que não passa de `topo`
+        self.topo = max([i for i, t in enumerate(tamanhos) if t <= topo] or [0])
+        self.slo_ms = float(slo_ms)
+        self.fila_alta = max(1, int(fila_alta))
+        self.intervalo_s = float(intervalo_s)
+        self.ocioso_s = float(ocioso_s)
+        self.folga = float(folga)
+        self.alfa = float(alfa)
+
+        self.nivel = self.topo
+        self.latencias = {}  # tamanho -> média móvel (ms)
+        self._ultima_mudanca = 0.0
+        self._ultima_requisicao = time.monotonic()
+
+        # Estatísticas
+        self.escolhas = Counter()
+        self.descidas = 0
+        self.subidas = 0
+
+    def degrau(self, qualidade):
+        """(tamanho, conf) de um ?quality= explícito; None para `auto` ou valor inválido"""
+        if qualidade == "low":
+            return self.escada[0]
+        if qualidade == "high":
+            return self.escada[self.topo]
+        if qualidade == "max":
+            return self.escada[-1]
+        if qualidade.isdigit():
+            return next((d for d in self.escada if d[0] == int(qualidade)), None)
+        return None
+
+    def escolher(self, profundidade):
+        """Degrau (tamanho, conf) para uma requisição automática, com `profundidade` requisições em andamento"""
+        agora = time.monotonic()
+        if agora - self._ultima_requisicao > self.ocioso_s and self.nivel != self.topo:
+            self._mudar(self.topo, agora)
+        self._ultima_requisicao = agora
+
+        # Rajada: a fila denuncia o atraso antes da latência média
+        if profundidade >= self.fila_alta and self.nivel > 0 and self._pode_mudar(agora):
+            self._mudar(self.nivel - 1, agora)
+
+        degrau = self.escada[self.nivel]
+        self.escolhas[degrau[0]] += 1
+        return degrau
+
+    def observar(self, tamanho, ms, profundidade):
+        """Registra a latência (ms) de uma requisição atendida em `tamanho` e ajusta o nível"""
+        anterior = self.latencias.get(tamanho)
+        self.latencias[tamanho] = ms if anterior is None else anterior + self.alfa * (ms - anterior)
+
+        agora = time.monotonic()
+        atual = self.latencias.get(self.escada[self.nivel][0])
+        if atual is None or not self._pode_mudar(agora):
+            return
+        if atual > self.slo_ms and self.nivel > 0:
+            self._mudar(self.nivel - 1, agora)
+        elif self.nivel < self.topo and profundidade <= 1:
+            razao = self.escada[self.nivel + 1][0] / self.escada[self.nivel][0]
+            if atual * razao ** 2 < self.slo_ms * self.folga:
+                self._mudar(self.nivel + 1, agora)
+
+    def _pode_mudar(self, agora):
+        return agora - self._ultima_mudanca >= self.intervalo_s
+
+    def _mudar(self, nivel, agora):
+        if nivel < self.nivel:
+            self.descidas += 1
+        else:
+            self.subidas += 1
+        self.nivel = nivel
+        self._ultima_mudanca = agora
+
+    def tamanho_atual(self):
+        return self.escada[self.nivel][0]
+
+    def estatisticas(self):
+        return {
+            "escada": [{"tamanho": t, "conf": c} for t, c in self.escada],
+            "topo_automatico": self.escada[self.topo][0],
+            "tamanho_atual": self.tamanho_atual(),
+            "slo_ms": self.slo_ms,
+            "fila_alta": self.fila_alta,
+            "latencia_media_ms": {t: round(ms, 1) for t, ms in sorted(self.latencias.items())},
+            "escolhas": dict(sorted(self.escolhas.items())),
+            "descidas": self.descidas,
+            "subidas": self.subidas,
+        }
@@ -0,0 +1,318 @@
+"""
+Quantização INT8 pós-treino (ONNX Runtime) com avaliação contra o FP32.
+
+    python quantizar_modelos.py --imagens pasta/ --classificador --yolo [--modo static|dynamic]
+
+Parte dos .onnx FP32 gerados por `exportar_onnx.py` e grava em models-ia/:
+    resnet50_consolidado.int8.onnx
+    bestYolov5_test.int8.onnx
+    quantizacao.json            (métricas + SHA-256 de cada arquivo INT8)
+
+As imagens da pasta são divididas em calibração (static) e avaliação:
+- classificador: concordância top-1 com as predições FP32 sobre LABEL_COLS
+- YOLO: mAP@0.5 do INT8 usando as detecções FP32 como referência
+  (drift = 1 - mAP@0.5)
+
+A API só carrega a variante INT8 (ONNX_MODEL_VARIANT=int8) se o relatório
+corresponder ao arquivo e a métrica atingir QUANT_GATE_MIN_TOP1 /
+QUANT_GATE_MIN_MAP50. Termina com código 1 se algum modelo ficar abaixo do gate.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import api_ia
+from backends_inferencia import (
+    RELATORIO_QUANTIZACAO, ClassificadorONNX, DetectorONNX, caminho_variante, criar_sessao_onnx, hash_arquivo,
+    letterbox
+)
+from exportar_onnx import CLASSIFICADOR_ONNX, YOLO_ONNX, iou
+from preprocessamento import recortar, redimensionar_array
+
+RELATORIO = api_ia.MODELS_DIR / RELATORIO_QUANTIZACAO
+
+
+# ========================================
+# DADOS
+# ========================================
+def carregar_pasta(pasta):
+    caminhos = sorted(p for p in Path(pasta).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if not caminhos:
+        raise SystemExit(f"❌ Nenhuma imagem em {pasta}")
+    return [Image.open(p).convert("RGB") for p in caminhos]
+
+
+def dividir(imagens, fracao_avaliacao, seed=0):
+    """Separa calibração e avaliação (com poucas imagens, usa todas nos dois)"""
+    if len(imagens) < 4:
+        print(f"⚠️ Apenas {len(imagens)} imagens: calibração e avaliação usam o mesmo conjunto")
+        return imagens, imagens
+    ordem = np.random.default_rng(seed).permutation(len(imagens))
+    n_avaliacao = max(1, int(round(len(imagens) * fracao_avaliacao)))
+    avaliacao = [imagens[i] for i in ordem[:n_avaliacao]]
+    calibracao = [imagens[i] for i in ordem[n_avaliacao:]]
+    return calibracao, avaliacao
+
+
+def recortes_classificador(imagens, por_imagem=4, seed=1):
+    """Imagem inteira + recortes aleatórios, preprocessados como na API"""
+    rng = np.random.default_rng(seed)
+    recortes = []
+    for img in imagens:
+        img_resized, _ = redimensionar_array(np.asarray(img), api_ia.HARDWARE_CONFIG['target_size'])
+        recortes.append(img_resized)
+        h, w = img_resized.shape[:2]
+        for _ in range(por_imagem):
+            x1, y1 = int(rng.integers(0, w // 2)), int(rng.integers(0, h // 2))
+            recortes.append(recortar(img_resized, (x1, y1, x1 + int(rng.integers(32, w // 2)), y1 + int(rng.integers(32, h // 2)))))
+    # Mesmo preprocessamento do backend ONNX (nome do arquivo define ResNet vs /255)
+    api_ia.CLASSIFIER_INFO["name"] = CLASSIFICADOR_ONNX.name
+    return api_ia.preprocessar_recortes(recortes)
+
+
+def entradas_yolo(imagens, tamanho):
+    """Letterbox + /255 em CHW, como o DetectorONNX"""
+    lotes = []
+    for img in imagens:
+        img_resized, _ = redimensionar_array(np.asarray(img), api_ia.HARDWARE_CONFIG['target_size'])
+        caixa, _, _ = letterbox(img_resized, tamanho)
+        lotes.append((caixa.transpose(2, 0, 1)[None] / 255.0).astype(np.float32))
+    return lotes
+
+
+# ========================================
+# QUANTIZAÇÃO
+# ========================================
+def quantizar(origem, destino, modo, lotes=None, calibracao="minmax"):
+    """FP32 -> INT8 (static: QDQ calibrado em `lotes`; dynamic: só pesos)"""
+    from onnxruntime.quantization import (
+        CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    )
+
+    origem = Path(origem)
+    if not origem.exists():
+        raise SystemExit(f"❌ {origem} não encontrado (rode exportar_onnx.py antes)")
+
+    # Pré-processamento de forma/fusões recomendado pelo ONNX Runtime (opcional)
+    intermediario = origem.with_name(f"{origem.stem}.pre{origem.suffix}")
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        quant_pre_process(str(origem), str(intermediario), skip_symbolic_shape=True)
+        entrada = intermediario
+    except Exception as e:
+        print(f"⚠️ quant_pre_process falhou ({e}), quantizando o original")
+        entrada = origem
+
+    try:
+        if modo == "dynamic":
+            quantize_dynamic(str(entrada), str(destino), weight_type=QuantType.QInt8)
+        else:
+            nome_entrada = criar_sessao_onnx(origem).get_inputs()[0].name
+
+            class Leitor(CalibrationDataReader):
+                def __init__(self):
+                    self._iter = iter(lotes)
+
+                def get_next(self):
+                    lote = next(self._iter, None)
+                    return None if lote is None else {nome_entrada: lote}
+
+            metodos = {
+                "minmax": CalibrationMethod.MinMax,
+                "entropy": CalibrationMethod.Entropy,
+                "percentile": CalibrationMethod.Percentile,
+            }
+            quantize_static(
+                str(entrada), str(destino), Leitor(),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+                calibrate_method=metodos[calibracao],
+            )
+    finally:
+        if intermediario.exists():
+            intermediario.unlink()
+
+    tamanhos = origem.stat().st_size / 1e6, Path(destino).stat().st_size / 1e6
+    print(f"📦 {Path(destino).name}: {tamanhos[0]:.1f} MB -> {tamanhos[1]:.1f} MB")
+    return destino
+
+
+def cronometrar(funcao, repeticoes=3):
+    """Latência média (ms) após um warm-up"""
+    funcao()
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao()
+    return (time.perf_counter() - inicio) * 1000 / repeticoes
+
+
+# ========================================
+# AVALIAÇÃO
+# ========================================
+def avaliar_classificador(fp32_path, int8_path, lote):
+    fp32 = ClassificadorONNX(fp32_path)
+    int8 = ClassificadorONNX(int8_path)
+    p_fp32, p_int8 = fp32(lote), int8(lote)
+    r_fp32, r_int8 = p_fp32.argmax(1), p_int8.argmax(1)
+
+    por_classe = {}
+    for i, classe in enumerate(api_ia.LABEL_COLS):
+        mascara = r_fp32 == i
+        if mascara.any():
+            por_classe[classe] = {"n": int(mascara.sum()), "concordancia": float((r_int8[mascara] == i).mean())}
+
+    return {
+        "top1_concordancia": float((r_fp32 == r_int8).mean()),
+        "concordancia_por_classe": por_classe,
+        "diff_conf_media": float(np.abs(p_fp32 - p_int8).max(1).mean()),
+        "diff_conf_max": float(np.abs(p_fp32 - p_int8).max()),
+        "amostras_avaliacao": int(len(lote)),
+        "latencia_ms": {
+            "fp32": round(cronometrar(lambda: fp32(lote)), 2),
+            "int8": round(cronometrar(lambda: int8(lote)), 2),
+        },
+    }
+
+
+def ap_voc(recall, precisao):
+    """Área sob a curva precisão x recall (interpolação contínua, VOC)"""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precisao, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    i = np.where(mrec[1:] != mrec[:-1])[0]
+    return float(np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1]))
+
+
+def map50(referencias, predicoes):
+    """mAP@0.5 de `predicoes` tomando `referencias` como verdade (listas de (n, 6) por imagem)"""
+    classes = {int(c) for ref in referencias for c in ref[:, 5]}
+    if not classes:
+        return 1.0 if not any(len(p) for p in predicoes) else 0.0
+
+    aps = []
+    for classe in sorted(classes):
+        n_ref = sum(int((ref[:, 5] == classe).sum()) for ref in referencias)
+        candidatos = []  # (conf, acerto)
+        for ref, pred in zip(referencias, predicoes):
+            ref_c = ref[ref[:, 5] == classe]
+            usadas = np.zeros(len(ref_c), dtype=bool)
+            pred_c = pred[pred[:, 5] == classe]
+            for caixa in pred_c[pred_c[:, 4].argsort()[::-1]]:
+                ious = np.array([iou(caixa, r) for r in ref_c]) if len(ref_c) else np.zeros(0)
+                j = int(ious.argmax()) if len(ious) else -1
+                acerto = j >= 0 and ious[j] >= 0.5 and not usadas[j]
+                if acerto:
+                    usadas[j] = True
+                candidatos.append((float(caixa[4]), acerto))
+
+        if not candidatos:
+            aps.append(0.0)
+            continue
+        candidatos.sort(key=lambda c: -c[0])
+        acertos = np.cumsum([c[1] for c in candidatos])
+        erros = np.cumsum([not c[1] for c in candidatos])
+        aps.append(ap_voc(acertos / n_ref, acertos / np.maximum(acertos + erros, 1)))
+    return float(np.mean(aps))
+
+
+def avaliar_yolo(fp32_path, int8_path, imagens, tamanho):
+    fp32 = DetectorONNX(fp32_path, tamanho)
+    int8 = DetectorONNX(int8_path, tamanho)
+    redimensionadas = [redimensionar_array(np.asarray(img), api_ia.HARDWARE_CONFIG['target_size'])[0] for img in imagens]
+
+    referencias = [fp32(img).xyxy[0] for img in redimensionadas]
+    predicoes = [int8(img).xyxy[0] for img in redimensionadas]
+    valor = map50(referencias, predicoes)
+
+    return {
+        "map50": valor,
+        "map50_drift": 1.0 - valor,
+        "caixas": {"fp32": int(sum(len(r) for r in referencias)), "int8": int(sum(len(p) for p in predicoes))},
+        "amostras_avaliacao": len(imagens),
+        "latencia_ms": {
+            "fp32": round(cronometrar(lambda: fp32(redimensionadas[0])), 2),
+            "int8": round(cronometrar(lambda: int8(redimensionadas[0])), 2),
+        },
+    }
+
+
+# ========================================
+# RELATÓRIO
+# ========================================
+def gravar_relatorio(chave, fp32_path, int8_path, metricas, args, amostras_calibracao):
+    relatorio = json.loads(RELATORIO.read_text(encoding="utf-8")) if RELATORIO.exists() else {}
+    relatorio[chave] = {
+        "arquivo": Path(int8_path).name,
+        "sha256": hash_arquivo(int8_path),
+        "referencia": Path(fp32_path).name,
+        "modo": args.modo,
+        "calibracao": args.calibracao if args.modo == "static" else None,
+        "amostras_calibracao": amostras_calibracao,
+        **metricas,
+        "gerado_em": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    RELATORIO.write_text(json.dumps(relatorio, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--imagens", required=True, help="Pasta com imagens de pé (calibração + avaliação)")
+    parser.add_argument("--classificador", action="store_true", help="Quantiza o classificador")
+    parser.add_argument("--yolo", action="store_true", help="Quantiza o YOLO")
+    parser.add_argument("--modo", choices=("static", "dynamic"), default="static")
+    parser.add_argument("--calibracao", choices=("minmax", "entropy", "percentile"), default="minmax")
+    parser.add_argument("--fracao-avaliacao", type=float, default=0.3, help="Parte das imagens reservada à avaliação")
+    parser.add_argument("--tamanho-yolo", type=int, default=api_ia.ONNX_CONFIG["yolo_size"])
+    parser.add_argument("--sem-quantizar", action="store_true", help="Apenas reavalia os INT8 existentes")
+    args = parser.parse_args()
+
+    if not (args.classificador or args.yolo):
+        parser.error("informe --classificador e/ou --yolo")
+
+    calibracao, avaliacao = dividir(carregar_pasta(args.imagens), args.fracao_avaliacao)
+    print(f"🖼️ {len(calibracao)} imagens de calibração, {len(avaliacao)} de avaliação")
+
+    ok = True
+    if args.classificador:
+        destino = caminho_variante(CLASSIFICADOR_ONNX, "int8")
+        lote_calibracao = recortes_classificador(calibracao)
+        if not args.sem_quantizar:
+            # Lotes pequenos limitam a memória da calibração
+            lotes = [lote_calibracao[i:i + 8] for i in range(0, len(lote_calibracao), 8)]
+            quantizar(CLASSIFICADOR_ONNX, destino, args.modo, lotes, args.calibracao)
+        metricas = avaliar_classificador(CLASSIFICADOR_ONNX, destino, recortes_classificador(avaliacao, seed=2))
+        gravar_relatorio("classificador", CLASSIFICADOR_ONNX, destino, metricas, args, len(lote_calibracao))
+
+        aprovado = metricas["top1_concordancia"] >= api_ia.ONNX_CONFIG["gate_top1"]
+        ok &= aprovado
+        print(f"{'✅' if aprovado else '❌'} Classificador INT8: top-1 {metricas['top1_concordancia']:.1%} "
+              f"(gate {api_ia.ONNX_CONFIG['gate_top1']:.1%}), max |Δconf| {metricas['diff_conf_max']:.3f}, "
+              f"{metricas['latencia_ms']['fp32']} -> {metricas['latencia_ms']['int8']} ms")
+
+    if args.yolo:
+        destino = caminho_variante(YOLO_ONNX, "int8")
+        if not args.sem_quantizar:
+            quantizar(YOLO_ONNX, destino, args.modo, entradas_yolo(calibracao, args.tamanho_yolo), args.calibracao)
+        metricas = avaliar_yolo(YOLO_ONNX, destino, avaliacao, args.tamanho_yolo)
+        gravar_relatorio("yolo", YOLO_ONNX, destino, metricas, args, len(calibracao))
+
+        aprovado = metricas["map50"] >= api_ia.ONNX_CONFIG["gate_map50"]
+        ok &= aprovado
+        print(f"{'✅' if aprovado else '❌'} YOLO INT8: mAP@0.5 {metricas['map50']:.3f} "
+              f"(drift {metricas['map50_drift']:.3f}, gate {api_ia.ONNX_CONFIG['gate_map50']}), "
+              f"{metricas['latencia_ms']['fp32']} -> {metricas['latencia_ms']['int8']} ms")
+
+    print(f"📝 Relatório: {RELATORIO}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
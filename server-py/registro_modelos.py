@@ -0,0 +1,280 @@
+"""
+Registro de versões dos modelos: troca a quente, canário e sombra.
+
+Cada tipo de modelo (classificacao, yolo) tem um `RegistroModelos` com as
+versões carregadas (`VersaoModelo`): a ativa recebe o tráfego; um canário
+recebe uma fração das requisições no lugar da ativa; uma sombra recebe uma
+cópia de uma fração delas em segundo plano (a resposta continua sendo a da
+versão servida), para comparar latência e concordância antes de promover.
+
+A versão de cada modelo é escolhida uma vez por requisição (`rotear`) e
+fica reservada até ela terminar: trocar a ativa é só reatribuir um
+ponteiro no event loop, as requisições em andamento terminam na versão
+que escolheram e nenhuma é descartada. Uma versão que sai do tráfego fica
+`drenando` e é descarregada (callback `descarregar`) quando a última
+requisição que a usa termina.
+
+O estado desejado (ativa/canário/sombra por tipo) fica em um arquivo JSON
+(`ler_estado`/`gravar_estado`) que cada worker reconcilia: com vários
+workers (servidor_prefork.py) todos convergem para o mesmo roteamento.
+"""
+import contextvars
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+_NOME_VALIDO = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+# (principal, sombra) de cada tipo de modelo escolhidos para a requisição atual
+_versoes_requisicao = contextvars.ContextVar("versoes_requisicao", default=None)
+
+
+def nome_versao_valido(nome):
+    return bool(_NOME_VALIDO.match(nome or "")) and nome not in (".", "..")
+
+
+class VersaoModelo:
+    """Uma versão de um modelo: objetos carregados, estado e estatísticas de uso"""
+
+    def __init__(self, tipo, nome, janela=1024):
+        self.tipo = tipo
+        self.nome = nome
+        # carregando -> pronta -> (servindo) -> drenando -> descarregada; ou erro
+        self.estado = "carregando"
+        self.recursos = None  # objetos do backend (modelo, forward compilado...)
+        self.info = {}
+        self.chave = None  # versão usada nas chaves do cache de resultados
+        self.batcher = None
+        self.erro = None
+        self.em_uso = 0
+        self.carregada_em = None
+
+        self._latencias_ms = deque(maxlen=janela)
+        self._chamadas = 0
+        self._erros = 0
+        self._comparacoes = 0
+        self._concordancias = 0
+
+    def pronta(self, recursos, info, chave):
+        self.recursos, self.info, self.chave = recursos, dict(info), chave
+        self.estado = "pronta"
+        self.carregada_em = time.time()
+
+    def falhou(self, erro):
+        self.estado = "erro"
+        self.erro = str(erro)
+
+    def observar(self, ms, erro=False):
+        """Registra uma chamada ao modelo (latência em ms, incluindo a espera no lote)"""
+        self._chamadas += 1
+        if erro:
+            self._erros += 1
+        else:
+            self._latencias_ms.append(ms)
+
+    def comparar(self, concorda):
+        """Registra se a sombra concordou com a versão servida"""
+        self._comparacoes += 1
+        self._concordancias += bool(concorda)
+
+    def estatisticas(self):
+        latencias = np.asarray(self._latencias_ms, dtype=np.float64)
+        resumo = {
+            "estado": self.estado,
+            "chave": self.chave,
+            "info": self.info,
+            "em_uso": self.em_uso,
+            "carregada_em": self.carregada_em,
+            "chamadas": self._chamadas,
+            "erros": self._erros,
+        }
+        if len(latencias):
+            p50, p95, p99 = np.percentile(latencias, [50, 95, 99])
+            resumo["latencia_ms"] = {
+                "media": round(float(latencias.mean()), 3),
+                "p50": round(float(p50), 3),
+                "p95": round(float(p95), 3),
+                "p99": round(float(p99), 3),
+                "amostras": len(latencias),
+            }
+        if self._comparacoes:
+            resumo["sombra"] = {
+                "comparacoes": self._comparacoes,
+                "concordancia": round(self._concordancias / self._comparacoes, 4),
+            }
+        if self.erro:
+            resumo["erro"] = self.erro
+        return resumo
+
+
+class RegistroModelos:
+    """Versões carregadas de um tipo de modelo e o roteamento entre elas
+
+    Só é alterado no event loop (sem locks); `descarregar(versao)` é
+    chamado quando uma versão fora do tráfego termina de drenar.
+    """
+
+    def __init__(self, tipo, descarregar):
+        self.tipo = tipo
+        self.versoes = {}
+        self.ativa = None
+        self.canario = None
+        self.fracao_canario = 0.0
+        self.sombra = None
+        self.fracao_sombra = 0.0
+        self._descarregar = descarregar
+        self._sorteio = random.Random()
+
+    def adicionar(self, nome):
+        """Nova versão (estado `carregando`); retorna a existente se já houver"""
+        versao = self.versoes.get(nome)
+        if versao is None or versao.estado in ("erro", "descarregada"):
+            versao = self.versoes[nome] = VersaoModelo(self.tipo, nome)
+        return versao
+
+    def servindo(self):
+        """Versões que recebem tráfego (ativa, canário, sombra)"""
+        return {v for v in (self.ativa, self.canario, self.sombra) if v is not None}
+
+    def rotear(self, ativa, canario=None, fracao_canario=0.0, sombra=None, fracao_sombra=0.0):
+        """Aplica o roteamento (versões já prontas) de uma vez; as que saem do tráfego drenam
+
+        Retorna se algo mudou.
+        """
+        canario = canario if canario is not ativa and fracao_canario > 0 else None
+        sombra = sombra if sombra is not ativa and fracao_sombra > 0 else None
+        rota = (ativa, canario, float(fracao_canario) if canario else 0.0, sombra, float(fracao_sombra) if sombra else 0.0)
+        if rota == (self.ativa, self.canario, self.fracao_canario, self.sombra, self.fracao_sombra):
+            return False
+
+        anteriores = self.servindo()
+        self.ativa, self.canario, self.fracao_canario, self.sombra, self.fracao_sombra = rota
+        for versao in self.servindo():
+            versao.estado = "servindo"
+        for versao in anteriores - self.servindo():
+            self.retirar(versao)
+        return True
+
+    def retirar(self, versao):
+        """Tira a versão do registro; é descarregada quando a última requisição que a usa termina"""
+        if versao in self.servindo():
+            raise ValueError(f"{self.tipo}/{versao.nome} está recebendo tráfego")
+        versao.estado = "drenando"
+        if versao.em_uso == 0:
+            self._finalizar(versao)
+
+    def _finalizar(self, versao):
+        versao.estado = "descarregada"
+        if self.versoes.get(versao.nome) is versao:
+            del self.versoes[versao.nome]
+        self._descarregar(versao)
+
+    def escolher(self):
+        """(versão que atende, versão sombra ou None) para uma requisição"""
+        principal = self.ativa
+        if self.canario is not None and self._sorteio.random() < self.fracao_canario:
+            principal = self.canario
+        sombra = None
+        if self.sombra is not None and self.sombra is not principal and self._sorteio.random() < self.fracao_sombra:
+            sombra = self.sombra
+        return principal, sombra
+
+    def reservar(self, versao):
+        versao.em_uso += 1
+
+    def liberar(self, versao):
+        versao.em_uso -= 1
+        if versao.em_uso == 0 and versao.estado == "drenando":
+            self._finalizar(versao)
+
+    def estatisticas(self):
+        return {
+            "ativa": self.ativa.nome if self.ativa else None,
+            "canario": self.canario.nome if self.canario else None,
+            "fracao_canario": self.fracao_canario,
+            "sombra": self.sombra.nome if self.sombra else None,
+            "fracao_sombra": self.fracao_sombra,
+            "versoes": {nome: versao.estatisticas() for nome, versao in self.versoes.items()},
+        }
+
+
+@contextmanager
+def rotear(registros):
+    """Escolhe as versões da requisição e as mantém carregadas até o fim do bloco"""
+    escolhas = {tipo: registro.escolher() for tipo, registro in registros.items() if registro.ativa}
+    reservadas = [
+        (registros[tipo], versao) for tipo, par in escolhas.items() for versao in par if versao is not None
+    ]
+    for registro, versao in reservadas:
+        registro.reservar(versao)
+    token = _versoes_requisicao.set(escolhas)
+    try:
+        yield escolhas
+    finally:
+        _versoes_requisicao.reset(token)
+        for registro, versao in reservadas:
+            registro.liberar(versao)
+
+
+def versoes_requisicao():
+    """{tipo: (principal, sombra)} da requisição atual (None fora de `rotear`)"""
+    return _versoes_requisicao.get()
+
+
+class RoteamentoModelos:
+    """Middleware ASGI: envolve as rotas de inferência em `rotear`
+
+    A resposta informa as versões que atenderam no cabeçalho
+    `X-Model-Versions` (ex.: `classificacao=v2, yolo=padrao`).
+    """
+
+    def __init__(self, app, registros, prefixos=("/predict",)):
+        self.app = app
+        self.registros = registros
+        self.prefixos = tuple(prefixos)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixos):
+            return await self.app(scope, receive, send)
+        with rotear(self.registros) as escolhas:
+            versoes = ", ".join(f"{tipo}={principal.nome}" for tipo, (principal, _) in escolhas.items())
+
+            async def send_com_versoes(mensagem):
+                if mensagem["type"] == "http.response.start" and versoes:
+                    mensagem["headers"] = [*mensagem.get("headers", []), (b"x-model-versions", versoes.encode())]
+                await send(mensagem)
+
+            await self.app(scope, receive, send_com_versoes)
+
+
+# ========================================
+# ESTADO DESEJADO (compartilhado entre workers)
+# ========================================
+def ler_estado(caminho):
+    """Estado desejado {tipo: {ativa, canario, fracao_canario, sombra, fracao_sombra}} ({} se não existe)"""
+    try:
+        with open(caminho, encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        return {}
+
+
+def gravar_estado(caminho, estado):
+    """Grava o estado desejado de forma atômica (os workers nunca leem um arquivo pela metade)"""
+    caminho = Path(caminho)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=caminho.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(descritor, "w", encoding="utf-8") as arquivo:
+            json.dump(estado, arquivo, indent=2)
+        os.replace(temporario, caminho)
+    except BaseException:
+        Path(temporario).unlink(missing_ok=True)
+        raise
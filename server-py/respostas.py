@@ -0,0 +1,104 @@
+"""
+Negociação de conteúdo das respostas de predição.
+
+- application/json (padrão): bytes viram base64, como sempre foi.
+- application/x-msgpack: bytes JPEG crus, sem base64 (requer `msgpack`).
+- multipart/mixed: primeira parte JSON; cada imagem vira uma parte
+  image/jpeg referenciada no JSON como "cid:<n>".
+"""
+import base64
+import json
+import uuid
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:  # opcional
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+MULTIPART = "multipart/mixed"
+
+_ALIASES = {
+    "application/json": JSON,
+    "application/x-msgpack": MSGPACK,
+    "application/msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    "multipart/mixed": MULTIPART,
+}
+
+
+def escolher_formato(accept):
+    """Escolhe o formato pelo header Accept (respeitando q=); JSON por padrão"""
+    candidatos = []
+    for ordem, item in enumerate((accept or "").split(",")):
+        partes = [p.strip() for p in item.split(";")]
+        formato = _ALIASES.get(partes[0].lower())
+        if formato is None or (formato == MSGPACK and msgpack is None):
+            continue
+        q = 1.0
+        for parametro in partes[1:]:
+            if parametro.startswith("q="):
+                try:
+                    q = float(parametro[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            candidatos.append((-q, ordem, formato))
+    return min(candidatos)[2] if candidatos else JSON
+
+
+def _mapear_bytes(valor, funcao):
+    if isinstance(valor, (bytes, bytearray)):
+        return funcao(bytes(valor))
+    if isinstance(valor, dict):
+        return {k: _mapear_bytes(v, funcao) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_mapear_bytes(v, funcao) for v in valor]
+    return valor
+
+
+def renderizar(conteudo, formato=JSON, headers=None):
+    """Serializa `conteudo` (que pode conter bytes JPEG) no formato escolhido"""
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept"
+
+    if formato == MSGPACK:
+        return Response(
+            content=msgpack.packb(conteudo, use_bin_type=True),
+            media_type=MSGPACK,
+            headers=headers
+        )
+
+    if formato == MULTIPART:
+        partes = []
+
+        def referenciar(dados):
+            partes.append(dados)
+            return f"cid:{len(partes) - 1}"
+
+        metadados = _mapear_bytes(conteudo, referenciar)
+        boundary = uuid.uuid4().hex
+        corpo = [
+            f"--{boundary}\r\nContent-Type: {JSON}\r\n\r\n".encode(),
+            json.dumps(metadados).encode(),
+        ]
+        for i, dados in enumerate(partes):
+            corpo.append(
+                f"\r\n--{boundary}\r\nContent-Type: image/jpeg\r\n"
+                f"Content-ID: <{i}>\r\nContent-Length: {len(dados)}\r\n\r\n".encode()
+            )
+            corpo.append(dados)
+        corpo.append(f"\r\n--{boundary}--\r\n".encode())
+        return Response(
+            content=b"".join(corpo),
+            media_type=f'{MULTIPART}; boundary="{boundary}"',
+            headers=headers
+        )
+
+    return JSONResponse(
+        content=_mapear_bytes(conteudo, lambda dados: base64.b64encode(dados).decode()),
+        headers=headers
+    )
@@ -0,0 +1,153 @@
+"""
+Servidor multi-worker com pré-fork.
+
+    WEB_CONCURRENCY=4 python servidor_prefork.py --port 8000
+
+O processo pai importa a API e os frameworks, carrega o que pode ser
+herdado por fork (`api_ia.preparar_prefork`) e congela o heap
+(`gc.freeze`, para o coletor não sujar as páginas compartilhadas); depois
+abre o socket e cria os workers, que herdam essa memória copy-on-write e
+aceitam conexões do mesmo socket. As threads de cada worker são a fatia
+`cpu_threads / workers` (ver `configurar_hardware`).
+
+TensorFlow e as sessões do ONNX Runtime não sobrevivem a fork depois de
+criar threads, então são criados em cada worker. No backend ONNX os workers
+carregam uma versão pré-otimizada com os pesos em arquivo externo
+(`preparar_modelo_compartilhado`, gerada aqui em um processo separado),
+mapeada em memória e compartilhada pelo page cache.
+
+O pai só supervisiona: recria workers que morrerem e repassa SIGTERM/SIGINT.
+Com 1 worker, roda o uvicorn direto, sem fork.
+"""
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+logger = logging.getLogger("servidor_prefork")
+
+# Worker que morre antes disso é recriado com espera (evita loop de crash)
+VIDA_MINIMA_S = 10
+
+
+def gerar_modelos_compartilhados(caminhos):
+    """Gera as versões com pesos em mmap em um processo novo (o pai não pode criar sessões ORT)"""
+    if not caminhos:
+        return
+    from backends_inferencia import preparar_modelo_compartilhado
+
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        for destino in pool.map(preparar_modelo_compartilhado, caminhos):
+            logger.info(f"🧠 Pesos compartilhados: {destino.name}")
+
+
+def abrir_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def executar_worker(app, sock, indice):
+    """Corpo do processo filho: uvicorn no socket herdado"""
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    os.environ["WORKER_ID"] = str(indice)
+    config = uvicorn.Config(app, log_level="info")
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+class Supervisor:
+    """Cria e recria os workers; encerra todos ao receber SIGTERM/SIGINT"""
+
+    def __init__(self, app, sock, workers):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.filhos = {}  # pid -> (índice, criado_em)
+        self.encerrando = False
+
+    def criar(self, indice):
+        pid = os.fork()
+        if pid == 0:
+            executar_worker(self.app, self.sock, indice)
+        self.filhos[pid] = (indice, time.monotonic())
+        logger.info(f"👷 Worker {indice} iniciado (pid {pid})")
+
+    def encerrar(self, signum, _frame):
+        self.encerrando = True
+        for pid in list(self.filhos):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def rodar(self):
+        signal.signal(signal.SIGTERM, self.encerrar)
+        signal.signal(signal.SIGINT, self.encerrar)
+        for indice in range(self.workers):
+            self.criar(indice)
+
+        while self.filhos:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            if pid not in self.filhos:
+                continue
+            indice, criado_em = self.filhos.pop(pid)
+            if self.encerrando:
+                continue
+            logger.warning(f"⚠️ Worker {indice} (pid {pid}) terminou com status {status}, recriando")
+            if time.monotonic() - criado_em < VIDA_MINIMA_S:
+                time.sleep(VIDA_MINIMA_S)
+            self.criar(indice)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    args = parser.parse_args()
+
+    # Lido por configurar_hardware no import da API (divisão das threads)
+    os.environ["WEB_CONCURRENCY"] = str(max(1, args.workers))
+
+    import api_ia
+
+    if args.workers <= 1:
+        import uvicorn
+        uvicorn.run(api_ia.app, host=args.host, port=args.port, log_level="info")
+        return
+
+    if api_ia.ONNX_CONFIG["pesos_compartilhados"]:
+        gerar_modelos_compartilhados(api_ia.modelos_onnx_compartilhaveis())
+    api_ia.preparar_prefork()
+
+    gc.collect()
+    gc.freeze()
+
+    sock = abrir_socket(args.host, args.port)
+    logger.info(f"🚀 {args.workers} workers em {args.host}:{args.port} (pid pai {os.getpid()})")
+    Supervisor(api_ia.app, sock, args.workers).rodar()
+    logger.info("👋 Workers encerrados")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
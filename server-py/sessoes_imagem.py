@@ -0,0 +1,79 @@
+import time
+import uuid
+from collections import OrderedDict
+
+
+class SessaoImagem:
+    """Imagem já decodificada/redimensionada e recortes já codificados"""
+    __slots__ = ("imagem", "resize_info", "subimagens", "origem", "criada_em")
+
+    def __init__(self, imagem, resize_info, subimagens, origem=None):
+        self.imagem = imagem
+        self.resize_info = resize_info
+        self.subimagens = subimagens
+        self.origem = origem  # identifica o conteúdo da imagem (chave do cache de resultados)
+        self.criada_em = time.monotonic()
+
+
+class ArmazemSessoes:
+    """Guarda as imagens da detecção por `imagem_id` (TTL + limite de itens).
+
+    Permite que a classificação reutilize a imagem decodificada e os
+    recortes da detecção em vez de receber um novo upload.
+    """
+
+    def __init__(self, ttl_s=600, max_itens=64):
+        self.ttl_s = float(ttl_s)
+        self.max_itens = max(1, int(max_itens))
+        self._sessoes = OrderedDict()
+        self._acertos = 0
+        self._expiradas = 0
+
+    def guardar(self, imagem, resize_info, subimagens=None, origem=None):
+        """Registra a imagem (e recortes JPEG já codificados, por coordenadas); retorna o id"""
+        self._limpar()
+        imagem_id = uuid.uuid4().hex
+        self._sessoes[imagem_id] = SessaoImagem(imagem, resize_info, dict(subimagens or {}), origem)
+        while len(self._sessoes) > self.max_itens:
+            self._sessoes.popitem(last=False)
+        return imagem_id
+
+    def obter(self, imagem_id):
+        """Retorna a sessão ou None se não existir/expirou"""
+        sessao = self._sessoes.get(imagem_id)
+        if sessao is None:
+            return None
+        if time.monotonic() - sessao.criada_em > self.ttl_s:
+            del self._sessoes[imagem_id]
+            self._expiradas += 1
+            return None
+        self._acertos += 1
+        return sessao
+
+    def _limpar(self):
+        agora = time.monotonic()
+        while self._sessoes:
+            imagem_id, sessao = next(iter(self._sessoes.items()))
+            if agora - sessao.criada_em <= self.ttl_s:
+                break
+            del self._sessoes[imagem_id]
+            self._expiradas += 1
+
+    def estatisticas(self):
+        return {
+            "sessoes": len(self._sessoes),
+            "max_itens": self.max_itens,
+            "ttl_s": self.ttl_s,
+            "acertos": self._acertos,
+            "expiradas": self._expiradas,
+        }
+
+
+def chave_caixa(det):
+    """Coordenadas inteiras (xmin, ymin, xmax, ymax) de uma detecção"""
+    return (
+        int(det.get("xmin", 0)),
+        int(det.get("ymin", 0)),
+        int(det.get("xmax", 0)),
+        int(det.get("ymax", 0)),
+    )
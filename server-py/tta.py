@@ -0,0 +1,79 @@
+"""
+Test-time augmentation (TTA) do classificador em um único forward pass.
+
+Com ?tta=true cada recorte vira K vistas (original, espelhamentos e
+pequenas rotações, ver TTA_VIEWS) e as N x K vistas entram no mesmo lote
+do ResNet50: o custo é o de um forward pass do lote maior, não N x K
+chamadas. As probabilidades de cada caixa são a média das suas vistas; a
+concordância (fração das vistas que escolhem a mesma classe da média) e a
+variância da probabilidade da classe escolhida entre as vistas medem a
+incerteza.
+
+As vistas são geradas sobre o lote já normalizado (float32), então valem
+para os dois modos de pré-processamento.
+"""
+import cv2
+import numpy as np
+
+# Vistas fixas; rotações são `rot<graus>` (ex.: rot10, rot-10)
+VISTAS_FIXAS = ("original", "flip_h", "flip_v")
+
+
+def ler_vistas(texto):
+    """Lê TTA_VIEWS: `original,flip_h,rot10` -> ("original", "flip_h", "rot10")"""
+    vistas = tuple(dict.fromkeys(v.strip() for v in texto.split(",") if v.strip()))
+    for vista in vistas:
+        if vista not in VISTAS_FIXAS and not _angulo(vista):
+            raise ValueError(f"Vista de TTA inválida: {vista} (use {', '.join(VISTAS_FIXAS)} ou rot<graus>)")
+    if not vistas:
+        raise ValueError("TTA_VIEWS vazio")
+    return vistas
+
+
+def _angulo(vista):
+    """Graus de uma vista `rot<graus>` (None se não for rotação)"""
+    if not vista.startswith("rot"):
+        return None
+    try:
+        return float(vista[3:]) or None
+    except ValueError:
+        return None
+
+
+def _rotacionar(lote, graus):
+    h, w = lote.shape[1:3]
+    matriz = cv2.getRotationMatrix2D((w / 2, h / 2), graus, 1.0)
+    saida = np.empty_like(lote)
+    for i, recorte in enumerate(lote):
+        # Reflexão na borda: sem cantos pretos que o classificador nunca viu
+        cv2.warpAffine(recorte, matriz, (w, h), dst=saida[i], flags=cv2.INTER_LINEAR,
+                       borderMode=cv2.BORDER_REFLECT_101)
+    return saida
+
+
+def expandir_lote(lote, vistas):
+    """(N, H, W, C) -> (N x K, H, W, C), com as K vistas de cada recorte em sequência"""
+    n, k = len(lote), len(vistas)
+    saida = np.empty((n, k) + lote.shape[1:], dtype=lote.dtype)
+    for j, vista in enumerate(vistas):
+        if vista == "original":
+            saida[:, j] = lote
+        elif vista == "flip_h":
+            saida[:, j] = lote[:, :, ::-1]
+        elif vista == "flip_v":
+            saida[:, j] = lote[:, ::-1]
+        else:
+            saida[:, j] = _rotacionar(lote, _angulo(vista))
+    return saida.reshape((n * k,) + lote.shape[1:])
+
+
+def agregar(preds, k):
+    """Média das K vistas de cada recorte; retorna (probabilidades (N, C), concordância (N,), variância (N,))"""
+    preds = np.asarray(preds, dtype=np.float32)
+    por_vista = preds.reshape(len(preds) // k, k, preds.shape[-1])
+    media = por_vista.mean(axis=1)
+    escolhida = media.argmax(axis=1)
+
+    concordancia = (por_vista.argmax(axis=2) == escolhida[:, None]).mean(axis=1)
+    prob_escolhida = np.take_along_axis(por_vista, escolhida[:, None, None], axis=2)[..., 0]
+    return media, concordancia, prob_escolhida.var(axis=1)
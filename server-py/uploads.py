@@ -0,0 +1,68 @@
+"""
+Limite de tamanho dos uploads.
+
+`LimiteUpload` é um middleware ASGI que recusa com 413 um corpo maior que
+o limite: pelo Content-Length, antes de ler qualquer byte, ou contando os
+bytes recebidos (uploads chunked), interrompendo a leitura assim que o
+limite é ultrapassado. Assim uma foto gigante nunca chega a ser spoolada
+inteira pelo parser multipart.
+"""
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+# Folga para os cabeçalhos multipart e campos de formulário (ex.: deteccoes_json)
+FOLGA_FORMULARIO = 256 * 1024
+
+
+def erro_upload_grande(max_bytes):
+    return HTTPException(
+        status_code=413,
+        detail=f"Upload maior que o limite de {max_bytes / (1024 * 1024):.1f} MB"
+    )
+
+
+class LimiteUpload:
+    """Middleware ASGI: corpo das requisições limitado a `max_bytes` (+ folga do formulário)"""
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = int(max_bytes)
+        self.max_corpo = self.max_bytes + FOLGA_FORMULARIO
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+
+        cabecalhos = dict(scope["headers"])
+        tamanho = cabecalhos.get(b"content-length")
+        if tamanho is not None and tamanho.isdigit() and int(tamanho) > self.max_corpo:
+            return await self._recusar(scope, receive, send)
+
+        recebidos = 0
+
+        async def receive_limitado():
+            nonlocal recebidos
+            mensagem = await receive()
+            if mensagem["type"] == "http.request":
+                recebidos += len(mensagem.get("body", b""))
+                if recebidos > self.max_corpo:
+                    # Dentro da rota o FastAPI converte em resposta 413
+                    raise erro_upload_grande(self.max_bytes)
+            return mensagem
+
+        await self.app(scope, receive_limitado, send)
+
+    async def _recusar(self, scope, receive, send):
+        erro = erro_upload_grande(self.max_bytes)
+        resposta = JSONResponse(status_code=erro.status_code, content={"detail": erro.detail})
+        await resposta(scope, receive, send)
+
+
+async def ler_upload(file, max_bytes):
+    """Bytes do arquivo enviado, com 413 se passar de `max_bytes`"""
+    if file.size is not None and file.size > max_bytes:
+        raise erro_upload_grande(max_bytes)
+    contents = await file.read()
+    if len(contents) > max_bytes:
+        raise erro_upload_grande(max_bytes)
+    return contents